@@ -1,18 +1,26 @@
-from database import get_db_connection, dict_from_row, json_dumps
-from auth import verify_token
+from database import json_dumps
+from db_backend import get_backend
+from pagination import build_listing_query, finish_page, is_paged, PaginationError
+from cache import cached_catalog, invalidate_catalog
+from uploads import sniff_image_type
+import image_pipeline
+import image_store
+from logger import get_logger
+from middleware import authenticate
 import json
 import os
 import base64
-import time
 from decimal import Decimal
 
+log = get_logger("artwork")
+
 # Create the uploads directory if it doesn't exist
 def ensure_uploads_directory():
     """Create the uploads directory if it doesn't exist"""
     uploads_dir = os.path.join(os.path.dirname(__file__), "static", "uploads")
     if not os.path.exists(uploads_dir):
         os.makedirs(uploads_dir)
-        print(f"Created directory: {uploads_dir}")
+        log.info("Created directory: %s", uploads_dir)
 
 # Call this function to ensure directory exists
 ensure_uploads_directory()
@@ -34,7 +42,7 @@ def save_image_from_base64(base64_str, name_prefix="artwork"):
             # For format like "data:image/jpeg;base64,/9j/4AAQSk..."
             image_format, base64_data = base64_str.split(",", 1)
             if ';base64' not in image_format:
-                print("Warning: Not a valid base64 image format")
+                log.warning("Not a valid base64 image format")
                 return None
         else:
             # Assume it's just the base64 data
@@ -44,114 +52,108 @@ def save_image_from_base64(base64_str, name_prefix="artwork"):
             # Decode the base64 data
             image_data = base64.b64decode(base64_data)
         except Exception as e:
-            print(f"Failed to decode base64 data: {e}")
+            log.warning("Failed to decode base64 data: %s", e)
             return "/static/uploads/placeholder.jpg"
         
-        # Generate a unique filename based on timestamp
-        timestamp = time.strftime("%Y%m%d%H%M%S")
-        filename = f"{name_prefix}_{timestamp}.jpg"
+        # Name the file after the format of the decoded bytes
+        detected = sniff_image_type(image_data[:16])
+        if detected is None:
+            log.warning("Uploaded data is not a JPEG, PNG, GIF or WebP image")
+            return None
+        _, extension = detected
+        
+        # Identical images are stored once, named by the hash of their bytes
+        image_url = image_store.store_bytes(image_data, extension)
         
-        # Save to the uploads directory
-        uploads_dir = os.path.join(os.path.dirname(__file__), "static", "uploads")
-        if not os.path.exists(uploads_dir):
-            os.makedirs(uploads_dir)
-            
-        file_path = os.path.join(uploads_dir, filename)
-        with open(file_path, "wb") as f:
-            f.write(image_data)
+        # Thumbnails and WebP variants are generated in the background
+        image_pipeline.submit(image_url)
         
         # Return the URL path to the image (ALWAYS use the standard format)
-        return f"/static/uploads/{filename}"
+        return image_url
     except Exception as e:
-        print(f"Error saving image: {e}")
+        log.error("Error saving image: %s", e)
         return None
 
-def get_all_artworks():
-    """Get all artworks from the database"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+ARTWORKS_SELECT = """
+SELECT id, title, artist, description, price, image_url, 
+       dimensions, medium, year, status, created_at
+FROM artworks
+"""
+
+ALL_ARTWORKS_QUERY = ARTWORKS_SELECT + "ORDER BY created_at DESC"
+
+# Sorts and filters accepted by get_all_artworks()
+ARTWORK_LISTING = {
+    'id': ('id', 'id'),
+    'sorts': {
+        'newest': ('created_at', 'created_at', 'desc'),
+        'oldest': ('created_at', 'created_at', 'asc'),
+        'price_asc': ('price', 'price', 'asc'),
+        'price_desc': ('price', 'price', 'desc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'artist': ('artist', '='),
+        'status': ('status', '='),
+        'min_price': ('price', '>='),
+        'max_price': ('price', '<='),
+        'date_from': ('created_at', '>='),
+        'date_to': ('created_at', '<'),
+    },
+}
+
+def format_artwork_row(artwork):
+    """Shape an artworks row for the API (string id, normalized image URL)"""
+    # Convert id to string to match frontend expectations
+    artwork['id'] = str(artwork['id'])
+    
+    # Format image URL if needed - ALWAYS ensure it has the correct prefix.
+    # Legacy base64 values are returned as stored; migrate_images.py moves
+    # them into the image store.
+    if artwork['image_url']:
+        if not artwork['image_url'].startswith(('/static/', 'data:')) and 'base64' not in artwork['image_url']:
+            artwork['image_url'] = f"/static/uploads/{os.path.basename(artwork['image_url'])}"
+        
+        # Log the final image URL for debugging (a sample of rows only)
+        log.sample().debug("Final image URL for %s: %s", artwork['title'], artwork['image_url'])
+    artwork['imageVariants'] = image_pipeline.variant_urls(artwork['image_url'])
+    return artwork
+
+def iter_all_artworks(chunk_size=500):
+    """Yield all artworks (newest first) without building a list"""
+    for artwork in get_backend('mysql').stream(ALL_ARTWORKS_QUERY, chunk_size=chunk_size):
+        yield format_artwork_row(artwork)
+
+def get_all_artworks(params=None):
+    """Get artworks, served from the catalog cache when possible.
+
+    params are the request's query parameters: sort, the ARTWORK_LISTING
+    filters, and limit/cursor to fetch one page at a time.
+    """
+    params = params or {}
+    return cached_catalog("artworks", params, lambda: _load_artworks(params))
+
+def _load_artworks(params):
+    try:
+        query, args, page = build_listing_query(ARTWORKS_SELECT, ARTWORK_LISTING, params, is_paged(params))
+    except PaginationError as e:
+        return {"error": str(e)}
     
     try:
-        query = """
-        SELECT id, title, artist, description, price, image_url, 
-               dimensions, medium, year, status
-        FROM artworks
-        ORDER BY created_at DESC
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        rows, next_cursor = finish_page(get_backend('mysql').query(query, args), page)
         
-        artworks = []
-        for row in rows:
-            artwork = dict_from_row(row, cursor)
-            
-            # Convert id to string to match frontend expectations
-            artwork['id'] = str(artwork['id'])
-            
-            # Format image URL if needed - ALWAYS ensure it has the correct prefix
-            if artwork['image_url']:
-                # Handle base64 images
-                if artwork['image_url'].startswith('data:') or 'base64' in artwork['image_url']:
-                    # Save the base64 image to a file and get its path
-                    saved_path = save_image_from_base64(artwork['image_url'])
-                    if saved_path:
-                        # Update the database with the new path
-                        update_artwork_image(artwork['id'], saved_path)
-                        artwork['image_url'] = saved_path
-                        print(f"Converted base64 image to file: {saved_path}")
-                elif not artwork['image_url'].startswith('/static/'):
-                    artwork['image_url'] = f"/static/uploads/{os.path.basename(artwork['image_url'])}"
-                
-                # Log the final image URL for debugging
-                print(f"Final image URL for {artwork['title']}: {artwork['image_url']}")
-                
-            artworks.append(artwork)
+        artworks = [format_artwork_row(artwork) for artwork in rows]
         
-        return {"artworks": artworks}
+        result = {"artworks": artworks}
+        if page['limit']:
+            result["nextCursor"] = next_cursor
+        return result
     except Exception as e:
-        print(f"Error getting artworks: {e}")
+        log.error("Error getting artworks: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-
-def update_artwork_image(artwork_id, image_path):
-    """Update the image_url in the database for an artwork"""
-    connection = get_db_connection()
-    if connection is None:
-        return False
-    
-    cursor = connection.cursor()
-    
-    try:
-        query = """
-        UPDATE artworks
-        SET image_url = %s
-        WHERE id = %s
-        """
-        cursor.execute(query, (image_path, artwork_id))
-        connection.commit()
-        return True
-    except Exception as e:
-        print(f"Error updating artwork image: {e}")
-        return False
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def get_artwork(artwork_id):
     """Get a specific artwork by ID"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    
     try:
         query = """
         SELECT id, title, artist, description, price, image_url, 
@@ -159,86 +161,21 @@ def get_artwork(artwork_id):
         FROM artworks
         WHERE id = %s
         """
-        cursor.execute(query, (artwork_id,))
-        row = cursor.fetchone()
+        artwork = get_backend('mysql').query_one(query, (artwork_id,))
         
-        if not row:
+        if not artwork:
             return {"error": "Artwork not found"}
         
-        artwork = dict_from_row(row, cursor)
-        # Convert id to string to match frontend expectations
-        artwork['id'] = str(artwork['id'])
-        
-        # Format image URL if needed
-        if artwork['image_url']:
-            # Handle base64 images
-            if artwork['image_url'].startswith('data:') or 'base64' in artwork['image_url']:
-                # Save the base64 image to a file and get its path
-                saved_path = save_image_from_base64(artwork['image_url'])
-                if saved_path:
-                    # Update the database with the new path
-                    update_artwork_image(artwork['id'], saved_path)
-                    artwork['image_url'] = saved_path
-                    print(f"Converted base64 image to file: {saved_path}")
-            elif not artwork['image_url'].startswith('/static/'):
-                artwork['image_url'] = f"/static/uploads/{os.path.basename(artwork['image_url'])}"
-        
-        return artwork
+        return format_artwork_row(artwork)
     except Exception as e:
-        print(f"Error getting artwork: {e}")
+        log.error("Error getting artwork: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def create_artwork(auth_header, artwork_data):
     """Create a new artwork (admin only)"""
-    print(f"\n--- Create Artwork Request ---")
-    print(f"Auth Header: {auth_header}")
-    print(f"Artwork Data: {artwork_data}")
-    
-    if not auth_header:
-        print("ERROR: Authentication header missing")
-        return {"error": "Authentication required"}
-    
-    # Extract token from header - handle both formats
-    token = None
-    if auth_header.startswith('Bearer '):
-        token = auth_header[7:]
-    else:
-        parts = auth_header.split(" ")
-        if len(parts) > 1:
-            token = parts[1]
-    
-    if not token:
-        print("ERROR: No token found in header")
-        return {"error": "Invalid authentication token"}
-    
-    # Verify token and check if user is admin
-    print(f"Verifying token: {token[:20]}...")
-    payload = verify_token(token)
-    print(f"Token verification result: {payload}")
-    
-    # Check if verification returned an error
-    if isinstance(payload, dict) and "error" in payload:
-        print(f"ERROR: Token verification failed: {payload['error']}")
-        return {"error": f"Authentication failed: {payload['error']}"}
-    
-    # Check if user is admin
-    is_admin = payload.get("is_admin", False)
-    print(f"Is admin: {is_admin}")
-    
-    if not is_admin:
-        print("ERROR: Access denied - Not an admin user")
-        return {"error": "Unauthorized access: Admin privileges required"}
-    
-    # Continue with artwork creation
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    payload = authenticate(auth_header, admin=True)
+    if "error" in payload:
+        return {"error": payload["error"]}
     
     try:
         # Parse artwork_data if it's a string
@@ -246,7 +183,7 @@ def create_artwork(auth_header, artwork_data):
             try:
                 artwork_data = json.loads(artwork_data)
             except json.JSONDecodeError as e:
-                print(f"ERROR: Failed to parse artwork data: {e}")
+                log.warning("Failed to parse artwork data: %s", e)
                 return {"error": f"Invalid artwork data format: {str(e)}"}
         
         # Handle the image - convert base64 to file if needed
@@ -256,18 +193,17 @@ def create_artwork(auth_header, artwork_data):
             saved_image_path = save_image_from_base64(image_url)
             if saved_image_path:
                 image_url = saved_image_path
-                print(f"Image saved to: {saved_image_path}")
+                log.debug("Image saved to: %s", saved_image_path)
             else:
-                print("Failed to save image")
+                log.warning("Failed to save image")
                 image_url = "/placeholder.svg"
         
-        print(f"Inserting artwork data: {artwork_data}")
         query = """
         INSERT INTO artworks (title, artist, description, price, image_url,
                            dimensions, medium, year, status)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        cursor.execute(query, (
+        _, new_artwork_id = get_backend('mysql').execute(query, (
             artwork_data.get("title"),
             artwork_data.get("artist"),
             artwork_data.get("description"),
@@ -278,53 +214,22 @@ def create_artwork(auth_header, artwork_data):
             artwork_data.get("year"),
             artwork_data.get("status", "available")
         ))
-        connection.commit()
+        invalidate_catalog()
         
         # Return the newly created artwork
-        new_artwork_id = cursor.lastrowid
-        print(f"Artwork created successfully with ID: {new_artwork_id}")
+        log.info("Artwork created successfully with ID: %s", new_artwork_id)
         return get_artwork(new_artwork_id)
     except Exception as e:
-        print(f"ERROR creating artwork: {e}")
+        log.error("Error creating artwork: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def update_artwork(auth_header, artwork_id, artwork_data):
     """Update an existing artwork (admin only)"""
-    if not auth_header:
-        return {"error": "Authentication required"}
-    
-    # Extract token from header
-    token = auth_header.split(" ")[1] if len(auth_header.split(" ")) > 1 else None
-    if not token:
-        return {"error": "Invalid authentication token"}
-    
-    # Debug token verification
-    print(f"Verifying token for update_artwork: {token}")
-    
-    # Verify token and check if user is admin
-    payload = verify_token(token)
-    print(f"Token verification result: {payload}")
-    
-    # Check if verification returned an error
-    if isinstance(payload, dict) and "error" in payload:
-        return {"error": f"Token verification failed: {payload['error']}"}
-    
-    # Check if user is admin
-    is_admin = payload.get("is_admin")
-    if not is_admin:
-        print("Access denied: Not an admin user")
-        return {"error": "Unauthorized access: Not an admin"}
-    
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    payload = authenticate(auth_header, admin=True)
+    if "error" in payload:
+        return {"error": payload["error"]}
     
+    db = get_backend('mysql')
     try:
         # Handle the image - convert base64 to file if needed
         image_url = artwork_data.get("imageUrl")
@@ -333,14 +238,13 @@ def update_artwork(auth_header, artwork_id, artwork_data):
             saved_image_path = save_image_from_base64(image_url)
             if saved_image_path:
                 image_url = saved_image_path
-                print(f"Image saved to: {saved_image_path}")
+                log.debug("Image saved to: %s", saved_image_path)
             else:
-                print("Failed to save image")
+                log.warning("Failed to save image")
                 # Keep the original image URL if saving fails
-                cursor.execute("SELECT image_url FROM artworks WHERE id = %s", (artwork_id,))
-                result = cursor.fetchone()
+                result = db.query_one("SELECT image_url FROM artworks WHERE id = %s", (artwork_id,))
                 if result:
-                    image_url = result[0]
+                    image_url = result['image_url']
                 else:
                     image_url = "/placeholder.svg"
                     
@@ -350,7 +254,7 @@ def update_artwork(auth_header, artwork_id, artwork_data):
             image_url = %s, dimensions = %s, medium = %s, year = %s, status = %s
         WHERE id = %s
         """
-        cursor.execute(query, (
+        rowcount, _ = db.execute(query, (
             artwork_data.get("title"),
             artwork_data.get("artist"),
             artwork_data.get("description"),
@@ -362,69 +266,33 @@ def update_artwork(auth_header, artwork_id, artwork_data):
             artwork_data.get("status"),
             artwork_id
         ))
-        connection.commit()
+        invalidate_catalog()
         
         # Check if artwork was found and updated
-        if cursor.rowcount == 0:
+        if rowcount == 0:
             return {"error": "Artwork not found"}
         
         # Return the updated artwork
         return get_artwork(artwork_id)
     except Exception as e:
-        print(f"Error updating artwork: {e}")
+        log.error("Error updating artwork: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def delete_artwork(auth_header, artwork_id):
     """Delete an artwork (admin only)"""
-    if not auth_header:
-        return {"error": "Authentication required"}
-    
-    # Extract token from header
-    token = auth_header.split(" ")[1] if len(auth_header.split(" ")) > 1 else None
-    if not token:
-        return {"error": "Invalid authentication token"}
-    
-    # Debug token verification
-    print(f"Verifying token for delete_artwork: {token}")
-    
-    # Verify token and check if user is admin
-    payload = verify_token(token)
-    print(f"Token verification result: {payload}")
-    
-    # Check if verification returned an error
-    if isinstance(payload, dict) and "error" in payload:
-        return {"error": f"Token verification failed: {payload['error']}"}
-    
-    # Check if user is admin
-    is_admin = payload.get("is_admin")
-    if not is_admin:
-        print("Access denied: Not an admin user")
-        return {"error": "Unauthorized access: Not an admin"}
-    
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    payload = authenticate(auth_header, admin=True)
+    if "error" in payload:
+        return {"error": payload["error"]}
     
     try:
-        query = "DELETE FROM artworks WHERE id = %s"
-        cursor.execute(query, (artwork_id,))
-        connection.commit()
+        rowcount, _ = get_backend('mysql').execute("DELETE FROM artworks WHERE id = %s", (artwork_id,))
+        invalidate_catalog()
         
         # Check if artwork was found and deleted
-        if cursor.rowcount == 0:
+        if rowcount == 0:
             return {"error": "Artwork not found"}
         
         return {"success": True, "message": "Artwork deleted successfully"}
     except Exception as e:
-        print(f"Error deleting artwork: {e}")
+        log.error("Error deleting artwork: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
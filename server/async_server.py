@@ -0,0 +1,193 @@
+import io
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logger import get_logger
+
+# Engine configuration (can be overridden from the environment)
+DEFAULT_EXECUTOR_WORKERS = int(os.getenv("ASYNC_EXECUTOR_WORKERS") or 32)
+DEFAULT_IDLE_TIMEOUT = float(os.getenv("ASYNC_IDLE_TIMEOUT") or 75)
+MAX_HEADER_BYTES = 64 * 1024
+# Request bodies are buffered in memory before the handler runs
+MAX_BODY_BYTES = int(os.getenv("ASYNC_MAX_BODY_BYTES") or 16 * 1024 * 1024)
+
+log = get_logger("async_server")
+
+LENGTH_REQUIRED_RESPONSE = (
+    b"HTTP/1.1 411 Length Required\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 36\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b'{"error": "Content-Length required"}'
+)
+
+PAYLOAD_TOO_LARGE_RESPONSE = (
+    b"HTTP/1.1 413 Payload Too Large\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 38\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b'{"error": "Request body is too large"}'
+)
+
+class _AsyncRequest:
+    """Socket stand-in handed to the request handler for one buffered request"""
+
+    def __init__(self, data, wfile):
+        self.data = data
+        self.wfile = wfile
+
+    def settimeout(self, timeout):
+        pass
+
+class _StreamWriterFile(io.RawIOBase):
+    """File-like object that forwards handler output to an asyncio StreamWriter.
+
+    The handler runs in an executor thread, so every write is scheduled on the
+    event loop and waits for the transport to drain before returning.
+    """
+
+    def __init__(self, loop, writer):
+        super().__init__()
+        self.loop = loop
+        self.writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        if data:
+            asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+        return len(data)
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+def _make_handler_class(handler_class):
+    """Adapt a BaseHTTPRequestHandler subclass to process one pre-read request"""
+
+    class AsyncRequestHandler(handler_class):
+        def setup(self):
+            self.connection = self.request
+            self.rfile = io.BytesIO(self.request.data)
+            self.wfile = self.request.wfile
+
+        def handle(self):
+            self.close_connection = True
+            self.handle_one_request()
+
+        def finish(self):
+            pass
+
+    AsyncRequestHandler.__name__ = f"Async{handler_class.__name__}"
+    return AsyncRequestHandler
+
+def _content_length(head):
+    """Return (length, chunked) parsed from a raw request head"""
+    length = 0
+    chunked = False
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value.strip() or 0)
+        elif name == b"transfer-encoding" and b"chunked" in value.lower():
+            chunked = True
+    return length, chunked
+
+class AsyncHTTPServer:
+    """asyncio based HTTP/1.1 server that drives an ordinary request handler class.
+
+    Sockets are read and written on the event loop, so idle keep-alive
+    connections only cost a coroutine. Once a full request has arrived the
+    handler runs in a thread pool, which keeps database work off the loop.
+    """
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_EXECUTOR_WORKERS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.server_address = server_address
+        self.handler_class = _make_handler_class(handler_class)
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="async-handler")
+        self.loop = None
+        self._server = None
+        self.open_connections = 0
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        host, port = self.server_address
+        self._server = await asyncio.start_server(
+            self._handle_connection, host or None, port, limit=MAX_HEADER_BYTES
+        )
+        async with self._server:
+            await self._server.serve_forever()
+
+    def shutdown(self):
+        if self.loop and self._server:
+            self.loop.call_soon_threadsafe(self._server.close)
+
+    def server_close(self):
+        self.executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader, writer):
+        self.open_connections += 1
+        client_address = writer.get_extra_info("peername")
+        wfile = _StreamWriterFile(self.loop, writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+
+                try:
+                    length, chunked = _content_length(head)
+                except ValueError:
+                    length, chunked = 0, True
+                if chunked:
+                    writer.write(LENGTH_REQUIRED_RESPONSE)
+                    await writer.drain()
+                    break
+                if length > MAX_BODY_BYTES:
+                    writer.write(PAYLOAD_TOO_LARGE_RESPONSE)
+                    await writer.drain()
+                    break
+
+                try:
+                    # A client that stalls mid-body is dropped like an idle one
+                    body = await asyncio.wait_for(reader.readexactly(length), self.idle_timeout) if length else b""
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                request = _AsyncRequest(head + body, wfile)
+                close = await self.loop.run_in_executor(
+                    self.executor, self._run_handler, request, client_address
+                )
+                if close:
+                    break
+        finally:
+            self.open_connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def _run_handler(self, request, client_address):
+        """Run the handler for one request and report whether to close the connection"""
+        try:
+            handler = self.handler_class(request, client_address, self)
+            return handler.close_connection
+        except ConnectionError:
+            return True
+        except Exception as e:
+            log.exception("Error handling request from %s", client_address)
+            return True
@@ -1,41 +1,68 @@
-import hashlib
 import secrets
-from database import get_db_connection, json_dumps
-import jwt
-import datetime
+from database import json_dumps
+from db_backend import get_backend
 import os
 from decimal import Decimal
-from middleware import SECRET_KEY  # Import the shared SECRET_KEY
+# Tokens are issued here and verified by middleware.authenticate()
+from middleware import generate_token
+from passwords import hash_password, verify_password, verify_dummy, PasswordHasherBusy
+from logger import get_logger
 
-def hash_password(password):
-    """Hash a password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+log = get_logger("auth")
+
+def _check_credentials(table, email, password):
+    """Return (id, name) of the users/admins row whose password matches, or None.
+
+    The password is checked after the connection has gone back to the pool,
+    and a legacy or outdated hash is replaced with one at the current cost.
+    """
+    row = get_backend('mysql').query_one(f"SELECT id, name, password FROM {table} WHERE email = %s", (email,))
+    
+    if row is None:
+        verify_dummy(password)
+        return None
+    
+    matches, rehash = verify_password(password, row['password'])
+    if not matches:
+        return None
+    if rehash:
+        _upgrade_password_hash(table, row['id'], row['password'], password)
+    return row['id'], row['name']
+
+def _upgrade_password_hash(table, account_id, old_hash, password):
+    """Store a current hash for a password that was just verified"""
+    new_hash = hash_password(password)
+    try:
+        # Skipped if the password was changed in the meantime
+        get_backend('mysql').execute(f"UPDATE {table} SET password = %s WHERE id = %s AND password = %s",
+                                     (new_hash, account_id, old_hash))
+        log.info("Upgraded password hash", table=table, account_id=account_id)
+    except Exception as e:
+        log.error("Error upgrading password hash: %s", e)
 
 def register_user(name, email, password, phone):
     """Register a new user"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    hashed_password = hash_password(password)
+    try:
+        # Hashed before taking a database connection, which it would hold idle
+        hashed_password = hash_password(password)
+    except PasswordHasherBusy as e:
+        return {"error": str(e)}
     
     try:
-        # Check if email already exists
-        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-        if cursor.fetchone():
-            return {"error": "Email already registered"}
-        
-        # Insert the new user
-        query = """
-        INSERT INTO users (name, email, password, phone)
-        VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query, (name, email, hashed_password, phone))
-        connection.commit()
-        
-        # Get the new user ID
-        user_id = cursor.lastrowid
+        with get_backend('mysql').transaction() as session:
+            # Check if email already exists
+            if session.query_one("SELECT id FROM users WHERE email = %s", (email,)):
+                return {"error": "Email already registered"}
+            
+            # Insert the new user
+            query = """
+            INSERT INTO users (name, email, password, phone)
+            VALUES (%s, %s, %s, %s)
+            """
+            session.execute(query, (name, email, hashed_password, phone))
+            
+            # Get the new user ID
+            user_id = session.lastrowid
         
         # Generate token for the new user
         token = generate_token(user_id, name, False)
@@ -46,28 +73,13 @@ def register_user(name, email, password, phone):
             "name": name
         }
     except Exception as e:
-        print(f"Error registering user: {e}")
+        log.error("Error registering user: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def login_user(email, password):
     """Login a user"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    hashed_password = hash_password(password)
-    
     try:
-        # Check user credentials
-        query = "SELECT id, name FROM users WHERE email = %s AND password = %s"
-        cursor.execute(query, (email, hashed_password))
-        user = cursor.fetchone()
-        
+        user = _check_credentials("users", email, password)
         if not user:
             return {"error": "Invalid credentials"}
         
@@ -81,28 +93,13 @@ def login_user(email, password):
             "name": name
         }
     except Exception as e:
-        print(f"Error logging in user: {e}")
+        log.error("Error logging in user: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def login_admin(email, password):
     """Login an admin"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    hashed_password = hash_password(password)
-    
     try:
-        # Check admin credentials
-        query = "SELECT id, name FROM admins WHERE email = %s AND password = %s"
-        cursor.execute(query, (email, hashed_password))
-        admin = cursor.fetchone()
-        
+        admin = _check_credentials("admins", email, password)
         if not admin:
             return {"error": "Invalid admin credentials"}
         
@@ -110,7 +107,7 @@ def login_admin(email, password):
         admin_id, name = admin
         token = generate_token(admin_id, name, True)
         
-        print(f"Admin login successful: {name}, admin_id: {admin_id}, token: {token[:20]}...")
+        log.info("Admin login", admin_id=admin_id)
         
         return {
             "token": token,
@@ -118,75 +115,32 @@ def login_admin(email, password):
             "name": name
         }
     except Exception as e:
-        print(f"Error logging in admin: {e}")
+        log.error("Error logging in admin: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-
-def generate_token(user_id, name, is_admin):
-    """Generate a JWT token for authentication"""
-    payload = {
-        "sub": str(user_id),  # Ensure user_id is converted to string
-        "name": name,
-        "is_admin": is_admin,
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1)
-    }
-    
-    print(f"Generating token with payload: {payload}")
-    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
-    return token
-
-def verify_token(token):
-    """Verify a JWT token"""
-    try:
-        print(f"Verifying token: {token[:20]}...")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        print(f"Token decoded successfully: {payload}")
-        return payload
-    except jwt.ExpiredSignatureError:
-        print("Token verification failed: Token expired")
-        return {"error": "Token expired"}
-    except jwt.InvalidTokenError as e:
-        print(f"Token verification failed: Invalid token - {str(e)}")
-        return {"error": f"Invalid token: {str(e)}"}
-    except Exception as e:
-        print(f"Unexpected error during token verification: {str(e)}")
-        return {"error": f"Token verification error: {str(e)}"}
 
 def create_admin(name, email, password):
     """Create a new admin (called from terminal/script)"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
     hashed_password = hash_password(password)
     
     try:
-        # Check if email already exists
-        cursor.execute("SELECT id FROM admins WHERE email = %s", (email,))
-        if cursor.fetchone():
-            return {"error": "Admin email already exists"}
-        
-        # Insert the new admin
-        query = """
-        INSERT INTO admins (name, email, password)
-        VALUES (%s, %s, %s)
-        """
-        cursor.execute(query, (name, email, hashed_password))
-        connection.commit()
+        with get_backend('mysql').transaction() as session:
+            # Check if email already exists
+            if session.query_one("SELECT id FROM admins WHERE email = %s", (email,)):
+                return {"error": "Admin email already exists"}
+            
+            # Insert the new admin
+            query = """
+            INSERT INTO admins (name, email, password)
+            VALUES (%s, %s, %s)
+            """
+            session.execute(query, (name, email, hashed_password))
+            admin_id = session.lastrowid
         
         return {
             "success": True,
-            "admin_id": cursor.lastrowid,
+            "admin_id": admin_id,
             "name": name
         }
     except Exception as e:
-        print(f"Error creating admin: {e}")
+        log.error("Error creating admin: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
@@ -0,0 +1,140 @@
+# Runs the same workload against each database backend and compares timings.
+#
+#   python bench_backends.py                       # SQLite, on a temporary file
+#   python bench_backends.py --backends sqlite --rows 20000
+#   python bench_backends.py --backends sqlite,mysql --mysql-database bench
+#
+# The workload drops and recreates its table, so it never runs against the
+# application's data: SQLite gets a temporary file unless --sqlite-file is
+# given, and MySQL is only used with an explicit scratch --mysql-database.
+import os
+import shutil
+import argparse
+import random
+import tempfile
+import time
+from db_backend import get_backend, SQLiteBackend
+
+# Scratch table used by the benchmark, created and dropped on every run
+CREATE_TABLE = {
+    'mysql': """
+        CREATE TABLE IF NOT EXISTS bench_items (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            artist VARCHAR(255) NOT NULL,
+            price DECIMAL(10, 2) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_bench_items_artist (artist)
+        )
+    """,
+    'sqlite': """
+        CREATE TABLE IF NOT EXISTS bench_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            artist TEXT NOT NULL,
+            price REAL NOT NULL,
+            status TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+CREATE_INDEX = {
+    'mysql': None,
+    'sqlite': "CREATE INDEX IF NOT EXISTS idx_bench_items_artist ON bench_items (artist)",
+}
+
+ARTISTS = [f"Artist {i}" for i in range(50)]
+
+def timed(label, results, func, operations):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    results.append((label, operations, elapsed))
+
+def run_workload(backend, rows, lookups):
+    """Run the benchmark workload on one backend and return [(label, ops, seconds)]"""
+    results = []
+    backend.execute("DROP TABLE IF EXISTS bench_items")
+    backend.execute(CREATE_TABLE[backend.name])
+    if CREATE_INDEX[backend.name]:
+        backend.execute(CREATE_INDEX[backend.name])
+
+    items = [(random.choice(ARTISTS), round(random.uniform(100, 5000), 2), 'available') for _ in range(rows)]
+    ids = random.sample(range(1, rows + 1), min(lookups, rows))
+
+    def bulk_insert():
+        backend.executemany("INSERT INTO bench_items (artist, price, status) VALUES (%s, %s, %s)", items)
+
+    def point_selects():
+        for item_id in ids:
+            backend.query_one("SELECT id, artist, price, status FROM bench_items WHERE id = %s", (item_id,))
+
+    def filtered_selects():
+        for artist in ARTISTS:
+            backend.query("SELECT id, price FROM bench_items WHERE artist = %s ORDER BY id DESC LIMIT 20", (artist,))
+
+    def full_scan():
+        backend.query("SELECT id, artist, price, status FROM bench_items ORDER BY id DESC")
+
+    def single_updates():
+        for item_id in ids:
+            backend.execute("UPDATE bench_items SET status = %s WHERE id = %s", ('sold', item_id))
+
+    timed("bulk insert", results, bulk_insert, rows)
+    timed("point select", results, point_selects, len(ids))
+    timed("filtered page", results, filtered_selects, len(ARTISTS))
+    timed("full listing", results, full_scan, 1)
+    timed("single update", results, single_updates, len(ids))
+
+    backend.execute("DROP TABLE IF EXISTS bench_items")
+    return results
+
+def open_backend(name, args, scratch_dir):
+    """Return the backend to benchmark, pointed at scratch storage"""
+    if name == 'sqlite':
+        return SQLiteBackend(args.sqlite_file or os.path.join(scratch_dir, 'bench.db'))
+    if name == 'mysql':
+        # Imported lazily so SQLite-only runs do not need mysql.connector
+        import database
+        if not args.mysql_database:
+            raise ValueError("pass --mysql-database with a scratch database to benchmark MySQL")
+        if args.mysql_database == database.DB_CONFIG['database']:
+            raise ValueError(f"refusing to drop tables in the application database '{args.mysql_database}'")
+        # Set before the shared pool is created by the first query
+        database.DB_CONFIG['database'] = args.mysql_database
+        return get_backend('mysql')
+    return get_backend(name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare database backends on the same workload")
+    parser.add_argument("--backends", default="sqlite", help="Comma separated backend names")
+    parser.add_argument("--rows", type=int, default=5000, help="Rows inserted by the workload")
+    parser.add_argument("--lookups", type=int, default=1000, help="Point selects and updates to run")
+    parser.add_argument("--sqlite-file", help="SQLite file to use (default: a temporary file)")
+    parser.add_argument("--mysql-database", help="Existing scratch MySQL database (required for mysql)")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix='bench_backends_')
+    try:
+        for name in args.backends.split(","):
+            name = name.strip()
+            try:
+                backend = open_backend(name, args, scratch_dir)
+                try:
+                    results = run_workload(backend, args.rows, args.lookups)
+                finally:
+                    if isinstance(backend, SQLiteBackend):
+                        backend.close_all()
+            except Exception as e:
+                print(f"\n[{name}] skipped: {e}")
+                continue
+
+            print(f"\n[{name}]")
+            print(f"{'operation':<16}{'ops':>8}{'total ms':>12}{'ops/sec':>12}")
+            for label, operations, elapsed in results:
+                rate = operations / elapsed if elapsed else float('inf')
+                print(f"{label:<16}{operations:>8}{elapsed * 1000:>12.1f}{rate:>12.0f}")
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
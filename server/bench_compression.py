@@ -0,0 +1,63 @@
+# Compares CPU time and bytes saved for each response compression setting.
+#
+#   python bench_compression.py                    # synthetic catalog of 500 artworks
+#   python bench_compression.py --artworks 2000 --repeat 20
+import argparse
+import random
+import time
+from compression import compress, brotli
+from serialization import dumps_bytes
+
+ARTISTS = [f"Artist {i}" for i in range(50)]
+MEDIUMS = ["Oil on canvas", "Acrylic", "Watercolour", "Mixed media", "Photography"]
+
+def sample_catalog(count):
+    """Build a catalog response body shaped like GET /api/artworks"""
+    artworks = []
+    for i in range(1, count + 1):
+        artworks.append({
+            "id": str(i),
+            "title": f"Untitled study no. {i}",
+            "artist": random.choice(ARTISTS),
+            "description": "A work exploring light, texture and memory across the Kenyan landscape. " * 2,
+            "price": round(random.uniform(5000, 250000), 2),
+            "imageUrl": f"/static/uploads/artwork_{1700000000 + i}.jpg",
+            "dimensions": f"{random.randint(20, 200)} x {random.randint(20, 200)} cm",
+            "medium": random.choice(MEDIUMS),
+            "year": random.randint(1990, 2024),
+            "status": random.choice(["available", "available", "sold"]),
+        })
+    return dumps_bytes({"artworks": artworks})
+
+def settings():
+    yield "gzip", 1
+    yield "gzip", 6
+    yield "gzip", 9
+    if brotli is not None:
+        yield "br", 1
+        yield "br", 5
+        yield "br", 11
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response compression settings")
+    parser.add_argument("--artworks", type=int, default=500, help="Artworks in the sample catalog")
+    parser.add_argument("--repeat", type=int, default=10, help="Compressions timed per setting")
+    args = parser.parse_args()
+
+    body = sample_catalog(args.artworks)
+    print(f"catalog JSON: {len(body)} bytes ({args.artworks} artworks)")
+    if brotli is None:
+        print("brotli is not installed; only gzip is measured")
+
+    print(f"{'encoding':<10}{'level':>6}{'bytes':>10}{'ratio':>8}{'ms/op':>10}{'MB/s':>10}")
+    for encoding, level in settings():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            compressed = compress(body, encoding, level)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        throughput = len(body) / elapsed / 1e6 if elapsed else float('inf')
+        print(f"{encoding:<10}{level:>6}{len(compressed):>10}{len(body) / len(compressed):>8.1f}"
+              f"{elapsed * 1000:>10.2f}{throughput:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Measures login throughput (password checks per second) for each hashing
+# cost setting, to size SCRYPT_N / PBKDF2_ITERATIONS and PASSWORD_HASH_WORKERS
+# for peak login traffic.
+#
+#   python bench_password_hashing.py                  # workers = PASSWORD_HASH_WORKERS
+#   python bench_password_hashing.py --workers 8 --logins 64
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from passwords import encode, check, PASSWORD_HASH_WORKERS
+
+def settings():
+    for n in (2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16):
+        yield 'scrypt', {'n': n, 'r': 8, 'p': 1}
+    for iterations in (100000, 310000, 600000):
+        yield 'pbkdf2_sha256', {'iterations': iterations}
+
+def describe(scheme, params):
+    if scheme == 'scrypt':
+        memory = 128 * params['n'] * params['r'] / (1024 * 1024)
+        return f"scrypt n=2^{params['n'].bit_length() - 1} r={params['r']} ({memory:.0f} MiB)"
+    return f"pbkdf2 {params['iterations']} iterations"
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare password hashing cost settings")
+    parser.add_argument("--workers", type=int, default=PASSWORD_HASH_WORKERS, help="Concurrent hashes")
+    parser.add_argument("--logins", type=int, default=32, help="Password checks timed per setting")
+    args = parser.parse_args()
+
+    print(f"{args.logins} logins per setting, {args.workers} hashing workers")
+    print(f"{'setting':<36}{'ms/login':>10}{'logins/s':>10}{'logins/s @workers':>20}")
+    for scheme, params in settings():
+        stored = encode("correct horse battery staple", scheme, params)
+
+        start = time.perf_counter()
+        for _ in range(args.logins):
+            check("correct horse battery staple", stored)
+        single = (time.perf_counter() - start) / args.logins
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda _: check("correct horse battery staple", stored), range(args.logins)))
+            parallel = (time.perf_counter() - start) / args.logins
+
+        print(f"{describe(scheme, params):<36}{single * 1000:>10.1f}{1 / single:>10.1f}{1 / parallel:>20.1f}")
+
+if __name__ == "__main__":
+    main()
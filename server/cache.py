@@ -0,0 +1,167 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from serialization import dumps_bytes
+
+# Catalog cache configuration (a TTL of 0 disables caching)
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL") or 60)
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES") or 256)
+
+class TTLCache:
+    """Thread-safe read-through cache with a TTL and LRU eviction.
+
+    Values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=CATALOG_CACHE_MAX_ENTRIES, ttl=CATALOG_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a load that raced with a write is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return (True, value) for a live entry, otherwise (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, generation=None, ttl=None):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, cacheable=lambda value: True, ttl=None):
+        """Return the cached value for key, calling loader() on a miss.
+
+        ttl, if given, is called with the loaded value and returns the
+        seconds to keep it (instead of the cache's ttl).
+        """
+        if self.ttl <= 0:
+            return loader()
+        found, value = self.get(key)
+        if found:
+            return value
+        generation = self._generation
+        value = loader()
+        if cacheable(value):
+            self.put(key, value, generation, ttl(value) if ttl else None)
+        return value
+
+    def invalidate(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+# Artwork and exhibition listings, shared by the MySQL modules and server.py
+catalog_cache = TTLCache()
+
+# Encoded JSON bodies of the public catalog GET endpoints
+response_cache = TTLCache()
+
+# Bumped on every catalog write. The random prefix keeps ETags issued by
+# different server processes (or before a restart) from ever matching.
+_version_prefix = os.urandom(4).hex()
+_version = 0
+_version_lock = threading.Lock()
+
+# variants holds compressed copies of body, keyed by content coding
+CachedResponse = namedtuple('CachedResponse', 'body status etag variants')
+
+def catalog_key(name, params=None):
+    """Cache key for a catalog listing and its query parameters"""
+    return (name,) + tuple(sorted((params or {}).items()))
+
+def is_cacheable(result):
+    """Only successful results are cached"""
+    if isinstance(result, tuple):
+        result = result[0]
+    return "error" not in result
+
+def cached_catalog(name, params, loader):
+    """Read-through lookup of a catalog listing"""
+    return catalog_cache.get_or_load(catalog_key(name, params), loader, is_cacheable)
+
+def invalidate_catalog():
+    """Call after any write that changes artworks or exhibitions"""
+    global _version
+    with _version_lock:
+        _version += 1
+    catalog_cache.invalidate()
+    response_cache.invalidate()
+
+def catalog_version():
+    return f"{_version_prefix}.{_version}"
+
+def make_etag(body, version=None):
+    """Strong ETag from the catalog version and a digest of the body"""
+    digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return f'"{version or catalog_version()}-{digest}"'
+
+def etag_matches(if_none_match, etag):
+    """Evaluate an If-None-Match header against an ETag"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
+
+def cached_response(key, render):
+    """Return a CachedResponse for key, calling render() -> (data, status) on a miss.
+
+    Only 200 responses are stored; the body is encoded once and reused.
+    """
+    version = catalog_version()
+
+    def load():
+        data, status = render()
+        body = dumps_bytes(data)
+        return CachedResponse(body, status, make_etag(body, version) if status == 200 else None, {})
+
+    return response_cache.get_or_load(key, load, lambda response: response.status == 200)
+
+def catalog_cache_stats():
+    return {"rows": catalog_cache.stats(), "responses": response_cache.stats()}
@@ -0,0 +1,122 @@
+import os
+import gzip
+import zlib
+import threading
+
+# brotli is used when it is installed (pip install brotli); gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES") or 1024)
+# Levels for responses compressed on the fly (gzip 1-9, brotli 0-11)
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL") or 6)
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY") or 5)
+# Static variants are compressed once, so they use the highest levels
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+# Where precompressed copies of static files are kept
+PRECOMPRESSED_DIR = os.getenv("PRECOMPRESSED_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".precompressed"
+)
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+# Preferred order when the client accepts several encodings equally
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+FILE_EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+_precompress_lock = threading.Lock()
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def negotiate(accept_encoding, encodings=SUPPORTED_ENCODINGS):
+    """Pick the best encoding the client accepts, or None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    best = None
+    best_weight = 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+def compress(body, encoding, level=None):
+    """Compress bytes with 'gzip' or 'br'"""
+    if encoding == 'br':
+        return brotli.compress(bytes(body), quality=BROTLI_QUALITY if level is None else level)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output (and anything derived from it) deterministic
+        return gzip.compress(bytes(body), compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+class StreamCompressor:
+    """Incremental compressor for chunked responses"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(bytes(data))
+        return self._compressor.compress(bytes(data))
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+def precompressed_path(source_path, encoding, source_root):
+    """Return the path of a compressed copy of a static file, creating it if needed.
+
+    The copy is rebuilt whenever the source file is newer.
+    """
+    relative = os.path.relpath(source_path, source_root)
+    target = os.path.join(PRECOMPRESSED_DIR, relative + FILE_EXTENSIONS[encoding])
+    source_mtime = os.stat(source_path).st_mtime_ns
+    try:
+        if os.stat(target).st_mtime_ns == source_mtime:
+            return target
+    except FileNotFoundError:
+        pass
+
+    with _precompress_lock:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(source_path, 'rb') as file:
+            level = STATIC_BROTLI_QUALITY if encoding == 'br' else STATIC_GZIP_LEVEL
+            data = compress(file.read(), encoding, level)
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        # The copy carries the source's mtime so staleness is a single stat
+        os.utime(temp_path, ns=(source_mtime, source_mtime))
+        os.replace(temp_path, target)
+    return target
@@ -1,12 +1,8 @@
 
-import hashlib
 import sys
 from db_setup import get_db_connection
 from mysql.connector import Error
-
-def hash_password(password):
-    """Hash a password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+from passwords import hash_password
 
 def create_admin(name, email, password):
     """Create a new admin user"""
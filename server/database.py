@@ -1,18 +1,13 @@
 
 import mysql.connector
 from mysql.connector import Error
-import json
-from decimal import Decimal
-from datetime import datetime
-
-# Custom JSON encoder to handle Decimal types and datetime objects
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super(DecimalEncoder, self).default(obj)
+import os
+import time
+import threading
+from collections import deque
+from serialization import dumps
+from db_backend import get_backend
+from logger import get_logger
 
 # Database connection configuration
 DB_CONFIG = {
@@ -22,136 +17,295 @@ DB_CONFIG = {
     'database': 'artgallery'
 }
 
+# Connection pool configuration
+POOL_CONFIG = {
+    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+    'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),  # seconds
+    'wait_timeout': float(os.environ.get('DB_POOL_WAIT_TIMEOUT', 5)),  # seconds
+    'ping_interval': float(os.environ.get('DB_POOL_PING_INTERVAL', 30)),  # seconds idle before a health check
+}
+
+log = get_logger("database")
+
+class PooledConnection:
+    """A checked-out pool connection that behaves like a mysql.connector connection.
+
+    close() returns the connection to the pool instead of closing the socket,
+    so existing `finally: connection.close()` blocks keep working unchanged.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise Error("Connection has already been returned to the pool")
+        return getattr(self._raw, name)
+
+    def is_connected(self):
+        # The connection was health checked on checkout, so avoid a ping here
+        return self._raw is not None
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections.
+
+    Idle connections are reused most-recently-used first. A connection that
+    has been idle longer than ping_interval is pinged before it is handed
+    out, and connections older than max_lifetime are replaced.
+    """
+
+    def __init__(self, config, min_size=2, max_size=10, max_lifetime=1800,
+                 wait_timeout=5, ping_interval=30):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, created_at, last_used)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'connect_errors': 0,
+        }
+
+    def _connect(self):
+        try:
+            connection = mysql.connector.connect(**self.config)
+        except Error:
+            with self._cond:
+                self._size -= 1
+                self._stats['connect_errors'] += 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    def fill(self):
+        """Open connections until the pool holds min_size of them"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            connection = self._connect()
+            now = time.monotonic()
+            self.release(connection, now)
+
+    def acquire(self):
+        """Check out a healthy connection, waiting up to wait_timeout for one to free up"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            entry = None
+            with self._cond:
+                waited_since = None
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise Error(f"Connection pool exhausted ({self.max_size} connections in use)")
+                    if waited_since is None:
+                        waited_since = time.monotonic()
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                if waited_since is not None:
+                    self._stats['wait_time'] += time.monotonic() - waited_since
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+
+            now = time.monotonic()
+            if entry is None:
+                connection = self._connect()
+                created_at = now
+            else:
+                connection, created_at, last_used = entry
+                if now - created_at > self.max_lifetime:
+                    self._discard(connection)
+                    continue
+                if now - last_used > self.ping_interval and not connection.is_connected():
+                    with self._cond:
+                        self._stats['health_check_failures'] += 1
+                    self._discard(connection)
+                    continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+            return PooledConnection(self, connection, created_at)
+
+    def release(self, connection, created_at):
+        """Return a connection to the pool, rolling back any open transaction"""
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except Error:
+            self._discard(connection)
+            return
+
+        if time.monotonic() - created_at > self.max_lifetime:
+            self._discard(connection)
+            return
+
+        with self._cond:
+            self._idle.append((connection, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        """Return pool size and usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max_size'] = self.max_size
+        return stats
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+                try:
+                    pool.fill()
+                except Error as e:
+                    log.error("Error pre-filling MySQL connection pool: %s", e)
+                _pool = pool
+    return _pool
+
 def get_db_connection():
-    """Create and return a database connection"""
+    """Check out a database connection from the pool.
+
+    Call close() on the returned connection to hand it back to the pool.
+    """
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        if connection.is_connected():
-            return connection
+        return get_pool().acquire()
     except Error as e:
-        print(f"Error connecting to MySQL: {e}")
+        log.error("Error connecting to MySQL: %s", e)
     return None
 
+def pool_stats():
+    """Return usage counters for the shared connection pool"""
+    return get_pool().stats()
+
 # Helper function to safely encode JSON with Decimal and datetime values
 def json_dumps(data):
     """Safely convert data to JSON string, handling Decimal and datetime types"""
-    return json.dumps(data, cls=DecimalEncoder)
-
-def dict_from_row(row, cursor):
-    """Convert a database row to a dictionary"""
-    result = {cursor.column_names[i]: value for i, value in enumerate(row)}
-    # Convert Decimal objects to float for JSON serialization
-    for key, value in result.items():
-        if isinstance(value, Decimal):
-            result[key] = float(value)
-    return result
+    return dumps(data)
 
 # Contact message functions
 def save_contact_message(name, email, phone, message, source='contact_form'):
     """Save a new contact message"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
     try:
-        cursor = connection.cursor()
-        
-        # Check if contact_messages table has source column
-        cursor.execute("SHOW COLUMNS FROM contact_messages LIKE 'source'")
-        source_exists = cursor.fetchone()
-        
-        if not source_exists:
-            # Add source column if it doesn't exist
-            print("Adding source column to contact_messages table")
-            cursor.execute("ALTER TABLE contact_messages ADD COLUMN source VARCHAR(50) DEFAULT 'contact_form'")
-            connection.commit()
-        
-        # Insert the message into the database
-        query = """
-        INSERT INTO contact_messages (name, email, phone, message, source, status)
-        VALUES (%s, %s, %s, %s, %s, 'new')
-        """
-        cursor.execute(query, (name, email, phone, message, source))
-        connection.commit()
+        with get_backend('mysql').transaction() as session:
+            # Check if contact_messages table has source column
+            source_exists = session.query_one("SHOW COLUMNS FROM contact_messages LIKE 'source'")
+            
+            if not source_exists:
+                # Add source column if it doesn't exist (DDL commits on its own)
+                log.info("Adding source column to contact_messages table")
+                session.execute("ALTER TABLE contact_messages ADD COLUMN source VARCHAR(50) DEFAULT 'contact_form'")
+            
+            # Insert the message into the database
+            query = """
+            INSERT INTO contact_messages (name, email, phone, message, source, status)
+            VALUES (%s, %s, %s, %s, %s, 'new')
+            """
+            session.execute(query, (name, email, phone, message, source))
+            message_id = session.lastrowid
         
-        message_id = cursor.lastrowid
-        print(f"Inserted new message with ID: {message_id}")
+        log.debug("Inserted new message with ID: %s", message_id)
         
         return {"success": True, "message_id": message_id}
     
-    except Error as e:
-        print(f"Error saving contact message: {e}")
+    except Exception as e:
+        log.error("Error saving contact message: %s", e)
         return {"error": str(e)}
-    
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+
+ALL_CONTACT_MESSAGES_QUERY = """
+SELECT * FROM contact_messages
+ORDER BY date DESC
+"""
+
+def iter_contact_messages(chunk_size=500):
+    """Yield all contact messages (newest first) without building a list"""
+    return get_backend('mysql').stream(ALL_CONTACT_MESSAGES_QUERY, chunk_size=chunk_size)
 
 def get_all_contact_messages():
     """Get all contact messages"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
     try:
-        cursor = connection.cursor()
-        
         # Get all messages ordered by date (newest first)
-        query = """
-        SELECT * FROM contact_messages
-        ORDER BY date DESC
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        messages = get_backend('mysql').query(ALL_CONTACT_MESSAGES_QUERY)
         
-        messages = []
-        for row in rows:
-            message_dict = dict_from_row(row, cursor)
-            messages.append(message_dict)
-        
-        print(f"Retrieved {len(messages)} messages")
+        log.debug("Retrieved %s messages", len(messages))
         return {"messages": messages}
     
-    except Error as e:
-        print(f"Error getting contact messages: {e}")
+    except Exception as e:
+        log.error("Error getting contact messages: %s", e)
         return {"error": str(e)}
-    
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def update_message_status(message_id, status):
     """Update the status of a message"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
     try:
-        cursor = connection.cursor()
-        
         # Update the message status
         query = """
         UPDATE contact_messages
         SET status = %s
         WHERE id = %s
         """
-        cursor.execute(query, (status, message_id))
-        connection.commit()
+        rowcount, _ = get_backend('mysql').execute(query, (status, message_id))
         
-        if cursor.rowcount == 0:
-            print(f"Message with ID {message_id} not found")
+        if rowcount == 0:
+            log.info("Message with ID %s not found", message_id)
             return {"error": "Message not found"}
         
-        print(f"Updated message {message_id} status to {status}")
+        log.info("Updated message %s status to %s", message_id, status)
         return {"success": True, "message_id": message_id, "status": status}
     
-    except Error as e:
-        print(f"Error updating message status: {e}")
+    except Exception as e:
+        log.error("Error updating message status: %s", e)
         return {"error": str(e)}
-    
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
@@ -0,0 +1,253 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from sqlite_backend import get_thread_connections
+
+# Which engine get_backend() returns by default: "mysql" or "sqlite"
+DB_BACKEND = os.getenv("DB_BACKEND") or 'mysql'
+DATABASE_FILE = os.getenv("DATABASE_FILE") or 'database.db'
+
+# %s placeholders outside of quoted string literals
+_PLACEHOLDER_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|%s""")
+
+@lru_cache(maxsize=512)
+def translate_placeholders(query, placeholder):
+    """Rewrite %s placeholders in a query to another paramstyle (e.g. '?')"""
+    if placeholder == '%s':
+        return query
+    return _PLACEHOLDER_PATTERN.sub(lambda m: m.group(1) or placeholder, query)
+
+class Session:
+    """Cursor wrapper used inside Backend.transaction().
+
+    Queries are always written with %s placeholders and translated for the
+    backend they run on.
+    """
+
+    def __init__(self, backend, connection, cursor):
+        self.backend = backend
+        self.connection = connection
+        self.cursor = cursor
+
+    def execute(self, query, params=()):
+        self.cursor.execute(self.backend.translate(query), params)
+        return self.cursor
+
+    def executemany(self, query, seq_of_params):
+        self.cursor.executemany(self.backend.translate(query), seq_of_params)
+        return self.cursor
+
+    def query(self, query, params=()):
+        """Run a SELECT and return every row as a dict"""
+        self.execute(query, params)
+        return [self.backend.row_to_dict(self.cursor, row) for row in self.cursor.fetchall()]
+
+    def query_one(self, query, params=()):
+        """Run a SELECT and return the first row as a dict, or None"""
+        self.execute(query, params)
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        # Drain anything left so the connection can be reused
+        self.cursor.fetchall()
+        return self.backend.row_to_dict(self.cursor, row)
+
+    def iterate(self, query, params=(), chunk_size=500):
+        """Yield rows as dicts, fetching chunk_size rows at a time"""
+        self.execute(query, params)
+        while True:
+            rows = self.cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield self.backend.row_to_dict(self.cursor, row)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+class Backend:
+    """Common query API over a database engine"""
+
+    name = None
+    placeholder = '%s'
+
+    def connect(self):
+        """Return a connection whose close() hands it back for reuse"""
+        raise NotImplementedError
+
+    def cursor(self, connection, buffered=True):
+        return connection.cursor()
+
+    def row_to_dict(self, cursor, row):
+        raise NotImplementedError
+
+    def begin(self, connection, cursor, lock):
+        pass
+
+    def translate(self, query):
+        return translate_placeholders(query, self.placeholder)
+
+    @contextmanager
+    def transaction(self, lock=False):
+        """Run a block in one transaction on one connection.
+
+        Commits when the block finishes and rolls back if it raises. Pass
+        lock=True when the block will lock rows it is about to update.
+        """
+        connection = self.connect()
+        if connection is None:
+            raise ConnectionError(f"Database connection failed ({self.name})")
+        cursor = self.cursor(connection)
+        try:
+            self.begin(connection, cursor, lock)
+            yield Session(self, connection, cursor)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+    def query(self, query, params=()):
+        with self.transaction() as session:
+            return session.query(query, params)
+
+    def query_one(self, query, params=()):
+        with self.transaction() as session:
+            return session.query_one(query, params)
+
+    def execute(self, query, params=()):
+        """Run a write statement and return (rowcount, lastrowid)"""
+        with self.transaction() as session:
+            session.execute(query, params)
+            return session.rowcount, session.lastrowid
+
+    def executemany(self, query, seq_of_params):
+        with self.transaction() as session:
+            session.executemany(query, seq_of_params)
+            return session.rowcount
+
+    def stream(self, query, params=(), chunk_size=500):
+        """Run a query now and return an iterator over its rows as dicts.
+
+        Rows are fetched chunk_size at a time, and the connection is held
+        until the iterator is exhausted or closed.
+        """
+        connection = self.connect()
+        if connection is None:
+            raise ConnectionError(f"Database connection failed ({self.name})")
+        session = Session(self, connection, self.cursor(connection, buffered=False))
+        try:
+            session.execute(query, params)
+        except Exception:
+            self._release(session)
+            raise
+
+        def rows():
+            try:
+                while True:
+                    batch = session.cursor.fetchmany(chunk_size)
+                    if not batch:
+                        break
+                    for row in batch:
+                        yield self.row_to_dict(session.cursor, row)
+            finally:
+                self._release(session)
+
+        return rows()
+
+    def _release(self, session):
+        try:
+            session.cursor.close()
+        except Exception:
+            # Unread rows left behind by an early exit; the pool discards the connection
+            pass
+        session.connection.close()
+
+class MySQLBackend(Backend):
+    """MySQL through the shared connection pool in database.py"""
+
+    name = 'mysql'
+    placeholder = '%s'
+
+    def __init__(self):
+        # Imported lazily so SQLite-only deployments do not need mysql.connector
+        import database
+        self._database = database
+
+    def connect(self):
+        return self._database.get_db_connection()
+
+    def cursor(self, connection, buffered=True):
+        return connection.cursor(buffered=buffered)
+
+    def row_to_dict(self, cursor, row):
+        return dict(zip(cursor.column_names, row))
+
+    def begin(self, connection, cursor, lock):
+        if lock:
+            connection.start_transaction()
+
+    def pool_stats(self):
+        return self._database.pool_stats()
+
+class SQLiteBackend(Backend):
+    """SQLite through per-thread persistent connections.
+
+    With persistent=False every transaction opens (and closes) its own
+    connection instead.
+    """
+
+    name = 'sqlite'
+    placeholder = '?'
+
+    def __init__(self, database_file=DATABASE_FILE, persistent=True):
+        self.database_file = database_file
+        self.persistent = persistent
+        self._connections = get_thread_connections(database_file)
+
+    def connect(self):
+        if self.persistent:
+            return self._connections.get()
+        return sqlite3.connect(self.database_file)
+
+    def close_all(self):
+        """Close the per-thread connections (call on shutdown)"""
+        self._connections.close_all()
+
+    def row_to_dict(self, cursor, row):
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def begin(self, connection, cursor, lock):
+        if lock and not connection.in_transaction:
+            # Take the write lock up front so the rows read stay current
+            cursor.execute("BEGIN IMMEDIATE")
+
+BACKENDS = {
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name=None):
+    """Return the shared backend instance for an engine name (default: DB_BACKEND)"""
+    name = name or DB_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{name}'")
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = BACKENDS[name]()
+            _backends[name] = backend
+    return backend
@@ -1,9 +1,11 @@
 
-from database import get_db_connection
-from decimal import Decimal
+from db_backend import get_backend
+from pagination import build_listing_query, finish_page, is_paged, PaginationError
+from logger import get_logger
 import random
 import string
-import json
+
+log = get_logger("db_operations")
 
 def generate_ticket_code():
     """Generate a unique ticket code"""
@@ -11,249 +13,215 @@ def generate_ticket_code():
     random_chars = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
     return f"{prefix}-{random_chars}"
 
-# Custom JSON encoder to handle Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# Pending orders created for a payment; mpesa_transaction_id holds the
+# checkout_request_id, which is unique, so a retried payment job cannot
+# create a second order
+INSERT_ORDER_QUERIES = {
+    'artwork': """
+        INSERT INTO artwork_orders (user_id, artwork_id, total_amount, name, email, phone, delivery_address,
+                                    payment_method, payment_status, mpesa_transaction_id)
+        SELECT %s, %s, %s, u.name, u.email, u.phone, '', 'mpesa', 'pending', %s
+        FROM users u WHERE u.id = %s
+    """,
+    'exhibition': """
+        INSERT INTO exhibition_bookings (user_id, exhibition_id, slots, ticket_code, name, email, phone,
+                                         payment_method, payment_status, total_amount, mpesa_transaction_id)
+        SELECT %s, %s, %s, %s, u.name, u.email, u.phone, 'mpesa', 'pending', %s, %s
+        FROM users u WHERE u.id = %s
+    """,
+}
+
+def insert_order(session, order_type, user_id, reference_id, amount, slots=1, checkout_request_id=None):
+    """Insert a pending artwork order or exhibition booking inside a transaction.
+
+    Returns {"order_id"} (plus "ticket_code" for bookings), or None if the
+    user does not exist.
+    """
+    if order_type == 'artwork':
+        cursor = session.execute(INSERT_ORDER_QUERIES['artwork'],
+                                 (user_id, reference_id, amount, checkout_request_id, user_id))
+        result = {}
+    else:
+        ticket_code = generate_ticket_code()
+        cursor = session.execute(INSERT_ORDER_QUERIES['exhibition'],
+                                 (user_id, reference_id, slots, ticket_code, amount, checkout_request_id, user_id))
+        result = {"ticket_code": ticket_code}
+    if cursor.rowcount == 0:
+        return None
+    result["order_id"] = cursor.lastrowid
+    return result
 
 def create_order(user_id, order_type, reference_id, amount):
     """Create a new order in the database - uses the appropriate order table based on type"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    if order_type not in INSERT_ORDER_QUERIES:
+        return {"error": "Invalid order type"}
     
     try:
-        # Use the appropriate table based on order type
-        if order_type == 'artwork':
-            query = """
-            INSERT INTO artwork_orders (user_id, artwork_id, total_amount, name, email, phone, delivery_address, payment_method, payment_status)
-            SELECT %s, %s, %s, u.name, u.email, u.phone, '', 'mpesa', 'pending'
-            FROM users u WHERE u.id = %s
-            """
-            cursor.execute(query, (user_id, reference_id, amount, user_id))
-            order_id = cursor.lastrowid
-        elif order_type == 'exhibition':
-            query = """
-            INSERT INTO exhibition_bookings (user_id, exhibition_id, slots, name, email, phone, payment_method, payment_status, total_amount)
-            SELECT %s, %s, 1, u.name, u.email, u.phone, 'mpesa', 'pending', %s
-            FROM users u WHERE u.id = %s
-            """
-            cursor.execute(query, (user_id, reference_id, amount, user_id))
-            order_id = cursor.lastrowid
-        else:
-            return {"error": "Invalid order type"}
-            
-        connection.commit()
+        with get_backend('mysql').transaction() as session:
+            order = insert_order(session, order_type, user_id, reference_id, amount)
+        if order is None:
+            return {"error": "User not found"}
         
-        return {"success": True, "order_id": order_id}
+        return {"success": True, "order_id": order["order_id"]}
     except Exception as e:
-        print(f"Error creating order: {e}")
+        log.error("Error creating order: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def create_ticket(user_id, exhibition_id, slots):
     """Create a new ticket in the exhibition_bookings table"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    
     try:
-        # Check if the booking exists
-        query = """
-        SELECT id, ticket_code FROM exhibition_bookings
-        WHERE user_id = %s AND exhibition_id = %s AND payment_status = 'completed'
-        """
-        cursor.execute(query, (user_id, exhibition_id))
-        existing_booking = cursor.fetchone()
-        
-        if existing_booking:
-            booking_id = existing_booking[0]
-            ticket_code = existing_booking[1]
-        else:
-            # Generate a ticket code
-            ticket_code = generate_ticket_code()
-            
-            # Update existing booking with ticket code if pending payment
+        with get_backend('mysql').transaction() as session:
+            # Check if the booking exists
             query = """
-            UPDATE exhibition_bookings 
-            SET ticket_code = %s
-            WHERE user_id = %s AND exhibition_id = %s AND ticket_code IS NULL
+            SELECT id, ticket_code FROM exhibition_bookings
+            WHERE user_id = %s AND exhibition_id = %s AND payment_status = 'completed'
             """
-            cursor.execute(query, (ticket_code, user_id, exhibition_id))
+            existing_booking = session.query_one(query, (user_id, exhibition_id))
             
-            if cursor.rowcount == 0:
-                # Create a new booking record
+            if existing_booking:
+                booking_id = existing_booking['id']
+                ticket_code = existing_booking['ticket_code']
+            else:
+                # Generate a ticket code
+                ticket_code = generate_ticket_code()
+                
+                # Update existing booking with ticket code if pending payment
                 query = """
-                INSERT INTO exhibition_bookings (user_id, exhibition_id, slots, ticket_code, name, email, phone, payment_method, payment_status, total_amount)
-                SELECT %s, %s, %s, %s, name, email, phone, 'mpesa', 'pending', 
-                (SELECT ticket_price FROM exhibitions WHERE id = %s) * %s
-                FROM users WHERE id = %s
+                UPDATE exhibition_bookings 
+                SET ticket_code = %s
+                WHERE user_id = %s AND exhibition_id = %s AND ticket_code IS NULL
                 """
-                cursor.execute(query, (user_id, exhibition_id, slots, ticket_code, exhibition_id, slots, user_id))
+                session.execute(query, (ticket_code, user_id, exhibition_id))
                 
-            booking_id = cursor.lastrowid
-            
-        connection.commit()
+                if session.rowcount == 0:
+                    # Create a new booking record
+                    query = """
+                    INSERT INTO exhibition_bookings (user_id, exhibition_id, slots, ticket_code, name, email, phone, payment_method, payment_status, total_amount)
+                    SELECT %s, %s, %s, %s, name, email, phone, 'mpesa', 'pending', 
+                    (SELECT ticket_price FROM exhibitions WHERE id = %s) * %s
+                    FROM users WHERE id = %s
+                    """
+                    session.execute(query, (user_id, exhibition_id, slots, ticket_code, exhibition_id, slots, user_id))
+                    
+                booking_id = session.lastrowid
         
         return {"success": True, "booking_id": booking_id, "ticket_code": ticket_code}
     except Exception as e:
-        print(f"Error creating ticket: {e}")
+        log.error("Error creating ticket: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
-def get_all_orders():
-    """Get all artwork orders from the database"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+ORDERS_SELECT = """
+SELECT o.id, o.user_id, u.name as user_name, o.artwork_id as reference_id, 
+       a.title as item_title, o.total_amount as amount, o.payment_status, 
+       'artwork' as type, o.order_date as created_at
+FROM artwork_orders o
+JOIN users u ON o.user_id = u.id
+LEFT JOIN artworks a ON o.artwork_id = a.id
+"""
+
+ALL_ORDERS_QUERY = ORDERS_SELECT + "ORDER BY o.order_date DESC"
+
+# Sorts and filters accepted by get_all_orders()
+ORDER_LISTING = {
+    'id': ('o.id', 'id'),
+    'sorts': {
+        'newest': ('o.order_date', 'created_at', 'desc'),
+        'oldest': ('o.order_date', 'created_at', 'asc'),
+        'amount_asc': ('o.total_amount', 'amount', 'asc'),
+        'amount_desc': ('o.total_amount', 'amount', 'desc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'payment_status': ('o.payment_status', '='),
+        'user_id': ('o.user_id', '='),
+        'min_amount': ('o.total_amount', '>='),
+        'max_amount': ('o.total_amount', '<='),
+        'date_from': ('o.order_date', '>='),
+        'date_to': ('o.order_date', '<'),
+    },
+}
+
+ALL_TICKETS_QUERY = """
+SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id, e.title as exhibition_title,
+       e.image_url as exhibition_image_url, b.ticket_code, b.slots, 
+       b.booking_date, b.payment_status as status, b.total_amount
+FROM exhibition_bookings b
+JOIN users u ON b.user_id = u.id
+JOIN exhibitions e ON b.exhibition_id = e.id
+ORDER BY b.booking_date DESC
+"""
+
+def iter_all_orders(chunk_size=500):
+    """Yield all artwork orders (newest first) without building a list"""
+    return get_backend('mysql').stream(ALL_ORDERS_QUERY, chunk_size=chunk_size)
+
+def iter_all_tickets(chunk_size=500):
+    """Yield all exhibition bookings (newest first) without building a list"""
+    return get_backend('mysql').stream(ALL_TICKETS_QUERY, chunk_size=chunk_size)
+
+def get_all_orders(params=None):
+    """Get artwork orders from the database.
+
+    params are the request's query parameters: sort, the ORDER_LISTING
+    filters, and limit/cursor to fetch one page at a time.
+    """
+    params = params or {}
+    try:
+        query, args, page = build_listing_query(ORDERS_SELECT, ORDER_LISTING, params, is_paged(params))
+    except PaginationError as e:
+        return {"error": str(e)}
     
     try:
-        # Get all artwork orders
-        query = """
-        SELECT o.id, o.user_id, u.name as user_name, o.artwork_id as reference_id, 
-               a.title as item_title, o.total_amount as amount, o.payment_status, 
-               'artwork' as type, o.order_date as created_at
-        FROM artwork_orders o
-        JOIN users u ON o.user_id = u.id
-        LEFT JOIN artworks a ON o.artwork_id = a.id
-        ORDER BY o.order_date DESC
-        """
-        cursor.execute(query)
-        orders = []
-        for row in cursor.fetchall():
-            order = {}
-            for i, col_name in enumerate(cursor.column_names):
-                order[col_name] = row[i]
-                if isinstance(order[col_name], Decimal):
-                    order[col_name] = float(order[col_name])
-            orders.append(order)
-        
-        # Convert to JSON and back to handle Decimal types
-        orders_json = json.dumps(orders, cls=DecimalEncoder)
-        return {"orders": json.loads(orders_json)}
+        # Decimal and datetime values are encoded when the response is written
+        orders, next_cursor = finish_page(get_backend('mysql').query(query, args), page)
+        result = {"orders": orders}
+        if page['limit']:
+            result["nextCursor"] = next_cursor
+        return result
     except Exception as e:
-        print(f"Error getting orders: {e}")
+        log.error("Error getting orders: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def get_all_tickets():
     """Get all exhibition bookings (tickets) from database"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    
     try:
-        # Get all exhibition bookings
-        query = """
-        SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id, e.title as exhibition_title,
-               e.image_url as exhibition_image_url, b.ticket_code, b.slots, 
-               b.booking_date, b.payment_status as status, b.total_amount
-        FROM exhibition_bookings b
-        JOIN users u ON b.user_id = u.id
-        JOIN exhibitions e ON b.exhibition_id = e.id
-        ORDER BY b.booking_date DESC
-        """
-        cursor.execute(query)
-        tickets = []
-        for row in cursor.fetchall():
-            ticket = {}
-            for i, col_name in enumerate(cursor.column_names):
-                ticket[col_name] = row[i]
-                if isinstance(ticket[col_name], Decimal):
-                    ticket[col_name] = float(ticket[col_name])
-            tickets.append(ticket)
-        
-        # Convert to JSON and back to handle Decimal types
-        tickets_json = json.dumps(tickets, cls=DecimalEncoder)
-        return {"tickets": json.loads(tickets_json)}
+        return {"tickets": get_backend('mysql').query(ALL_TICKETS_QUERY)}
     except Exception as e:
-        print(f"Error getting tickets: {e}")
+        log.error("Error getting tickets: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def get_user_orders(user_id):
     """Get all orders and bookings for a specific user"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    
     try:
-        # Get artwork orders
-        artwork_query = """
-        SELECT o.id, o.user_id, o.artwork_id as reference_id, 
-               a.title as item_title, o.total_amount as amount, o.payment_status, 
-               'artwork' as type, o.order_date as created_at
-        FROM artwork_orders o
-        LEFT JOIN artworks a ON o.artwork_id = a.id
-        WHERE o.user_id = %s
-        ORDER BY o.order_date DESC
-        """
-        cursor.execute(artwork_query, (user_id,))
-        artwork_orders = []
-        for row in cursor.fetchall():
-            order = {}
-            for i, col_name in enumerate(cursor.column_names):
-                order[col_name] = row[i]
-                if isinstance(order[col_name], Decimal):
-                    order[col_name] = float(order[col_name])
-            artwork_orders.append(order)
-        
-        # Get exhibition bookings
-        exhibition_query = """
-        SELECT b.id, b.user_id, b.exhibition_id as reference_id, 
-               e.title as item_title, b.total_amount as amount, b.payment_status, 
-               'exhibition' as type, b.booking_date as created_at
-        FROM exhibition_bookings b
-        LEFT JOIN exhibitions e ON b.exhibition_id = e.id
-        WHERE b.user_id = %s
-        ORDER BY b.booking_date DESC
-        """
-        cursor.execute(exhibition_query, (user_id,))
-        exhibition_bookings = []
-        for row in cursor.fetchall():
-            booking = {}
-            for i, col_name in enumerate(cursor.column_names):
-                booking[col_name] = row[i]
-                if isinstance(booking[col_name], Decimal):
-                    booking[col_name] = float(booking[col_name])
-            exhibition_bookings.append(booking)
-        
-        # Convert to JSON and back to handle Decimal types
-        orders_json = json.dumps(artwork_orders, cls=DecimalEncoder)
-        bookings_json = json.dumps(exhibition_bookings, cls=DecimalEncoder)
+        with get_backend('mysql').transaction() as session:
+            # Get artwork orders
+            artwork_query = """
+            SELECT o.id, o.user_id, o.artwork_id as reference_id, 
+                   a.title as item_title, o.total_amount as amount, o.payment_status, 
+                   'artwork' as type, o.order_date as created_at
+            FROM artwork_orders o
+            LEFT JOIN artworks a ON o.artwork_id = a.id
+            WHERE o.user_id = %s
+            ORDER BY o.order_date DESC
+            """
+            artwork_orders = session.query(artwork_query, (user_id,))
+            
+            # Get exhibition bookings
+            exhibition_query = """
+            SELECT b.id, b.user_id, b.exhibition_id as reference_id, 
+                   e.title as item_title, b.total_amount as amount, b.payment_status, 
+                   'exhibition' as type, b.booking_date as created_at
+            FROM exhibition_bookings b
+            LEFT JOIN exhibitions e ON b.exhibition_id = e.id
+            WHERE b.user_id = %s
+            ORDER BY b.booking_date DESC
+            """
+            exhibition_bookings = session.query(exhibition_query, (user_id,))
         
         return {
-            "orders": json.loads(orders_json),
-            "bookings": json.loads(bookings_json)
+            "orders": artwork_orders,
+            "bookings": exhibition_bookings
         }
     except Exception as e:
-        print(f"Error getting user orders: {e}")
+        log.error("Error getting user orders: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
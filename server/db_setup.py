@@ -234,5 +234,8 @@ if __name__ == "__main__":
     except Error as err:
         print(f"Error creating database: {err}")
     
-    # Initialize tables
-    initialize_database()
+    # Initialize tables and apply pending migrations (indexes)
+    if initialize_database():
+        from db_backend import get_backend
+        from migrations import apply_migrations
+        apply_migrations(get_backend('mysql'))
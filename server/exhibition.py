@@ -1,12 +1,20 @@
 
-from database import get_db_connection, dict_from_row, json_dumps
-from auth import verify_token
+from database import json_dumps
+from db_backend import get_backend
+from pagination import build_listing_query, finish_page, is_paged, PaginationError
+from cache import cached_catalog, invalidate_catalog
+from uploads import sniff_image_type
+import image_pipeline
+import image_store
+from logger import get_logger
+from middleware import authenticate
 import json
 import os
 import base64
-import time
 from decimal import Decimal
 
+log = get_logger("exhibition")
+
 # Default exhibition image path
 DEFAULT_EXHIBITION_IMAGE = "/static/uploads/default_exhibition.jpg"
 
@@ -16,7 +24,7 @@ def ensure_uploads_directory():
     uploads_dir = os.path.join(os.path.dirname(__file__), "static", "uploads")
     if not os.path.exists(uploads_dir):
         os.makedirs(uploads_dir)
-        print(f"Created directory: {uploads_dir}")
+        log.info("Created directory: %s", uploads_dir)
 
 # Call this function to ensure directory exists
 ensure_uploads_directory()
@@ -38,7 +46,7 @@ def save_image_from_base64(base64_str, name_prefix="exhibition"):
             # For format like "data:image/jpeg;base64,/9j/4AAQSk..."
             image_format, base64_data = base64_str.split(",", 1)
             if ';base64' not in image_format:
-                print("Warning: Not a valid base64 image format")
+                log.warning("Not a valid base64 image format")
                 return None
         else:
             # Assume it's just the base64 data
@@ -48,50 +56,74 @@ def save_image_from_base64(base64_str, name_prefix="exhibition"):
         try:
             image_data = base64.b64decode(base64_data)
         except Exception as e:
-            print(f"Failed to decode base64 data: {e}")
+            log.warning("Failed to decode base64 data: %s", e)
+            return DEFAULT_EXHIBITION_IMAGE
+        
+        # Name the file after the format of the decoded bytes
+        detected = sniff_image_type(image_data[:16])
+        if detected is None:
+            log.warning("Uploaded data is not a JPEG, PNG, GIF or WebP image")
             return DEFAULT_EXHIBITION_IMAGE
+        _, extension = detected
         
-        # Generate a unique filename based on timestamp
-        timestamp = time.strftime("%Y%m%d%H%M%S")
-        filename = f"{name_prefix}_{timestamp}.jpg"
+        # Identical images are stored once, named by the hash of their bytes
+        image_url = image_store.store_bytes(image_data, extension)
         
-        # Save to the uploads directory
-        uploads_dir = os.path.join(os.path.dirname(__file__), "static", "uploads")
-        if not os.path.exists(uploads_dir):
-            os.makedirs(uploads_dir)
-            
-        file_path = os.path.join(uploads_dir, filename)
-        with open(file_path, "wb") as f:
-            f.write(image_data)
+        # Thumbnails and WebP variants are generated in the background
+        image_pipeline.submit(image_url)
         
         # Return the URL path to the image (ALWAYS use the standard format)
-        return f"/static/uploads/{filename}"
+        return image_url
     except Exception as e:
-        print(f"Error saving image: {e}")
+        log.error("Error saving image: %s", e)
         return DEFAULT_EXHIBITION_IMAGE
 
-def get_all_exhibitions():
-    """Get all exhibitions from the database"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+EXHIBITIONS_SELECT = """
+SELECT id, title, description, location, start_date, end_date,
+       ticket_price, image_url, total_slots, available_slots, status
+FROM exhibitions
+"""
+
+# Sorts and filters accepted by get_all_exhibitions()
+EXHIBITION_LISTING = {
+    'id': ('id', 'id'),
+    'sorts': {
+        'upcoming': ('start_date', 'start_date', 'asc'),
+        'latest': ('start_date', 'start_date', 'desc'),
+        'price_asc': ('ticket_price', 'ticket_price', 'asc'),
+        'price_desc': ('ticket_price', 'ticket_price', 'desc'),
+    },
+    'default_sort': 'upcoming',
+    'filters': {
+        'status': ('status', '='),
+        'location': ('location', '='),
+        'min_price': ('ticket_price', '>='),
+        'max_price': ('ticket_price', '<='),
+        'date_from': ('start_date', '>='),
+        'date_to': ('start_date', '<'),
+    },
+}
+
+def get_all_exhibitions(params=None):
+    """Get exhibitions, served from the catalog cache when possible.
+
+    params are the request's query parameters: sort, the EXHIBITION_LISTING
+    filters, and limit/cursor to fetch one page at a time.
+    """
+    params = params or {}
+    return cached_catalog("exhibitions", params, lambda: _load_exhibitions(params))
+
+def _load_exhibitions(params):
+    try:
+        query, args, page = build_listing_query(EXHIBITIONS_SELECT, EXHIBITION_LISTING, params, is_paged(params))
+    except PaginationError as e:
+        return {"error": str(e)}
     
     try:
-        query = """
-        SELECT id, title, description, location, start_date, end_date,
-               ticket_price, image_url, total_slots, available_slots, status
-        FROM exhibitions
-        ORDER BY start_date ASC
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        rows, next_cursor = finish_page(get_backend('mysql').query(query, args), page)
         
         exhibitions = []
-        for row in rows:
-            exhibition = dict_from_row(row, cursor)
-            
+        for exhibition in rows:
             # Convert id to string to match frontend expectations
             exhibition['id'] = str(exhibition['id'])
             
@@ -102,18 +134,11 @@ def get_all_exhibitions():
             # Convert ticket_price to camelCase
             exhibition['ticketPrice'] = exhibition.pop('ticket_price')
             
-            # Convert image_url to camelCase and ensure it's valid
+            # Convert image_url to camelCase and ensure it's valid (legacy
+            # base64 values are returned as stored until migrate_images.py runs)
             image_url = exhibition.pop('image_url')
-            # Convert base64 images to file paths
-            if image_url and (image_url.startswith('data:') or 'base64' in image_url):
-                # Save the base64 image to a file and get its path
-                saved_path = save_image_from_base64(image_url)
-                exhibition['imageUrl'] = saved_path
-                # Also update the database with the new path
-                update_exhibition_image(exhibition['id'], saved_path)
-                print(f"Converted base64 image to file: {saved_path}")
-            else:
-                exhibition['imageUrl'] = image_url if image_url else DEFAULT_EXHIBITION_IMAGE
+            exhibition['imageUrl'] = image_url if image_url else DEFAULT_EXHIBITION_IMAGE
+            exhibition['imageVariants'] = image_pipeline.variant_urls(exhibition['imageUrl'])
             
             # Convert total_slots and available_slots to camelCase
             exhibition['totalSlots'] = exhibition.pop('total_slots')
@@ -121,48 +146,16 @@ def get_all_exhibitions():
             
             exhibitions.append(exhibition)
         
-        return {"exhibitions": exhibitions}
+        result = {"exhibitions": exhibitions}
+        if page['limit']:
+            result["nextCursor"] = next_cursor
+        return result
     except Exception as e:
-        print(f"Error getting exhibitions: {e}")
+        log.error("Error getting exhibitions: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-
-def update_exhibition_image(exhibition_id, image_path):
-    """Update the image_url in the database for an exhibition"""
-    connection = get_db_connection()
-    if connection is None:
-        return False
-    
-    cursor = connection.cursor()
-    
-    try:
-        query = """
-        UPDATE exhibitions
-        SET image_url = %s
-        WHERE id = %s
-        """
-        cursor.execute(query, (image_path, exhibition_id))
-        connection.commit()
-        return True
-    except Exception as e:
-        print(f"Error updating exhibition image: {e}")
-        return False
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def get_exhibition(exhibition_id):
     """Get a specific exhibition by ID"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    
     try:
         query = """
         SELECT id, title, description, location, start_date, end_date,
@@ -170,14 +163,11 @@ def get_exhibition(exhibition_id):
         FROM exhibitions
         WHERE id = %s
         """
-        cursor.execute(query, (exhibition_id,))
-        row = cursor.fetchone()
+        exhibition = get_backend('mysql').query_one(query, (exhibition_id,))
         
-        if not row:
+        if not exhibition:
             return {"error": "Exhibition not found"}
         
-        exhibition = dict_from_row(row, cursor)
-        
         # Convert id to string to match frontend expectations
         exhibition['id'] = str(exhibition['id'])
         
@@ -188,18 +178,11 @@ def get_exhibition(exhibition_id):
         # Convert ticket_price to camelCase
         exhibition['ticketPrice'] = exhibition.pop('ticket_price')
         
-        # Convert image_url to camelCase and ensure it's valid
+        # Convert image_url to camelCase and ensure it's valid (legacy
+        # base64 values are returned as stored until migrate_images.py runs)
         image_url = exhibition.pop('image_url')
-        # Convert base64 images to file paths
-        if image_url and (image_url.startswith('data:') or 'base64' in image_url):
-            # Save the base64 image to a file and get its path
-            saved_path = save_image_from_base64(image_url)
-            exhibition['imageUrl'] = saved_path
-            # Also update the database with the new path
-            update_exhibition_image(exhibition['id'], saved_path)
-            print(f"Converted base64 image to file: {saved_path}")
-        else:
-            exhibition['imageUrl'] = image_url if image_url else DEFAULT_EXHIBITION_IMAGE
+        exhibition['imageUrl'] = image_url if image_url else DEFAULT_EXHIBITION_IMAGE
+        exhibition['imageVariants'] = image_pipeline.variant_urls(exhibition['imageUrl'])
         
         # Convert total_slots and available_slots to camelCase
         exhibition['totalSlots'] = exhibition.pop('total_slots')
@@ -207,60 +190,14 @@ def get_exhibition(exhibition_id):
         
         return exhibition
     except Exception as e:
-        print(f"Error getting exhibition: {e}")
+        log.error("Error getting exhibition: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def create_exhibition(auth_header, exhibition_data):
     """Create a new exhibition (admin only)"""
-    print(f"\n--- Create Exhibition Request ---")
-    print(f"Auth Header: {auth_header}")
-    print(f"Exhibition Data: {exhibition_data}")
-    
-    if not auth_header:
-        print("ERROR: Authentication header missing")
-        return {"error": "Authentication required"}
-    
-    # Extract token from header - handle both formats
-    token = None
-    if auth_header.startswith('Bearer '):
-        token = auth_header[7:]
-    else:
-        parts = auth_header.split(" ")
-        if len(parts) > 1:
-            token = parts[1]
-    
-    if not token:
-        print("ERROR: No token found in header")
-        return {"error": "Invalid authentication token"}
-    
-    # Verify token and check if user is admin
-    print(f"Verifying token: {token[:20]}...")
-    payload = verify_token(token)
-    print(f"Token verification result: {payload}")
-    
-    # Check if verification returned an error
-    if isinstance(payload, dict) and "error" in payload:
-        print(f"ERROR: Token verification failed: {payload['error']}")
-        return {"error": f"Authentication failed: {payload['error']}"}
-    
-    # Check if user is admin
-    is_admin = payload.get("is_admin", False)
-    print(f"Is admin: {is_admin}")
-    
-    if not is_admin:
-        print("ERROR: Access denied - Not an admin user")
-        return {"error": "Unauthorized access: Admin privileges required"}
-    
-    # Continue with exhibition creation
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    payload = authenticate(auth_header, admin=True)
+    if "error" in payload:
+        return {"error": payload["error"]}
     
     try:
         # Parse exhibition_data if it's a string
@@ -268,7 +205,7 @@ def create_exhibition(auth_header, exhibition_data):
             try:
                 exhibition_data = json.loads(exhibition_data)
             except json.JSONDecodeError as e:
-                print(f"ERROR: Failed to parse exhibition data: {e}")
+                log.warning("Failed to parse exhibition data: %s", e)
                 return {"error": f"Invalid exhibition data format: {str(e)}"}
         
         # Handle the image - convert base64 to file if needed
@@ -278,12 +215,11 @@ def create_exhibition(auth_header, exhibition_data):
             saved_image_path = save_image_from_base64(image_url)
             if saved_image_path:
                 image_url = saved_image_path
-                print(f"Image saved to: {saved_image_path}")
+                log.debug("Image saved to: %s", saved_image_path)
             else:
-                print("Failed to save image")
+                log.warning("Failed to save image")
                 image_url = DEFAULT_EXHIBITION_IMAGE
         
-        print(f"Inserting exhibition data: {exhibition_data}")
         query = """
         INSERT INTO exhibitions (title, description, location, start_date, end_date,
                                ticket_price, image_url, total_slots, available_slots, status)
@@ -297,7 +233,7 @@ def create_exhibition(auth_header, exhibition_data):
         if not image_url:
             image_url = DEFAULT_EXHIBITION_IMAGE
         
-        cursor.execute(query, (
+        _, new_exhibition_id = get_backend('mysql').execute(query, (
             exhibition_data.get("title"),
             exhibition_data.get("description"),
             exhibition_data.get("location"),
@@ -309,36 +245,29 @@ def create_exhibition(auth_header, exhibition_data):
             available_slots,
             exhibition_data.get("status")
         ))
-        connection.commit()
+        invalidate_catalog()
         
         # Return the newly created exhibition
-        new_exhibition_id = cursor.lastrowid
-        print(f"Exhibition created successfully with ID: {new_exhibition_id}")
+        log.info("Exhibition created successfully with ID: %s", new_exhibition_id)
         return get_exhibition(new_exhibition_id)
     except Exception as e:
-        print(f"ERROR creating exhibition: {e}")
+        log.error("Error creating exhibition: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def update_exhibition(auth_header, exhibition_id, exhibition_data):
-    # ... keep existing code (verification of admin and auth token)
-    
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    """Update an existing exhibition (admin only)"""
+    payload = authenticate(auth_header, admin=True)
+    if "error" in payload:
+        return {"error": payload["error"]}
     
+    db = get_backend('mysql')
     try:
         # First get the current exhibition to preserve the image_url
-        cursor.execute("SELECT image_url FROM exhibitions WHERE id = %s", (exhibition_id,))
-        current_exhibition = cursor.fetchone()
+        current_exhibition = db.query_one("SELECT image_url FROM exhibitions WHERE id = %s", (exhibition_id,))
         
         if not current_exhibition:
             return {"error": "Exhibition not found"}
+        current_image_url = current_exhibition['image_url'] or DEFAULT_EXHIBITION_IMAGE
         
         # Handle the image - convert base64 to file if needed
         image_url = exhibition_data.get("imageUrl")
@@ -347,14 +276,14 @@ def update_exhibition(auth_header, exhibition_id, exhibition_data):
             saved_image_path = save_image_from_base64(image_url)
             if saved_image_path:
                 image_url = saved_image_path
-                print(f"Image saved to: {saved_image_path}")
+                log.debug("Image saved to: %s", saved_image_path)
             else:
-                print("Failed to save image")
+                log.warning("Failed to save image")
                 # Keep the original image URL if saving fails
-                image_url = current_exhibition[0] if current_exhibition[0] else DEFAULT_EXHIBITION_IMAGE
+                image_url = current_image_url
         else:
             # Keep the existing image_url or use default if none
-            image_url = current_exhibition[0] if current_exhibition[0] else DEFAULT_EXHIBITION_IMAGE
+            image_url = current_image_url
         
         query = """
         UPDATE exhibitions
@@ -362,7 +291,7 @@ def update_exhibition(auth_header, exhibition_id, exhibition_data):
             ticket_price = %s, image_url = %s, total_slots = %s, available_slots = %s, status = %s
         WHERE id = %s
         """
-        cursor.execute(query, (
+        rowcount, _ = db.execute(query, (
             exhibition_data.get("title"),
             exhibition_data.get("description"),
             exhibition_data.get("location"),
@@ -375,85 +304,32 @@ def update_exhibition(auth_header, exhibition_id, exhibition_data):
             exhibition_data.get("status"),
             exhibition_id
         ))
-        connection.commit()
+        invalidate_catalog()
         
         # Check if exhibition was found and updated
-        if cursor.rowcount == 0:
+        if rowcount == 0:
             return {"error": "Exhibition not found"}
         
         # Return the updated exhibition
         return get_exhibition(exhibition_id)
     except Exception as e:
-        print(f"Error updating exhibition: {e}")
+        log.error("Error updating exhibition: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def delete_exhibition(auth_header, exhibition_id):
     """Delete an exhibition (admin only)"""
-    print(f"\n--- Delete Exhibition Request ---")
-    print(f"Auth Header: {auth_header}")
-    print(f"Exhibition ID: {exhibition_id}")
-    
-    if not auth_header:
-        print("ERROR: Authentication header missing")
-        return {"error": "Authentication required"}
-    
-    # Extract token from header - handle both formats
-    token = None
-    if auth_header.startswith('Bearer '):
-        token = auth_header[7:]
-    else:
-        parts = auth_header.split(" ")
-        if len(parts) > 1:
-            token = parts[1]
-    
-    if not token:
-        print("ERROR: No token found in header")
-        return {"error": "Invalid authentication token"}
-    
-    # Verify token and check if user is admin
-    print(f"Verifying token: {token[:20]}...")
-    payload = verify_token(token)
-    print(f"Token verification result: {payload}")
-    
-    # Check if verification returned an error
-    if isinstance(payload, dict) and "error" in payload:
-        print(f"ERROR: Token verification failed: {payload['error']}")
-        return {"error": f"Authentication failed: {payload['error']}"}
-    
-    # Check if user is admin
-    is_admin = payload.get("is_admin", False)
-    print(f"Is admin: {is_admin}")
-    
-    if not is_admin:
-        print("ERROR: Access denied - Not an admin user")
-        return {"error": "Unauthorized access: Admin privileges required"}
-    
-    # Proceed with deletion
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
+    payload = authenticate(auth_header, admin=True)
+    if "error" in payload:
+        return {"error": payload["error"]}
     
     try:
-        # First check if the exhibition exists
-        cursor.execute("SELECT id FROM exhibitions WHERE id = %s", (exhibition_id,))
-        if not cursor.fetchone():
+        # Proceed with deletion, if the exhibition exists
+        rowcount, _ = get_backend('mysql').execute("DELETE FROM exhibitions WHERE id = %s", (exhibition_id,))
+        if rowcount == 0:
             return {"error": "Exhibition not found"}
-        
-        # Delete the exhibition
-        cursor.execute("DELETE FROM exhibitions WHERE id = %s", (exhibition_id,))
-        connection.commit()
+        invalidate_catalog()
         
         return {"success": True, "message": f"Exhibition with ID {exhibition_id} deleted successfully"}
     except Exception as e:
-        print(f"Error deleting exhibition: {e}")
+        log.error("Error deleting exhibition: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
@@ -0,0 +1,190 @@
+import os
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from cache import TTLCache, invalidate_catalog
+from logger import get_logger
+
+# Pillow does the resizing (pip install Pillow); without it uploads are kept
+# as-is and no variants are generated
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+log = get_logger("image_pipeline")
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS") or 2)
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY") or 82)
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY") or 80)
+
+# Variant name -> longest edge in pixels (None keeps the original size)
+VARIANT_SIZES = {
+    'thumbnail': 320,
+    'medium': 1024,
+    'original': None,
+}
+
+# Keys of the imageVariants object returned by the API, with the suffix and
+# format of the file behind each one (None: same format as the upload, or
+# PNG for formats other than JPEG and PNG)
+VARIANT_FILES = {
+    'thumbnail': ('_thumbnail', None),
+    'thumbnailWebp': ('_thumbnail', 'webp'),
+    'medium': ('_medium', None),
+    'mediumWebp': ('_medium', 'webp'),
+    'webp': ('', 'webp'),
+}
+
+# Variants found per image URL, so listings do not stat every variant file
+# of every row. Stored images never change, so found variants are kept for
+# an hour; an image without variants is looked at again after
+# IMAGE_VARIANT_MISS_TTL seconds, as another process may have made them.
+IMAGE_VARIANT_CACHE_SIZE = int(os.getenv("IMAGE_VARIANT_CACHE_SIZE") or 10000)
+IMAGE_VARIANT_MISS_TTL = float(os.getenv("IMAGE_VARIANT_MISS_TTL") or 30)
+_variant_cache = TTLCache(max_entries=IMAGE_VARIANT_CACHE_SIZE, ttl=3600)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def is_available():
+    return Image is not None
+
+def _variant_path(source_path, suffix, extension):
+    stem, source_extension = os.path.splitext(source_path)
+    if extension is None:
+        extension = source_extension.lstrip('.').lower()
+        if extension not in ('jpg', 'jpeg', 'png'):
+            extension = 'png'
+    return f"{stem}{suffix}.{extension}"
+
+def _url_to_path(image_url):
+    if not image_url or not image_url.startswith('/static/'):
+        return None
+    path = os.path.realpath(os.path.join(STATIC_ROOT, image_url[len('/static/'):]))
+    if not path.startswith(os.path.realpath(STATIC_ROOT) + os.sep):
+        return None
+    return path
+
+def _path_to_url(path):
+    return '/static/' + os.path.relpath(path, STATIC_ROOT).replace(os.sep, '/')
+
+def _save(image, path, image_format):
+    # A unique temp name per call: a re-queued upload may be processed twice
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path), dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            if image_format == 'WEBP':
+                image.save(file, 'WEBP', quality=WEBP_QUALITY, method=4)
+            elif image_format == 'JPEG':
+                image.convert('RGB').save(file, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            else:
+                image.save(file, image_format, optimize=True)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def generate_variants(source_path):
+    """Write the resized and WebP variants of an image; runs in a worker process.
+
+    Returns {variant key: file path} for the files written.
+    """
+    written = {}
+    with Image.open(source_path) as opened:
+        source_format = opened.format if opened.format in ('JPEG', 'PNG') else 'PNG'
+        # Apply the EXIF orientation so thumbnails are not sideways
+        image = ImageOps.exif_transpose(opened)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for name, size in VARIANT_SIZES.items():
+            resized = image
+            if size and max(image.size) > size:
+                resized = image.copy()
+                resized.thumbnail((size, size), Image.LANCZOS)
+            suffix = '' if name == 'original' else f'_{name}'
+            if name != 'original':
+                path = _variant_path(source_path, suffix, None)
+                _save(resized, path, source_format)
+                written[name] = path
+            path = _variant_path(source_path, suffix, 'webp')
+            if path == source_path:
+                # The upload already is a full-size WebP
+                continue
+            _save(resized, path, 'WEBP')
+            written[f'{name}Webp' if name != 'original' else 'webp'] = path
+    return written
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn rather than fork: the server process is multithreaded
+            _executor = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+def _finished(image_url, future):
+    try:
+        written = future.result()
+    except Exception as e:
+        log.error("Error generating image variants for %s: %s", image_url, e)
+        return
+    log.info("Generated %d image variants for %s", len(written), image_url)
+    # Cached lookups and listings do not include the new variants yet
+    _variant_cache.invalidate()
+    invalidate_catalog()
+
+def submit(image_url):
+    """Queue variant generation for an uploaded image; returns the future or None"""
+    path = _url_to_path(image_url)
+    if Image is None or path is None or not os.path.isfile(path):
+        return None
+    if variant_urls(image_url):
+        # Already processed (the same image was stored before)
+        return None
+    try:
+        future = _get_executor().submit(generate_variants, path)
+    except Exception as e:
+        # A broken pool is replaced on the next upload; the image itself is kept
+        log.error("Could not queue image variants for %s: %s", image_url, e)
+        shutdown(wait=False)
+        return None
+    future.add_done_callback(lambda done: _finished(image_url, done))
+    return future
+
+def variant_urls(image_url):
+    """Return {variant key: url} for the variants of image_url that exist on disk.
+
+    The result is cached and shared between callers; treat it as read-only.
+    """
+    if not image_url or not image_url.startswith('/static/'):
+        return {}
+    return _variant_cache.get_or_load(
+        image_url,
+        lambda: _find_variants(image_url),
+        ttl=lambda variants: None if variants else IMAGE_VARIANT_MISS_TTL,
+    )
+
+def _find_variants(image_url):
+    path = _url_to_path(image_url)
+    if path is None:
+        return {}
+    variants = {}
+    for key, (suffix, extension) in VARIANT_FILES.items():
+        variant = _variant_path(path, suffix, extension)
+        if variant != path and os.path.exists(variant):
+            variants[key] = _path_to_url(variant)
+    return variants
+
+def shutdown(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,176 @@
+# Content-addressed image store.
+#
+# Images are stored once per distinct content under
+# static/uploads/cas/<aa>/<bb>/<sha256><ext>, where aa and bb are the first
+# two byte pairs of the hash. Generated variants sit next to the original and
+# share its hash prefix. A file name never gets different content, so these
+# URLs can be cached forever.
+#
+#   python image_store.py stats [--backend mysql|sqlite]
+#   python image_store.py gc    [--backend mysql|sqlite] [--dry-run] [--grace-hours 24]
+import os
+import re
+import sys
+import time
+import hashlib
+import tempfile
+import argparse
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+CAS_ROOT = os.path.join(UPLOADS_DIR, "cas")
+CAS_URL_PREFIX = "/static/uploads/cas/"
+
+# Unreferenced files younger than this are kept: an image is uploaded before
+# the artwork that uses it is saved
+GC_GRACE_SECONDS = float(os.getenv("IMAGE_GC_GRACE_SECONDS") or 24 * 3600)
+
+DIGEST_PATTERN = re.compile(r'^([0-9a-f]{64})')
+CONTENT_URL_PATTERN = re.compile(r'^/static/uploads/cas/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})')
+
+# Tables and columns that reference stored images
+REFERENCE_QUERY = """
+SELECT image_url, COUNT(*) AS refs FROM artworks WHERE image_url LIKE %s GROUP BY image_url
+UNION ALL
+SELECT image_url, COUNT(*) AS refs FROM exhibitions WHERE image_url LIKE %s GROUP BY image_url
+"""
+
+def content_path(digest, extension):
+    return os.path.join(CAS_ROOT, digest[:2], digest[2:4], digest + extension)
+
+def content_url(digest, extension):
+    return f"{CAS_URL_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+def digest_of_url(image_url):
+    """Return the content hash in a store URL, or None for other URLs"""
+    match = CONTENT_URL_PATTERN.match(image_url or '')
+    return match.group(1) if match else None
+
+def _touch(path):
+    """Refresh an existing object's mtime; returns False if it is not stored.
+
+    An unreferenced object is kept by collect_garbage() while it is younger
+    than the grace period, so identical content uploaded again (before the
+    row that uses it is saved) is not collected from under it.
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def store_file(temp_path, digest, extension):
+    """Move a fully written temp file into the store.
+
+    Returns (url, created); created is False when identical content was
+    already stored, in which case the temp file is removed.
+    """
+    path = content_path(digest, extension)
+    if _touch(path):
+        os.remove(temp_path)
+        return content_url(digest, extension), False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+    return content_url(digest, extension), True
+
+def store_bytes(data, extension):
+    """Store image bytes held in memory and return their URL"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = content_path(digest, extension)
+    if not _touch(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temp name per call: several threads may store the same bytes
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix=digest, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            store_file(temp_path, digest, extension)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    return content_url(digest, extension)
+
+def reference_counts(backend):
+    """Return {digest: number of artwork and exhibition rows using it}"""
+    counts = {}
+    pattern = CAS_URL_PREFIX + '%'
+    for row in backend.query(REFERENCE_QUERY, (pattern, pattern)):
+        digest = digest_of_url(row['image_url'])
+        if digest:
+            counts[digest] = counts.get(digest, 0) + row['refs']
+    return counts
+
+def stored_objects():
+    """Return {digest: [file paths]} for the originals and variants in the store"""
+    objects = {}
+    for directory, _, files in os.walk(CAS_ROOT):
+        for name in files:
+            match = DIGEST_PATTERN.match(name)
+            if match and not name.endswith('.tmp'):
+                objects.setdefault(match.group(1), []).append(os.path.join(directory, name))
+    return objects
+
+def collect_garbage(backend, grace_seconds=GC_GRACE_SECONDS, dry_run=False):
+    """Delete stored images (with their variants) that no row references.
+
+    Returns (objects removed, files removed, bytes freed).
+    """
+    # List files before reading references, so an image stored and
+    # referenced in between is never seen as an orphan
+    objects = stored_objects()
+    references = reference_counts(backend)
+    cutoff = time.time() - grace_seconds
+    removed_objects = removed_files = freed = 0
+    for digest, paths in objects.items():
+        if references.get(digest):
+            continue
+        try:
+            if max(os.path.getmtime(path) for path in paths) > cutoff:
+                continue
+            sizes = sum(os.path.getsize(path) for path in paths)
+        except FileNotFoundError:
+            continue
+        for path in paths:
+            if dry_run:
+                print(f"Would remove {path}")
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            removed_files += 1
+        removed_objects += 1
+        freed += sizes
+    return removed_objects, removed_files, freed
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or garbage-collect the content-addressed image store")
+    parser.add_argument("command", choices=["stats", "gc"])
+    parser.add_argument("--backend", default=None, help="mysql or sqlite (default: DB_BACKEND)")
+    parser.add_argument("--dry-run", action="store_true", help="List what gc would remove")
+    parser.add_argument("--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600,
+                        help="Keep unreferenced images younger than this")
+    args = parser.parse_args()
+
+    from db_backend import get_backend
+    backend = get_backend(args.backend)
+
+    if args.command == "stats":
+        objects = stored_objects()
+        references = reference_counts(backend)
+        referenced = sum(1 for digest in objects if references.get(digest))
+        shared = sum(count - 1 for digest, count in references.items() if count > 1)
+        print(f"Stored images:      {len(objects)}")
+        print(f"Referenced:         {referenced}")
+        print(f"Unreferenced:       {len(objects) - referenced}")
+        print(f"Deduplicated rows:  {shared}")
+        return 0
+
+    objects, files, freed = collect_garbage(backend, args.grace_hours * 3600, args.dry_run)
+    action = "Would remove" if args.dry_run else "Removed"
+    print(f"{action} {objects} unreferenced images ({files} files, {freed / 1024:.1f} KiB)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
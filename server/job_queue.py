@@ -0,0 +1,268 @@
+# Durable background jobs stored in SQLite.
+#
+#   import job_queue
+#
+#   @job_queue.handler("mpesa.stk_push")
+#   def process_stk_push(payload, job_id):
+#       ...                                  # raise to retry, PermanentJobError to give up
+#
+#   job, created = job_queue.enqueue("mpesa.stk_push", payload, idempotency_key=key)
+#   job_queue.start()                        # worker threads, once per process
+#
+# Jobs survive restarts: they are rows in the jobs table, and a worker claims
+# one by leasing it inside a write transaction, so several workers (or
+# processes sharing the database file) never run the same job at once. A job
+# whose worker died is picked up again when its lease runs out, so handlers
+# must be safe to run twice for the same job id.
+#
+# A failed attempt is retried after an exponential backoff with jitter, up to
+# JOB_MAX_ATTEMPTS attempts. Enqueuing twice with the same idempotency key
+# returns the first job instead of creating another one; with
+# match_payload=True, reusing a key for a different payload raises
+# IdempotencyConflict instead.
+import os
+import json
+import time
+import uuid
+import random
+import threading
+from db_backend import SQLiteBackend, DATABASE_FILE
+from logger import get_logger
+
+JOB_DB_FILE = os.getenv("JOB_DB_FILE") or DATABASE_FILE
+JOB_WORKERS = int(os.getenv("JOB_WORKERS") or 2)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS") or 5)
+# Retry n waits between half and all of min(base * 2^(n-1), max) seconds
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE") or 2)
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX") or 300)
+# Seconds a claimed job stays reserved for its worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS") or 120)
+# Seconds an idle worker sleeps before looking for due jobs again
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL") or 1)
+# Finished jobs are deleted after this many seconds
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS") or 7 * 24 * 3600)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+log = get_logger("job_queue")
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot help"""
+
+class IdempotencyConflict(Exception):
+    """Raised by enqueue when an idempotency key is reused for another payload"""
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        idempotency_key TEXT UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT,
+        result TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)",
+]
+
+_handlers = {}
+_backend = None
+_schema_lock = threading.Lock()
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_workers = []
+
+def handler(kind):
+    """Decorator registering the function that runs jobs of a kind"""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+def _get_backend():
+    global _backend
+    with _schema_lock:
+        if _backend is None:
+            backend = SQLiteBackend(JOB_DB_FILE)
+            with backend.transaction() as session:
+                for statement in _SCHEMA:
+                    session.execute(statement)
+            _backend = backend
+    return _backend
+
+def _decode(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after `attempts` failed ones"""
+    delay = min(JOB_RETRY_BASE * 2 ** (attempts - 1), JOB_RETRY_MAX)
+    # Jitter spreads out retries of jobs that failed together
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def _same_job(row, kind, payload):
+    # Compared as JSON, the way the payload is stored
+    return row['kind'] == kind and json.loads(row['payload']) == json.loads(json.dumps(payload))
+
+def enqueue(kind, payload, idempotency_key=None, job_id=None, reuse_finished=True, match_payload=False):
+    """Store a job and wake a worker; returns (job, created).
+
+    If a job with the same idempotency key exists it is returned instead
+    (created is False). One that had failed for good is queued again, so
+    a client can retry with the same key. With reuse_finished=False only a
+    queued or running job is reused: the key is taken from a finished job
+    and given to a new one, for keys derived from the request rather than
+    chosen by the client. With match_payload=True a job is only reused for
+    the same kind and payload; IdempotencyConflict is raised otherwise.
+    """
+    now = time.time()
+    job_id = job_id or uuid.uuid4().hex
+    with _get_backend().transaction(lock=True) as session:
+        existing = None
+        if idempotency_key is not None:
+            existing = session.query_one("SELECT * FROM jobs WHERE idempotency_key = %s", (idempotency_key,))
+        if existing is not None and not reuse_finished and existing['status'] in (DONE, FAILED):
+            session.execute("UPDATE jobs SET idempotency_key = NULL WHERE id = %s", (existing['id'],))
+            existing = None
+        if existing is not None and match_payload and not _same_job(existing, kind, payload):
+            raise IdempotencyConflict(idempotency_key)
+        if existing is None:
+            session.execute("""
+                INSERT INTO jobs (id, kind, idempotency_key, payload, status, run_after, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, (job_id, kind, idempotency_key, json.dumps(payload), QUEUED, now, now, now))
+            created = True
+        elif existing['status'] == FAILED:
+            session.execute("""
+                UPDATE jobs SET status = %s, attempts = 0, run_after = %s, last_error = NULL,
+                    payload = %s, updated_at = %s
+                WHERE id = %s
+            """, (QUEUED, now, json.dumps(payload), now, existing['id']))
+            job_id, created = existing['id'], True
+        else:
+            job_id, created = existing['id'], False
+        job = _decode(session.query_one("SELECT * FROM jobs WHERE id = %s", (job_id,)))
+    if created:
+        _wakeup.set()
+    return job, created
+
+def get_job(job_id):
+    return _decode(_get_backend().query_one("SELECT * FROM jobs WHERE id = %s", (job_id,)))
+
+def claim():
+    """Lease the next due job to the calling worker, or return None"""
+    now = time.time()
+    with _get_backend().transaction(lock=True) as session:
+        row = session.query_one("""
+            SELECT * FROM jobs
+            WHERE (status = %s AND run_after <= %s) OR (status = %s AND locked_until <= %s)
+            ORDER BY run_after
+            LIMIT 1
+        """, (QUEUED, now, RUNNING, now))
+        if row is None:
+            return None
+        locked_until = now + JOB_LEASE_SECONDS
+        session.execute("""
+            UPDATE jobs SET status = %s, attempts = attempts + 1, locked_until = %s, updated_at = %s
+            WHERE id = %s
+        """, (RUNNING, locked_until, now, row['id']))
+    job = _decode(row)
+    job['attempts'] += 1
+    job['status'] = RUNNING
+    job['locked_until'] = locked_until
+    return job
+
+def _finish(job, status, result=None, error=None, run_after=None):
+    """Record a job's outcome, unless its lease ran out and another worker took it"""
+    now = time.time()
+    rowcount, _ = _get_backend().execute("""
+        UPDATE jobs SET status = %s, result = %s, last_error = %s, run_after = %s,
+            locked_until = NULL, updated_at = %s
+        WHERE id = %s AND status = %s AND locked_until = %s
+    """, (status, json.dumps(result) if result is not None else None, error,
+          run_after or now, now, job['id'], RUNNING, job['locked_until']))
+    if not rowcount:
+        log.warning("Lost the lease on job; outcome discarded", job_id=job['id'], kind=job['kind'])
+    return rowcount > 0
+
+def run_job(job):
+    """Run a claimed job and record its outcome"""
+    func = _handlers.get(job['kind'])
+    if func is None:
+        log.error("No handler for job kind %s", job['kind'], job_id=job['id'])
+        return _finish(job, FAILED, error=f"No handler for job kind '{job['kind']}'")
+    try:
+        result = func(job['payload'], job['id'])
+    except PermanentJobError as e:
+        log.warning("Job failed: %s", e, job_id=job['id'], kind=job['kind'])
+        return _finish(job, FAILED, error=str(e))
+    except Exception as e:
+        if job['attempts'] >= JOB_MAX_ATTEMPTS:
+            log.error("Job failed after %d attempts: %s", job['attempts'], e, job_id=job['id'], kind=job['kind'])
+            return _finish(job, FAILED, error=str(e))
+        delay = retry_delay(job['attempts'])
+        log.warning("Job attempt %d failed, retrying in %.1fs: %s", job['attempts'], delay, e,
+                    job_id=job['id'], kind=job['kind'])
+        return _finish(job, QUEUED, error=str(e), run_after=time.time() + delay)
+    _finish(job, DONE, result=result)
+
+def purge(older_than=JOB_RETENTION_SECONDS):
+    """Delete finished jobs last updated more than older_than seconds ago"""
+    rowcount, _ = _get_backend().execute(
+        "DELETE FROM jobs WHERE status IN (%s, %s) AND updated_at < %s",
+        (DONE, FAILED, time.time() - older_than))
+    return rowcount
+
+def _work():
+    next_purge = 0
+    while not _stopping.is_set():
+        try:
+            job = claim()
+            if job is not None:
+                run_job(job)
+                continue
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + 3600
+                purge()
+        except Exception:
+            log.exception("Job worker error")
+        _wakeup.wait(JOB_POLL_INTERVAL)
+        _wakeup.clear()
+
+def start(workers=JOB_WORKERS):
+    """Start the worker threads (no-op if they are running)"""
+    if _workers:
+        return
+    _get_backend()
+    _stopping.clear()
+    for number in range(workers):
+        thread = threading.Thread(target=_work, name=f"job-worker-{number}", daemon=True)
+        thread.start()
+        _workers.append(thread)
+    log.info("Started %d job workers", workers)
+
+def stop(timeout=10):
+    """Ask the workers to stop and wait for their current jobs to finish.
+
+    A job still running after timeout is retried once its lease expires.
+    """
+    _stopping.set()
+    _wakeup.set()
+    for thread in _workers:
+        thread.join(timeout)
+    _workers.clear()
+
+def stats():
+    rows = _get_backend().query("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")
+    return {row['status']: row['count'] for row in rows}
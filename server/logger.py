@@ -0,0 +1,162 @@
+# Leveled, structured logging for the request paths.
+#
+#   from logger import get_logger
+#   log = get_logger(__name__)
+#   log.info("Order created", order_id=order_id, amount=amount)
+#   log.debug("Loaded %d rows", len(rows))             # formatted only if emitted
+#   log.sample().debug("Row image %s", url)            # per-row: 1 in 100 by default
+#
+# Records are put on an in-memory queue and written by one background
+# thread, so request threads never wait on stdout. Messages use %-style
+# arguments and are only formatted, on the writer thread, when the level is
+# enabled. When the queue is full new records are dropped and counted rather
+# than blocking the request.
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+# "text" for people, "json" (one object per line) for log shippers
+LOG_FORMAT = os.getenv("LOG_FORMAT") or "text"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE") or 10000)
+# Share of sampled (per-row) messages that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE") or 0.01)
+
+ROOT_LOGGER = "afriart"
+
+class TextFormatter(logging.Formatter):
+    """time LEVEL logger: message key=value ..."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that neither formats in the caller nor blocks when full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener thread formats the record; the queue stays in-process
+        # so the record (args and exc_info included) can be passed as is
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger whose methods take key=value fields after the message arguments"""
+
+    def __init__(self, logger):
+        super().__init__(logger, {})
+
+    def _emit(self, level, msg, args, exc_info, fields):
+        if self.logger.isEnabledFor(level):
+            # stacklevel points the record at the caller of debug(), info(), ...
+            self.logger._log(level, msg, args, exc_info=exc_info, extra={'fields': fields}, stacklevel=3)
+
+    def log(self, level, msg, *args, exc_info=None, **fields):
+        self._emit(level, msg, args, exc_info, fields)
+
+    def debug(self, msg, *args, **fields):
+        self._emit(logging.DEBUG, msg, args, None, fields)
+
+    def info(self, msg, *args, **fields):
+        self._emit(logging.INFO, msg, args, None, fields)
+
+    def warning(self, msg, *args, **fields):
+        self._emit(logging.WARNING, msg, args, None, fields)
+
+    def error(self, msg, *args, **fields):
+        self._emit(logging.ERROR, msg, args, None, fields)
+
+    def exception(self, msg, *args, **fields):
+        self._emit(logging.ERROR, msg, args, True, fields)
+
+    def sample(self, rate=None):
+        """Return this logger for a fraction of calls and a no-op logger otherwise"""
+        rate = LOG_SAMPLE_RATE if rate is None else rate
+        return self if random.random() < rate else _NULL_LOGGER
+
+class _NullLogger:
+    def _discard(self, *args, **kwargs):
+        pass
+
+    debug = info = warning = error = exception = log = _discard
+
+    def isEnabledFor(self, level):
+        return False
+
+_NULL_LOGGER = _NullLogger()
+
+_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+def configure(level=None, log_format=None, stream=None):
+    """Set up the queue and writer thread; later calls change the level only"""
+    global _handler, _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level or LOG_LEVEL)
+    with _configure_lock:
+        if _handler is not None:
+            return
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JSONFormatter() if (log_format or LOG_FORMAT) == "json" else TextFormatter())
+        _handler = DroppingQueueHandler(log_queue)
+        _listener = QueueListener(log_queue, output, respect_handler_level=False)
+        _listener.start()
+        root.addHandler(_handler)
+        root.propagate = False
+        atexit.register(shutdown)
+
+def shutdown():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
+
+def get_logger(name):
+    """Return a structured logger under the application's logger tree"""
+    if _handler is None:
+        configure()
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
@@ -1,21 +1,81 @@
 
 import jwt
+import time
 import datetime
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from functools import wraps
 from http.server import BaseHTTPRequestHandler
-from decimal import Decimal
-import json
+from serialization import dumps, dumps_bytes
+from logger import get_logger
 
 # Get the secret key from environment or use a default (in production, always use environment variables)
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'afriart_default_secret_key')
 
-# Custom JSON encoder to handle Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super(DecimalEncoder, self).default(obj)
+# Verified tokens are remembered so repeat requests skip the signature check.
+# An entry is dropped when the token expires, or after TOKEN_CACHE_MAX_AGE
+# seconds so a rotated JWT_SECRET_KEY takes effect within that time.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE") or 1024)
+TOKEN_CACHE_MAX_AGE = float(os.getenv("TOKEN_CACHE_MAX_AGE") or 300)
+
+log = get_logger("middleware")
+
+class TokenCache:
+    """Bounded LRU of verified token payloads, keyed by a digest of the token"""
+
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE, max_age=TOKEN_CACHE_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers may add to the payload; keep the cached one unchanged
+        return dict(payload)
+
+    def put(self, token, payload):
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.max_age
+        if isinstance(payload.get("exp"), (int, float)):
+            expires_at = min(expires_at, payload["exp"])
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (dict(payload), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+token_cache = TokenCache()
 
 def generate_token(user_id, name, is_admin):
     """Generate a JWT token for authentication"""
@@ -26,26 +86,27 @@ def generate_token(user_id, name, is_admin):
         "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1)
     }
     
-    print(f"Generating token with payload: {payload}")
     token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
     return token
 
 def verify_token(token):
-    """Verify a JWT token"""
+    """Verify a JWT token; returns its payload or {"error": ...}"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
-        print(f"Verifying token: {token[:20]}...")
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        print(f"Token decoded successfully: {payload}")
-        return payload
     except jwt.ExpiredSignatureError:
-        print("Token verification failed: Token expired")
+        log.debug("Token verification failed: token expired")
         return {"error": "Token expired"}
     except jwt.InvalidTokenError as e:
-        print(f"Token verification failed: Invalid token - {str(e)}")
+        log.debug("Token verification failed: invalid token - %s", e)
         return {"error": f"Invalid token: {str(e)}"}
     except Exception as e:
-        print(f"Unexpected error during token verification: {str(e)}")
+        log.error("Unexpected error during token verification: %s", e)
         return {"error": f"Token verification error: {str(e)}"}
+    token_cache.put(token, payload)
+    return payload
 
 def extract_auth_token(handler):
     """Extract token from Authorization header
@@ -62,7 +123,7 @@ def extract_auth_token(handler):
         auth_header = handler.headers.get('Authorization', '')
     else:
         # Unknown type
-        print(f"Warning: extract_auth_token received unknown type: {type(handler)}")
+        log.warning("extract_auth_token received unknown type: %s", type(handler))
         return None
     
     token = None
@@ -73,21 +134,32 @@ def extract_auth_token(handler):
     
     return token
 
-def auth_required(handler_method):
-    """Decorator to ensure a valid token is present for protected routes"""
+def authenticate(auth_header, admin=False):
+    """Check an Authorization header (or request handler) and return the token payload.
+
+    This is the one entry point for request authentication. On failure it
+    returns {"error": message, "status": 401 or 403}.
+    """
+    if not auth_header:
+        return {"error": "Authentication required", "status": 401}
+    token = extract_auth_token(auth_header)
+    if not token:
+        return {"error": "Invalid authentication token", "status": 401}
+    payload = verify_token(token)
+    if "error" in payload:
+        return {"error": payload["error"], "status": 401}
+    if admin and not payload.get("is_admin", False):
+        log.warning("Access denied: not an admin user", user_id=payload.get("sub"))
+        return {"error": "Unauthorized access: Admin privileges required", "status": 403}
+    return payload
+
+def _require(handler_method, admin):
     @wraps(handler_method)
     def wrapper(self, *args, **kwargs):
-        token = extract_auth_token(self)
-        
-        if not token:
-            self._set_response(401)
-            self.wfile.write(b'{"error": "Authentication required"}')
-            return None
-        
-        payload = verify_token(token)
-        if isinstance(payload, dict) and "error" in payload:
-            self._set_response(401)
-            self.wfile.write(f'{{"error": "{payload["error"]}"}}'.encode())
+        payload = authenticate(self.headers.get('Authorization', ''), admin)
+        if "error" in payload:
+            self._set_response(payload["status"])
+            self.wfile.write(dumps_bytes({"error": payload["error"]}))
             return None
         
         # Attach user info to the handler
@@ -96,36 +168,15 @@ def auth_required(handler_method):
     
     return wrapper
 
+def auth_required(handler_method):
+    """Decorator to ensure a valid token is present for protected routes"""
+    return _require(handler_method, admin=False)
+
 def admin_required(handler_method):
     """Decorator to ensure the user is an admin for admin-only routes"""
-    @wraps(handler_method)
-    def wrapper(self, *args, **kwargs):
-        token = extract_auth_token(self)
-        
-        if not token:
-            self._set_response(401)
-            self.wfile.write(b'{"error": "Authentication required"}')
-            return None
-        
-        payload = verify_token(token)
-        if isinstance(payload, dict) and "error" in payload:
-            self._set_response(401)
-            self.wfile.write(f'{{"error": "{payload["error"]}"}}'.encode())
-            return None
-        
-        # Check if user is admin
-        if not payload.get("is_admin", False):
-            self._set_response(403)
-            self.wfile.write(b'{"error": "Unauthorized access: Admin privileges required"}')
-            return None
-        
-        # Attach user info to the handler
-        self.user_info = payload
-        return handler_method(self, *args, **kwargs)
-    
-    return wrapper
+    return _require(handler_method, admin=True)
 
 # Helper function to safely encode JSON with Decimal values
 def json_dumps(data):
     """Safely convert data to JSON string, handling Decimal types"""
-    return json.dumps(data, cls=DecimalEncoder)
+    return dumps(data)
@@ -0,0 +1,116 @@
+# Moves legacy base64 images out of artworks.image_url and
+# exhibitions.image_url into the image store, in batches.
+#
+#   python migrate_images.py [--backend mysql|sqlite] [--batch-size 100] [--dry-run]
+#
+# Safe to run while the server is up and to re-run: each batch is one
+# transaction, and a row is only rewritten if it still holds the data it was
+# read with.
+import sys
+import time
+import base64
+import binascii
+import argparse
+import image_pipeline
+import image_store
+from uploads import sniff_image_type
+from db_backend import get_backend
+
+TABLES = ('artworks', 'exhibitions')
+
+# Same test the read paths used before images were migrated offline
+LEGACY_PATTERNS = ('data:%', '%base64%')
+
+BATCH_QUERY = """
+SELECT id, image_url FROM {table}
+WHERE id > %s AND (image_url LIKE %s OR image_url LIKE %s)
+ORDER BY id
+LIMIT %s
+"""
+
+UPDATE_QUERY = "UPDATE {table} SET image_url = %s WHERE id = %s AND image_url = %s"
+
+COUNT_QUERY = "SELECT COUNT(*) AS total FROM {table} WHERE image_url LIKE %s OR image_url LIKE %s"
+
+def decode_image(value):
+    """Return (image bytes, extension) for a base64 image_url, or None"""
+    header, separator, data = value.partition(',')
+    if not separator:
+        data = value
+    elif ';base64' not in header:
+        return None
+    try:
+        image = base64.b64decode(data)
+    except (binascii.Error, ValueError):
+        return None
+    detected = sniff_image_type(image[:16])
+    if detected is None:
+        return None
+    return image, detected[1]
+
+def store_image(image, extension):
+    """Store decoded bytes and build their variants; returns the image URL"""
+    url = image_store.store_bytes(image, extension)
+    if image_pipeline.is_available() and not image_pipeline.variant_urls(url):
+        path = image_store.content_path(image_store.digest_of_url(url), extension)
+        try:
+            image_pipeline.generate_variants(path)
+        except Exception as e:
+            print(f"  could not build variants for {url}: {e}")
+    return url
+
+def migrate_table(backend, table, batch_size, dry_run=False):
+    """Convert every legacy row of one table; returns (migrated, skipped)"""
+    total = backend.query_one(COUNT_QUERY.format(table=table), LEGACY_PATTERNS)['total']
+    print(f"{table}: {total} rows with base64 images")
+    migrated = skipped = 0
+    last_id = 0
+    started = time.time()
+    while True:
+        rows = backend.query(BATCH_QUERY.format(table=table), (last_id,) + LEGACY_PATTERNS + (batch_size,))
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+
+        # Files are written before the transaction so it only holds the UPDATEs
+        updates = []
+        for row in rows:
+            decoded = decode_image(row['image_url'])
+            if decoded is None:
+                print(f"  {table} {row['id']}: not a JPEG, PNG, GIF or WebP image; left as is")
+                skipped += 1
+                continue
+            url = store_image(*decoded) if not dry_run else None
+            updates.append((url, row['id'], row['image_url']))
+
+        if updates and not dry_run:
+            with backend.transaction() as session:
+                session.executemany(UPDATE_QUERY.format(table=table), updates)
+        migrated += len(updates)
+        done = migrated + skipped
+        rate = done / max(time.time() - started, 1e-6)
+        print(f"  {table}: {done}/{total} rows ({rate:.0f} rows/s)")
+    return migrated, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Move base64 image_url values into the image store")
+    parser.add_argument("--backend", default=None, help="mysql or sqlite (default: DB_BACKEND)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Rows converted per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Decode and count rows without writing anything")
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend)
+    migrated = skipped = 0
+    for table in TABLES:
+        table_migrated, table_skipped = migrate_table(backend, table, args.batch_size, args.dry_run)
+        migrated += table_migrated
+        skipped += table_skipped
+
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {migrated} images ({skipped} rows skipped)")
+    if migrated and not args.dry_run:
+        print("A running server picks up the new URLs once its catalog cache expires")
+    return 1 if skipped else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
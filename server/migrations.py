@@ -0,0 +1,241 @@
+# Versioned schema migrations and an EXPLAIN check for hot queries.
+#
+#   python migrations.py migrate [--backend mysql|sqlite]
+#   python migrations.py check   [--backend mysql|sqlite]
+import re
+import sys
+import argparse
+from db_backend import get_backend
+
+# Each migration runs once per database, in version order. Statements are
+# listed per backend because the MySQL and SQLite schemas differ.
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Indexes for order history, transaction lookups and catalog sorting',
+        'mysql': [
+            "CREATE INDEX idx_artwork_orders_user_date ON artwork_orders (user_id, order_date)",
+            "CREATE INDEX idx_exhibition_bookings_user_date ON exhibition_bookings (user_id, booking_date)",
+            "CREATE INDEX idx_mpesa_transactions_checkout ON mpesa_transactions (checkout_request_id)",
+            "CREATE INDEX idx_artworks_created_at ON artworks (created_at)",
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_artwork_orders_user_date ON artwork_orders (user_id, order_date)",
+            "CREATE INDEX IF NOT EXISTS idx_exhibition_bookings_user_date ON exhibition_bookings (user_id, booking_date)",
+        ],
+    },
+    {
+        'version': 2,
+        'description': 'Indexes for sorted, filtered and keyset-paginated listings',
+        'mysql': [
+            "CREATE INDEX idx_artworks_status_created_at ON artworks (status, created_at)",
+            "CREATE INDEX idx_artworks_artist_created_at ON artworks (artist, created_at)",
+            "CREATE INDEX idx_artworks_price ON artworks (price)",
+            "CREATE INDEX idx_exhibitions_start_date ON exhibitions (start_date)",
+            "CREATE INDEX idx_exhibitions_status_start_date ON exhibitions (status, start_date)",
+            "CREATE INDEX idx_exhibitions_ticket_price ON exhibitions (ticket_price)",
+            "CREATE INDEX idx_artwork_orders_order_date ON artwork_orders (order_date)",
+            "CREATE INDEX idx_artwork_orders_status_date ON artwork_orders (payment_status, order_date)",
+            "CREATE INDEX idx_artwork_orders_total_amount ON artwork_orders (total_amount)",
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS idx_artworks_artist ON artworks (artist)",
+            "CREATE INDEX IF NOT EXISTS idx_artworks_price ON artworks (price)",
+            "CREATE INDEX IF NOT EXISTS idx_exhibitions_start_date ON exhibitions (start_date)",
+            "CREATE INDEX IF NOT EXISTS idx_exhibitions_price ON exhibitions (price)",
+            "CREATE INDEX IF NOT EXISTS idx_artwork_orders_order_date ON artwork_orders (order_date)",
+            "CREATE INDEX IF NOT EXISTS idx_artwork_orders_status_date ON artwork_orders (payment_status, order_date)",
+            "CREATE INDEX IF NOT EXISTS idx_artwork_orders_total_amount ON artwork_orders (total_amount)",
+            "CREATE INDEX IF NOT EXISTS idx_exhibition_bookings_booking_date ON exhibition_bookings (booking_date)",
+            "CREATE INDEX IF NOT EXISTS idx_exhibition_bookings_status_date ON exhibition_bookings (status, booking_date)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)",
+        ],
+    },
+    {
+        'version': 3,
+        'description': 'One transaction and one order per STK push checkout id',
+        'mysql': [
+            "CREATE UNIQUE INDEX uq_mpesa_transactions_checkout ON mpesa_transactions (checkout_request_id)",
+            "CREATE UNIQUE INDEX uq_artwork_orders_mpesa_transaction ON artwork_orders (mpesa_transaction_id)",
+            "CREATE UNIQUE INDEX uq_exhibition_bookings_mpesa_transaction ON exhibition_bookings (mpesa_transaction_id)",
+        ],
+    },
+]
+
+SCHEMA_MIGRATIONS_TABLE = {
+    'mysql': """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    'sqlite': """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+
+# Queries on the request path that must be served from an index, with
+# sample parameters for EXPLAIN
+HOT_QUERIES = {
+    'mysql': {
+        'user artwork orders': ("""
+            SELECT o.id, o.artwork_id, a.title, o.total_amount, o.payment_status, o.order_date
+            FROM artwork_orders o
+            LEFT JOIN artworks a ON o.artwork_id = a.id
+            WHERE o.user_id = %s
+            ORDER BY o.order_date DESC
+        """, (1,)),
+        'user exhibition bookings': ("""
+            SELECT b.id, b.exhibition_id, e.title, b.total_amount, b.payment_status, b.booking_date
+            FROM exhibition_bookings b
+            LEFT JOIN exhibitions e ON b.exhibition_id = e.id
+            WHERE b.user_id = %s
+            ORDER BY b.booking_date DESC
+        """, (1,)),
+        'transaction by checkout id': ("""
+            SELECT status, result_code, result_desc, order_type, order_id
+            FROM mpesa_transactions
+            WHERE checkout_request_id = %s
+        """, ('ws_check',)),
+        'newest artworks': ("""
+            SELECT id, title, artist, price, image_url, status
+            FROM artworks
+            ORDER BY created_at DESC
+            LIMIT 50
+        """, ()),
+        'orders page by status': ("""
+            SELECT o.id, o.total_amount, o.payment_status, o.order_date
+            FROM artwork_orders o
+            WHERE o.payment_status = %s
+              AND (o.order_date < %s OR (o.order_date = %s AND o.id < %s))
+            ORDER BY o.order_date DESC, o.id DESC
+            LIMIT 51
+        """, ('completed', '2030-01-01', '2030-01-01', 1000000)),
+    },
+    'sqlite': {
+        'user artwork orders': ("""
+            SELECT o.id, o.artwork_id, a.title, o.total_amount, o.payment_status, o.order_date
+            FROM artwork_orders o
+            LEFT JOIN artworks a ON o.artwork_id = a.id
+            WHERE o.user_id = %s
+            ORDER BY o.order_date DESC
+        """, (1,)),
+        'user exhibition bookings': ("""
+            SELECT b.id, b.exhibition_id, e.title, b.total_amount, b.status, b.booking_date
+            FROM exhibition_bookings b
+            LEFT JOIN exhibitions e ON b.exhibition_id = e.id
+            WHERE b.user_id = %s
+            ORDER BY b.booking_date DESC
+        """, (1,)),
+        'payment by checkout id': ("""
+            SELECT result_code, result_desc
+            FROM mpesa_payments
+            WHERE checkout_request_id = %s
+        """, ('ws_check',)),
+        'orders page by status': ("""
+            SELECT o.id, o.total_amount, o.payment_status, o.order_date
+            FROM artwork_orders o
+            WHERE o.payment_status = %s
+              AND (o.order_date < %s OR (o.order_date = %s AND o.id < %s))
+            ORDER BY o.order_date DESC, o.id DESC
+            LIMIT 51
+        """, ('completed', '2030-01-01', '2030-01-01', 1000000)),
+        'artworks page by price': ("""
+            SELECT * FROM artworks
+            WHERE (price > %s OR (price = %s AND id > %s))
+            ORDER BY price ASC, id ASC
+            LIMIT 51
+        """, (100, 100, 0)),
+    },
+}
+
+def applied_versions(backend):
+    """Return the set of migration versions already applied"""
+    backend.execute(SCHEMA_MIGRATIONS_TABLE[backend.name])
+    rows = backend.query("SELECT version FROM schema_migrations")
+    return {row['version'] for row in rows}
+
+# MySQL error for CREATE INDEX on an index name that exists. DDL commits on
+# its own in MySQL, so a migration that failed part way leaves its earlier
+# indexes behind; rerunning it skips them instead of failing on them.
+ER_DUP_KEYNAME = 1061
+
+def _execute_statement(session, statement):
+    try:
+        session.execute(statement)
+    except Exception as e:
+        if getattr(e, 'errno', None) != ER_DUP_KEYNAME:
+            raise
+
+def apply_migrations(backend):
+    """Apply pending migrations in order and return the versions applied"""
+    done = applied_versions(backend)
+    applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m['version']):
+        if migration['version'] in done:
+            continue
+        with backend.transaction() as session:
+            for statement in migration.get(backend.name, []):
+                _execute_statement(session, statement)
+            session.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (migration['version'], migration['description'])
+            )
+        print(f"Applied migration {migration['version']}: {migration['description']}")
+        applied.append(migration['version'])
+    return applied
+
+# SQLite reports a table scan as "SCAN <table>" with no "USING ... INDEX"
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?!.*\bUSING\b.*\bINDEX\b)(?!CONSTANT ROW)', re.IGNORECASE)
+
+def full_scans(backend, query, params):
+    """Return the tables a query reads with a full table scan"""
+    scans = []
+    with backend.transaction() as session:
+        if backend.name == 'sqlite':
+            for row in session.query("EXPLAIN QUERY PLAN " + query, params):
+                if SQLITE_FULL_SCAN.match(row['detail']):
+                    scans.append(row['detail'])
+        else:
+            for row in session.query("EXPLAIN " + query, params):
+                if row.get('type') == 'ALL':
+                    scans.append(f"{row.get('table')} (type=ALL)")
+    return scans
+
+def check_hot_queries(backend):
+    """EXPLAIN every hot query and return {name: [full scans]} for the failures"""
+    failures = {}
+    for name, (query, params) in HOT_QUERIES[backend.name].items():
+        scans = full_scans(backend, query, params)
+        if scans:
+            failures[name] = scans
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations or check hot query plans")
+    parser.add_argument("command", choices=["migrate", "check"])
+    parser.add_argument("--backend", default=None, help="mysql or sqlite (default: DB_BACKEND)")
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend)
+    if args.command == "migrate":
+        applied = apply_migrations(backend)
+        if not applied:
+            print("Database schema is up to date")
+        return 0
+
+    failures = check_hot_queries(backend)
+    for name, scans in failures.items():
+        print(f"FULL SCAN in '{name}': {', '.join(scans)}")
+    if failures:
+        return 1
+    print(f"All {len(HOT_QUERIES[backend.name])} hot queries use an index")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
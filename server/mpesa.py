@@ -8,7 +8,11 @@ import requests
 import base64
 import datetime
 from decimal import Decimal
-from database import get_db_connection
+from db_backend import get_backend
+from cache import invalidate_catalog
+from logger import get_logger
+import job_queue
+import payments
 
 # M-Pesa API configuration
 CONSUMER_KEY = os.environ.get('MPESA_CONSUMER_KEY', 'sMwMwGZ8oOiSkNrUIrPbcCeWIO8UiQ3SV4CyX739uAyZVs1F')
@@ -18,145 +22,109 @@ MPESA_SHORTCODE = os.environ.get('MPESA_SHORTCODE', '174379')  # Default is Safa
 CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'https://webhook.site/3c1f62b5-4214-47d6-9f26-71c1f4b9c8f0')
 API_BASE_URL = "https://sandbox.safaricom.co.ke"
 
+log = get_logger("mpesa")
+
 # Function to initiate STK Push
-def initiate_stk_push(phone_number, amount, account_reference, order_type, order_id, user_id):
-    """Simulate initiating an STK push"""
-    print(f"Initiating STK Push for {phone_number}, amount: {amount}, order: {order_type}-{order_id}")
+def initiate_stk_push(phone_number, amount, account_reference, order_type, order_id, user_id,
+                      checkout_request_id=None, slots=1):
+    """Simulate initiating an STK push for an artwork or exhibition (order_id).
+
+    The pending order or booking and the mpesa_transactions row are created
+    in one transaction, both keyed on checkout_request_id, so a retried job
+    finds them and creates nothing twice.
+    """
+    log.info("Initiating STK Push", order_type=order_type, order_id=order_id, amount=amount)
     
     # Generate unique transaction ID for this request
-    checkout_request_id = f"ws_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{order_id}"
+    checkout_request_id = checkout_request_id or f"ws_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{order_id}"
     merchant_request_id = f"mr_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{order_id}"
     
-    # Save the transaction details to the database
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
+    if order_type not in _ORDER_TABLES:
+        return {"error": "Invalid order type"}
     
-    cursor = connection.cursor()
+    from db_operations import insert_order
     
     try:
-        # First, check if the order exists in the appropriate table
-        if order_type == "artwork":
-            query = """
-            SELECT id, payment_status FROM artwork_orders
-            WHERE id = %s AND user_id = %s
-            """
-        elif order_type == "exhibition":
-            query = """
-            SELECT id, payment_status FROM exhibition_bookings
-            WHERE id = %s AND user_id = %s
-            """
-        else:
-            return {"error": "Invalid order type"}
-            
-        cursor.execute(query, (order_id, user_id))
-        order = cursor.fetchone()
-        
-        if not order:
-            # Create the order if it doesn't exist
-            from db_operations import create_order, create_ticket
+        with get_backend('mysql').transaction(lock=True) as session:
+            existing = session.query_one("""
+                SELECT merchant_request_id, order_id, status FROM mpesa_transactions
+                WHERE checkout_request_id = %s
+                FOR UPDATE
+            """, (checkout_request_id,))
+            if existing is None:
+                order = insert_order(session, order_type, user_id, order_id, amount, slots, checkout_request_id)
+                if order is None:
+                    return {"error": "User not found"}
+                
+                # Insert MPesa transaction record
+                session.execute("""
+                    INSERT INTO mpesa_transactions
+                    (checkout_request_id, merchant_request_id, order_type, order_id, user_id, amount, phone_number, status)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending')
+                """, (
+                    checkout_request_id,
+                    merchant_request_id,
+                    order_type,
+                    order["order_id"],
+                    user_id,
+                    amount,
+                    phone_number
+                ))
+                status = 'pending'
+            else:
+                # Recorded by an earlier attempt of the same job
+                merchant_request_id = existing["merchant_request_id"]
+                order = {"order_id": existing["order_id"]}
+                status = existing["status"]
             
-            if order_type == "artwork":
-                result = create_order(user_id, order_type, order_id, amount)
-                if "error" in result:
-                    return result
-            elif order_type == "exhibition":
-                # For exhibition, we assume slots = 1 if not specified
-                slots = 1
-                result = create_ticket(user_id, order_id, slots)
-                if "error" in result:
-                    return result
+            # For demonstration/development, simulate successful transaction
+            # In production, this would be handled by the MPesa callback.
+            # Settled on the same connection, in the same transaction.
+            settled = False
+            if status == 'pending':  # Always succeed in demo
+                status, settled = _settle(session, checkout_request_id, '0', 'Success')
         
-        # Insert MPesa transaction record
-        query = """
-        INSERT INTO mpesa_transactions 
-        (checkout_request_id, merchant_request_id, order_type, order_id, user_id, amount, phone_number, status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending')
-        """
-        cursor.execute(query, (
-            checkout_request_id,
-            merchant_request_id,
-            order_type,
-            order_id,
-            user_id,
-            amount,
-            phone_number
-        ))
-        connection.commit()
-        
-        # For demonstration/development, simulate successful transaction
-        # In production, this would be handled by the MPesa callback
-        if True:  # Always succeed in demo
-            # Simulate a successful payment after a short delay
-            # In production, this would be handled by the callback
-            update_order_status(order_type, order_id, "completed")
-            
-            # Update the transaction status
-            query = """
-            UPDATE mpesa_transactions
-            SET status = 'completed', result_code = '0', result_desc = 'Success'
-            WHERE checkout_request_id = %s
-            """
-            cursor.execute(query, (checkout_request_id,))
-            connection.commit()
+        if settled and status == 'completed':
+            invalidate_catalog()
         
         return {
             "success": True,
             "checkout_request_id": checkout_request_id,
             "merchant_request_id": merchant_request_id,
+            "status": status,
             "phone_number": phone_number,
-            "amount": amount
+            "amount": amount,
+            **order
         }
     except Exception as e:
-        print(f"Error initiating STK push: {e}")
+        log.error("Error initiating STK push: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def check_transaction_status(checkout_request_id):
     """Check the status of an MPesa transaction"""
-    connection = get_db_connection()
-    if connection is None:
-        return {"error": "Database connection failed"}
-    
-    cursor = connection.cursor()
-    
     try:
         query = """
         SELECT status, result_code, result_desc, order_type, order_id
         FROM mpesa_transactions
         WHERE checkout_request_id = %s
         """
-        cursor.execute(query, (checkout_request_id,))
-        result = cursor.fetchone()
+        result = get_backend('mysql').query_one(query, (checkout_request_id,))
         
         if not result:
-            return {"error": "Transaction not found"}
-        
-        status, result_code, result_desc, order_type, order_id = result
+            return payments.job_status(checkout_request_id) or {"error": "Transaction not found"}
         
         return {
             "success": True,
             "checkout_request_id": checkout_request_id,
-            "status": status,
-            "result_code": result_code,
-            "result_desc": result_desc,
-            "order_type": order_type,
-            "order_id": order_id
+            **result
         }
     except Exception as e:
-        print(f"Error checking transaction status: {e}")
+        log.error("Error checking transaction status: %s", e)
         return {"error": str(e)}
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 def handle_mpesa_callback(callback_data):
     """Handle callback from MPesa API"""
-    print(f"MPesa callback received: {callback_data}")
+    log.debug("MPesa callback received: %s", callback_data)
     
     try:
         # Extract transaction details from callback
@@ -164,197 +132,159 @@ def handle_mpesa_callback(callback_data):
         stkCallback = body.get("stkCallback", {})
         
         checkout_request_id = stkCallback.get("CheckoutRequestID")
-        merchant_request_id = stkCallback.get("MerchantRequestID")
         result_code = stkCallback.get("ResultCode")
         result_desc = stkCallback.get("ResultDesc")
         
-        # Get transaction details from database
-        connection = get_db_connection()
-        if connection is None:
-            return {"error": "Database connection failed"}
-        
-        cursor = connection.cursor()
+        status, settled = settle_transaction(checkout_request_id, result_code, result_desc)
+        if status is None:
+            return {"error": "Transaction not found"}
+        if not settled:
+            return {"success": True, "message": "Transaction already processed"}
         
-        try:
-            # Get transaction details
-            query = """
-            SELECT order_type, order_id, status
-            FROM mpesa_transactions
-            WHERE checkout_request_id = %s
-            """
-            cursor.execute(query, (checkout_request_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                return {"error": "Transaction not found"}
-            
-            order_type, order_id, current_status = result
-            
-            # If transaction is already completed, just return success
-            if current_status == 'completed':
-                return {"success": True, "message": "Transaction already processed"}
-            
-            # Update transaction status based on result code
-            status = 'completed' if result_code == '0' else 'failed'
-            
-            query = """
-            UPDATE mpesa_transactions
-            SET status = %s, result_code = %s, result_desc = %s
-            WHERE checkout_request_id = %s
-            """
-            cursor.execute(query, (status, result_code, result_desc, checkout_request_id))
-            connection.commit()
-            
-            # If payment was successful, update order status
-            if result_code == '0':
-                update_order_status(order_type, order_id, "completed")
-            
-            return {
-                "success": True,
-                "checkout_request_id": checkout_request_id,
-                "status": status
-            }
-        except Exception as e:
-            print(f"Error processing MPesa callback: {e}")
-            return {"error": str(e)}
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+        return {
+            "success": True,
+            "checkout_request_id": checkout_request_id,
+            "status": status
+        }
     except Exception as e:
-        print(f"Error handling MPesa callback: {e}")
+        log.error("Error handling MPesa callback: %s", e)
         return {"error": str(e)}
 
-# We need to modify the update_order_status function to use the correct tables
+# Marks an order paid and takes it out of inventory in one statement. The
+# guards make a repeated settlement change nothing, and refuse to sell an
+# artwork twice or take more exhibition slots than are left.
+_SETTLE_ORDER_QUERIES = {
+    "artwork": """
+        UPDATE artwork_orders o
+        JOIN artworks a ON a.id = o.artwork_id
+        SET o.payment_status = 'completed', a.status = 'sold'
+        WHERE o.id = %s AND o.payment_status <> 'completed' AND a.status <> 'sold'
+    """,
+    "exhibition": """
+        UPDATE exhibition_bookings b
+        JOIN exhibitions e ON e.id = b.exhibition_id
+        SET b.payment_status = 'completed', e.available_slots = e.available_slots - b.slots
+        WHERE b.id = %s AND b.payment_status <> 'completed' AND e.available_slots >= b.slots
+    """,
+}
+
+_ORDER_TABLES = {
+    "artwork": "artwork_orders",
+    "exhibition": "exhibition_bookings",
+}
+
+def _set_order_status(session, order_type, order_id, payment_status):
+    """Update an order's payment status inside a transaction; returns rows changed"""
+    if payment_status == "completed":
+        return session.execute(_SETTLE_ORDER_QUERIES[order_type], (order_id,)).rowcount
+    query = f"UPDATE {_ORDER_TABLES[order_type]} SET payment_status = %s WHERE id = %s"
+    return session.execute(query, (payment_status, order_id)).rowcount
+
+def _settle(session, checkout_request_id, result_code, result_desc):
+    """settle_transaction() inside the caller's transaction; the caller clears the cache"""
+    transaction = session.query_one("""
+        SELECT order_type, order_id, status
+        FROM mpesa_transactions
+        WHERE checkout_request_id = %s
+        FOR UPDATE
+    """, (checkout_request_id,))
+    if transaction is None:
+        return None, False
+    if transaction["status"] != 'pending':
+        # Settled already; a recorded failure is never turned into a payment
+        return transaction["status"], False
+    
+    status = 'completed' if str(result_code) == '0' else 'failed'
+    order_type = transaction["order_type"]
+    if status == 'completed' and order_type in _SETTLE_ORDER_QUERIES:
+        if not _set_order_status(session, order_type, transaction["order_id"], "completed"):
+            # Sold out (or already paid) since the order was placed
+            log.warning("Paid order could not be settled", checkout_request_id=checkout_request_id,
+                        order_type=order_type, order_id=transaction["order_id"])
+            status, result_desc = 'failed', "Order could not be settled: item no longer available"
+    elif status == 'failed' and order_type in _ORDER_TABLES:
+        _set_order_status(session, order_type, transaction["order_id"], "failed")
+    
+    session.execute("""
+        UPDATE mpesa_transactions
+        SET status = %s, result_code = %s, result_desc = %s
+        WHERE checkout_request_id = %s
+    """, (status, result_code, result_desc, checkout_request_id))
+    return status, True
+
+def settle_transaction(checkout_request_id, result_code, result_desc):
+    """Record an M-Pesa result and, if it was paid, settle the order.
+
+    The transaction row is locked, and the transaction, order and inventory
+    are updated in one database transaction on one pooled connection. Only a
+    pending transaction is settled. A payment whose order can no longer be
+    fulfilled (artwork sold, not enough slots) is recorded as failed.
+    Returns (status, settled): status is None if the transaction does not
+    exist, and settled is False if it had already been settled.
+    """
+    with get_backend('mysql').transaction(lock=True) as session:
+        status, settled = _settle(session, checkout_request_id, result_code, result_desc)
+    
+    if settled:
+        if status == 'completed':
+            # Artwork status or exhibition slots changed; only now is it visible
+            invalidate_catalog()
+        log.info("Transaction settled", checkout_request_id=checkout_request_id, status=status)
+    return status, settled
+
 def update_order_status(order_type, order_id, payment_status):
-    """Update order payment status in database"""
-    connection = get_db_connection()
-    if not connection:
+    """Update order payment status (and inventory, once paid) in one transaction"""
+    if order_type not in _ORDER_TABLES:
         return False
     
-    cursor = connection.cursor()
-    
     try:
-        if order_type == "artwork":
-            query = """
-            UPDATE artwork_orders
-            SET payment_status = %s
-            WHERE id = %s
-            """
-        elif order_type == "exhibition":
-            query = """
-            UPDATE exhibition_bookings
-            SET payment_status = %s
-            WHERE id = %s
-            """
-        else:
-            return False
-        
-        cursor.execute(query, (payment_status, order_id))
-        connection.commit()
-        
-        # If it's an artwork order and payment is completed, update artwork status
-        if order_type == "artwork" and payment_status == "completed":
-            query = """
-            UPDATE artworks a
-            JOIN artwork_orders o ON a.id = o.artwork_id
-            SET a.status = 'sold'
-            WHERE o.id = %s
-            """
-            cursor.execute(query, (order_id,))
-            connection.commit()
-        
-        # If it's an exhibition booking and payment is completed, update available slots
-        if order_type == "exhibition" and payment_status == "completed":
-            query = """
-            UPDATE exhibitions e
-            JOIN exhibition_bookings b ON e.id = b.exhibition_id
-            SET e.available_slots = e.available_slots - b.slots
-            WHERE b.id = %s
-            """
-            cursor.execute(query, (order_id,))
-            connection.commit()
-        
-        return True
+        with get_backend('mysql').transaction(lock=True) as session:
+            changed = _set_order_status(session, order_type, order_id, payment_status)
     except Exception as e:
-        print(f"Error updating order: {e}")
+        log.error("Error updating order: %s", e)
         return False
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+    
+    if not changed:
+        # Unknown order, or already paid / sold out when completing
+        return False
+    if payment_status == "completed":
+        # Artwork status or exhibition slots changed
+        invalidate_catalog()
+    
+    return True
 
-# Update the handle_stk_push_request function to work with correct tables
-def handle_stk_push_request(request_data):
-    """Handle STK Push request from frontend"""
-    try:
-        print("STK Push request received:", request_data)
-        
-        phone_number = request_data.get("phoneNumber")
-        amount = request_data.get("amount")
-        order_type = request_data.get("orderType")
-        order_id = request_data.get("orderId")
-        user_id = request_data.get("userId")
-        account_reference = request_data.get("accountReference")
-        callback_url = request_data.get("callbackUrl", CALLBACK_URL)
-        slots = request_data.get("slots", 1)  # For exhibition tickets
-        
-        # Validate required fields
-        required_fields = ["phoneNumber", "amount", "orderType", "orderId", "userId"]
-        missing_fields = []
-        
-        for field in required_fields:
-            value = request_data.get(field)
-            if not value or (isinstance(value, str) and value.strip() == ''):
-                missing_fields.append(field)
-        
-        if missing_fields:
-            error_msg = f"Missing required fields: {', '.join(missing_fields)}"
-            print(error_msg)
-            return {"error": error_msg}
-        
-        # Initialize STK Push
-        stk_result = initiate_stk_push(
-            phone_number, 
-            amount, 
-            account_reference or f"{order_type}-{order_id}", 
-            order_type, 
-            order_id, 
-            user_id
-        )
-        
-        if "error" in stk_result:
-            return stk_result
-        
-        # For development, create order and ticket immediately after STK push initiation
-        from db_operations import create_ticket, create_order
-        
-        if order_type == "exhibition":
-            # Create ticket
-            ticket_result = create_ticket(user_id, order_id, slots)
-            if "error" in ticket_result:
-                return ticket_result
-            
-            return {
-                "success": True,
-                "message": "Exhibition ticket created successfully",
-                "ticket": ticket_result,
-                "stk": stk_result
-            }
-        elif order_type == "artwork":
-            # Create order for artwork
-            order_result = create_order(user_id, "artwork", order_id, amount)
-            if "error" in order_result:
-                return order_result
-            
-            return {
-                "success": True,
-                "message": "Artwork order created successfully",
-                "order": order_result,
-                "stk": stk_result
-            }
-        else:
-            return {"error": "Invalid order type"}
-    except Exception as e:
-        print(f"Error handling STK Push request: {e}")
-        return {"error": str(e)}
+def handle_stk_push_request(request_data, idempotency_key=None):
+    """Queue an STK Push requested by the frontend.
+
+    Returns at once with the checkout_request_id; the payment is initiated by
+    a job worker and clients poll /api/mpesa/status/<checkout_request_id>.
+    """
+    log.debug("STK Push request received: %s", request_data)
+    result = payments.queue_stk_push(request_data, idempotency_key)
+    if "error" in result:
+        return {"error": result["error"]}
+    return result
+
+@job_queue.handler(payments.STK_PUSH_JOB)
+def process_stk_push(payload, checkout_request_id):
+    """Job: create the pending order and initiate the STK push"""
+    order_type = payload["orderType"]
+    order_id = payload["orderId"]
+    
+    stk_result = initiate_stk_push(
+        payload["phoneNumber"],
+        payload["amount"],
+        payload["accountReference"] or f"{order_type}-{order_id}",
+        order_type,
+        order_id,
+        payload["userId"],
+        checkout_request_id=checkout_request_id,
+        slots=payload["slots"]
+    )
+    if stk_result.get("error") == "User not found":
+        raise job_queue.PermanentJobError(stk_result["error"])
+    # Other errors are database failures; raising retries the job
+    if "error" in stk_result:
+        raise RuntimeError(stk_result["error"])
+    
+    return stk_result
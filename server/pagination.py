@@ -0,0 +1,135 @@
+import json
+import base64
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import parse_qs
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Query parameters that are not filters
+RESERVED_PARAMS = ('limit', 'cursor', 'sort')
+
+# A listing describes how one endpoint can be sorted and filtered:
+#
+#   {
+#       'id': ('a.id', 'id'),                          # tiebreaker column, row key
+#       'sorts': {'newest': ('a.created_at', 'created_at', 'desc'), ...},
+#       'default_sort': 'newest',
+#       'filters': {'artist': ('a.artist', '='), 'min_price': ('a.price', '>='), ...},
+#   }
+#
+# Every sort is paired with the id column so pages are stable, and the next
+# page is selected with a keyset predicate on (sort column, id) instead of
+# OFFSET, which keeps each page an index range scan.
+
+class PaginationError(ValueError):
+    """Raised for invalid paging, sorting or filtering parameters"""
+
+def parse_query_params(query_string):
+    """Parse a URL query string into a dict of single values"""
+    return {key: values[-1] for key, values in parse_qs(query_string).items()}
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def encode_cursor(sort_name, sort_value, row_id):
+    """Encode the position after a row as an opaque cursor string"""
+    payload = json.dumps([sort_name, _cursor_value(sort_value), _cursor_value(row_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into (sort_name, sort_value, row_id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_name, sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return sort_name, sort_value, row_id
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+
+def _page_size(params):
+    raw = params.get('limit')
+    if raw is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be at least 1")
+    return min(limit, MAX_PAGE_SIZE)
+
+def build_listing_query(base_query, listing, params, paged=True):
+    """Add filters, keyset position, ordering and a limit to a SELECT.
+
+    base_query is a SELECT ... FROM ... [JOIN ...] without WHERE or ORDER BY.
+    Returns (query, args, page); pass page to finish_page() with the fetched
+    rows. The query uses %s placeholders.
+    """
+    sort_name = params.get('sort') or listing['default_sort']
+    if sort_name not in listing['sorts']:
+        raise PaginationError(f"Unknown sort '{sort_name}', expected one of: {', '.join(listing['sorts'])}")
+    sort_column, sort_key, direction = listing['sorts'][sort_name]
+    id_column, id_key = listing['id']
+
+    conditions = []
+    args = []
+    for name, value in params.items():
+        if name in RESERVED_PARAMS:
+            continue
+        if name not in listing['filters']:
+            raise PaginationError(f"Unknown filter '{name}'")
+        column, operator = listing['filters'][name]
+        conditions.append(f"{column} {operator} %s")
+        args.append(value)
+
+    cursor = params.get('cursor')
+    if cursor:
+        cursor_sort, sort_value, row_id = decode_cursor(cursor)
+        if cursor_sort != sort_name:
+            raise PaginationError("Cursor does not match the requested sort")
+        comparison = '<' if direction == 'desc' else '>'
+        if sort_column == id_column:
+            conditions.append(f"{id_column} {comparison} %s")
+            args.append(row_id)
+        else:
+            conditions.append(
+                f"({sort_column} {comparison} %s OR ({sort_column} = %s AND {id_column} {comparison} %s))"
+            )
+            args.extend([sort_value, sort_value, row_id])
+
+    query = base_query
+    if conditions:
+        query += "\nWHERE " + " AND ".join(conditions)
+    if sort_column == id_column:
+        query += f"\nORDER BY {id_column} {direction.upper()}"
+    else:
+        query += f"\nORDER BY {sort_column} {direction.upper()}, {id_column} {direction.upper()}"
+
+    limit = _page_size(params) if paged else None
+    if limit is not None:
+        # Fetch one extra row to find out whether there is a next page
+        query += "\nLIMIT %s"
+        args.append(limit + 1)
+
+    page = {'limit': limit, 'sort': sort_name, 'sort_key': sort_key, 'id_key': id_key}
+    return query, tuple(args), page
+
+def finish_page(rows, page):
+    """Trim the extra row and return (rows, next_cursor)"""
+    limit = page['limit']
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(page['sort'], last[page['sort_key']], last[page['id_key']])
+
+def is_paged(params):
+    """True when the client asked for a page rather than the full filtered list"""
+    return 'limit' in params or 'cursor' in params
@@ -0,0 +1,150 @@
+# Salted password hashing with configurable cost.
+#
+# Stored hashes name their scheme and parameters, so the cost can be raised
+# later and existing hashes are upgraded the next time their owner logs in:
+#
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+#
+# Older accounts hold an unsalted SHA-256 hex digest; verify_password accepts
+# those and reports that they need rehashing.
+#
+# Hashing is CPU-bound and deliberately slow, so it runs on a small bounded
+# executor: at most PASSWORD_HASH_WORKERS hashes run at once, and at most
+# PASSWORD_HASH_QUEUE more wait, and any further login fails at once with
+# PasswordHasherBusy, so a burst of logins cannot take every request thread
+# and CPU away from the rest of the API. hashlib releases the
+# GIL while it hashes, so the workers run in parallel.
+import os
+import hmac
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME") or 'scrypt'
+# scrypt: memory used is 128 * n * r bytes (16 MiB with the defaults)
+SCRYPT_N = int(os.getenv("SCRYPT_N") or 2 ** 14)
+SCRYPT_R = int(os.getenv("SCRYPT_R") or 8)
+SCRYPT_P = int(os.getenv("SCRYPT_P") or 1)
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS") or 600000)
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or min(4, os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE") or 32)
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+class PasswordHasherBusy(Exception):
+    """Every hashing slot is taken; the caller should answer 503"""
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES)
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, HASH_BYTES)
+
+def current_params(scheme=None):
+    """The configured cost parameters for a scheme"""
+    scheme = scheme or PASSWORD_SCHEME
+    if scheme == 'scrypt':
+        return {'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+    if scheme == 'pbkdf2_sha256':
+        return {'iterations': PBKDF2_ITERATIONS}
+    raise ValueError(f"Unknown password scheme '{scheme}'")
+
+def encode(password, scheme=None, params=None, salt=None):
+    """Hash a password now (in the calling thread) and return the stored form"""
+    scheme = scheme or PASSWORD_SCHEME
+    params = params or current_params(scheme)
+    salt = salt or os.urandom(SALT_BYTES)
+    if scheme == 'scrypt':
+        digest = _scrypt(password, salt, params['n'], params['r'], params['p'])
+        return f"scrypt${params['n']}${params['r']}${params['p']}${_b64(salt)}${_b64(digest)}"
+    if scheme == 'pbkdf2_sha256':
+        digest = _pbkdf2(password, salt, params['iterations'])
+        return f"pbkdf2_sha256${params['iterations']}${_b64(salt)}${_b64(digest)}"
+    raise ValueError(f"Unknown password scheme '{scheme}'")
+
+def _parse(encoded):
+    """Return (scheme, params, salt, digest), or None for unrecognised values"""
+    parts = (encoded or '').split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            params = {'n': int(parts[1]), 'r': int(parts[2]), 'p': int(parts[3])}
+            return 'scrypt', params, _unb64(parts[4]), _unb64(parts[5])
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            return 'pbkdf2_sha256', {'iterations': int(parts[1])}, _unb64(parts[2]), _unb64(parts[3])
+    except ValueError:
+        return None
+    return None
+
+def is_legacy_sha256(encoded):
+    return len(encoded or '') == 64 and all(c in '0123456789abcdef' for c in encoded)
+
+def needs_rehash(encoded):
+    """True unless encoded uses the configured scheme at the configured cost"""
+    parsed = _parse(encoded)
+    return parsed is None or parsed[0] != PASSWORD_SCHEME or parsed[1] != current_params()
+
+def check(password, encoded, allow_plaintext=False):
+    """Verify a password now (in the calling thread).
+
+    Returns (matches, needs_rehash). allow_plaintext accepts values stored as
+    the password itself, which older SQLite databases contain; it never
+    applies to a SHA-256 digest, which would otherwise work as a password.
+    """
+    if password is None or not encoded:
+        return False, False
+    parsed = _parse(encoded)
+    if parsed is not None:
+        scheme, params, salt, expected = parsed
+        if scheme == 'scrypt':
+            digest = _scrypt(password, salt, params['n'], params['r'], params['p'])
+        else:
+            digest = _pbkdf2(password, salt, params['iterations'])
+        matches = hmac.compare_digest(digest, expected)
+        return matches, matches and needs_rehash(encoded)
+    if is_legacy_sha256(encoded):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return (True, True) if hmac.compare_digest(legacy, encoded) else (False, False)
+    if allow_plaintext and hmac.compare_digest(password.encode(), encoded.encode()):
+        return True, True
+    return False, False
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+def _run(func, *args):
+    # Fail fast: waiting for a slot would hold the request thread instead
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy("Too many logins in progress, try again shortly")
+    try:
+        return _executor.submit(func, *args).result()
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    """Hash a password with the configured scheme on the hashing executor"""
+    return _run(encode, password)
+
+def verify_password(password, encoded, allow_plaintext=False):
+    """Check a password on the hashing executor; returns (matches, needs_rehash)"""
+    return _run(check, password, encoded, allow_plaintext)
+
+# Checked when an account does not exist, so unknown emails take as long
+# to reject as wrong passwords
+_DUMMY_HASH = None
+
+def verify_dummy(password):
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = encode('dummy password')
+    verify_password(password or '', _DUMMY_HASH)
@@ -0,0 +1,95 @@
+# STK push requests, shared by the MySQL (mpesa.py) and SQLite (server.py)
+# servers. Each registers its own job_queue handler for STK_PUSH_JOB, which
+# records the payment in its database.
+import json
+import uuid
+import job_queue
+from logger import get_logger
+
+log = get_logger("payments")
+
+STK_PUSH_JOB = "mpesa.stk_push"
+ORDER_TYPES = ("artwork", "exhibition")
+REQUIRED_FIELDS = ["phoneNumber", "amount", "orderType", "orderId", "userId"]
+
+# Status reported while the STK push job has not recorded a transaction yet
+JOB_STATUSES = {
+    job_queue.QUEUED: "queued",
+    job_queue.RUNNING: "processing",
+    job_queue.DONE: "pending",
+    job_queue.FAILED: "failed",
+}
+
+def derived_idempotency_key(payload):
+    """Key shared by requests for the same order, payer and amount"""
+    return "stk:{orderType}:{orderId}:{userId}:{amount}".format(**payload)
+
+def client_idempotency_key(payload, idempotency_key):
+    """A client supplied Idempotency-Key, scoped to the paying user"""
+    return "stk:client:" + json.dumps([str(payload["userId"]), idempotency_key])
+
+def queue_stk_push(request_data, idempotency_key=None):
+    """Validate an STK push request and queue it.
+
+    Returns the response for the client, or {"error", "status"}. A client
+    supplied idempotency key maps to the same job for the same user and
+    request, and is refused (422) for a different request. Without one,
+    repeated requests share a job only while it is queued or running, so
+    the same item can be paid for again once an earlier payment finished.
+    """
+    missing = [field for field in REQUIRED_FIELDS if not str(request_data.get(field) or '').strip()]
+    if missing:
+        error_msg = f"Missing required fields: {', '.join(missing)}"
+        log.warning("%s", error_msg)
+        return {"error": error_msg, "status": 400}
+    if request_data.get("orderType") not in ORDER_TYPES:
+        return {"error": "Invalid order type", "status": 400}
+
+    payload = {field: request_data.get(field) for field in REQUIRED_FIELDS}
+    payload["accountReference"] = request_data.get("accountReference")
+    payload["slots"] = request_data.get("slots") or 1  # For exhibition tickets
+    if idempotency_key is not None:
+        key = client_idempotency_key(payload, idempotency_key)
+    else:
+        key = derived_idempotency_key(payload)
+    try:
+        job, created = job_queue.enqueue(
+            STK_PUSH_JOB,
+            payload,
+            idempotency_key=key,
+            job_id=f"ws_{uuid.uuid4().hex}",
+            reuse_finished=idempotency_key is not None,
+            match_payload=idempotency_key is not None,
+        )
+    except job_queue.IdempotencyConflict:
+        log.warning("Idempotency-Key reused for a different STK push", user_id=payload["userId"])
+        return {"error": "Idempotency-Key was already used for a different payment request", "status": 422}
+    except Exception as e:
+        log.error("Error queueing STK push: %s", e)
+        return {"error": "Could not queue the payment request", "status": 503}
+    if created:
+        log.info("STK push queued", checkout_request_id=job["id"], order_type=payload["orderType"],
+                 order_id=payload["orderId"])
+
+    return {
+        "success": True,
+        "message": "Payment request queued",
+        "checkout_request_id": job["id"],
+        "status": JOB_STATUSES[job["status"]],
+        "stk": {"checkout_request_id": job["id"]},
+    }
+
+def job_status(checkout_request_id):
+    """Status of an STK push from its job, or None if there is no such job"""
+    job = job_queue.get_job(checkout_request_id)
+    if job is None:
+        return None
+    response = {
+        "success": True,
+        "checkout_request_id": checkout_request_id,
+        "status": JOB_STATUSES[job["status"]],
+        "attempts": job["attempts"],
+    }
+    if job["status"] == job_queue.FAILED:
+        response["result_desc"] = job["last_error"]
+    return response
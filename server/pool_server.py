@@ -0,0 +1,131 @@
+import os
+import time
+import queue
+import select
+import threading
+import http.server
+
+# Worker pool configuration (can be overridden from the environment)
+DEFAULT_WORKERS = int(os.getenv("SERVER_WORKERS") or 16)
+DEFAULT_QUEUE_SIZE = int(os.getenv("SERVER_QUEUE_SIZE") or 64)
+
+# Response sent straight to the socket when the server is overloaded
+BUSY_BODY = b'{"error": "Server is busy, please try again shortly"}'
+BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"Content-Length: " + str(len(BUSY_BODY)).encode() + b"\r\n"
+    b"\r\n" + BUSY_BODY
+)
+
+# How often a worker holding an idle keep-alive connection checks whether
+# other connections are waiting for it
+IDLE_POLL_INTERVAL = 0.25
+
+def wait_for_request(connection, rfile, timeout, busy_timeout, is_busy):
+    """Wait until the next request on a connection starts to arrive.
+
+    Returns False when the connection should be closed instead: it stayed
+    idle for timeout seconds, or is_busy() reported connections waiting for
+    a worker and it has been idle for busy_timeout seconds. This keeps idle
+    keep-alive clients from holding every worker while requests queue up.
+    """
+    started = time.monotonic()
+    readable = False
+    while True:
+        # A non-blocking peek sees bytes already buffered (pipelined requests)
+        # as well as ones waiting on the socket
+        connection.setblocking(False)
+        try:
+            pending = rfile.peek(1)
+        except OSError:
+            return False
+        finally:
+            connection.settimeout(timeout)
+        if pending:
+            return True
+        if readable:
+            # Readable but nothing to read: the client closed the connection
+            return False
+        idle = time.monotonic() - started
+        limit = min(timeout, busy_timeout) if is_busy() else timeout
+        if idle >= limit:
+            return False
+        ready, _, _ = select.select([connection], [], [], min(IDLE_POLL_INTERVAL, limit - idle))
+        readable = bool(ready)
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTP server that hands accepted connections to a fixed pool of worker threads.
+
+    Connections wait in a bounded queue until a worker is free. When the queue
+    is full the connection is answered with a 503 right away instead of piling up.
+    """
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.queue_size = queue_size
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._stats_lock = threading.Lock()
+        self.rejected_count = 0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"http-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker, or reject it when the queue is full"""
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected_count += 1
+            self.reject_request(request)
+            self.shutdown_request(request)
+
+    def reject_request(self, request):
+        """Send a 503 response to a connection we have no capacity for"""
+        try:
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+
+    def _worker_loop(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def connections_waiting(self):
+        """True when accepted connections are queued for a worker"""
+        return not self._requests.empty()
+
+    def stats(self):
+        """Return the current pool usage"""
+        with self._stats_lock:
+            rejected = self.rejected_count
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self._requests.qsize(),
+            "rejected": rejected
+        }
+
+    def server_close(self):
+        super().server_close()
+        # Wake every worker up so it can exit
+        for _ in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
@@ -0,0 +1,164 @@
+# In-memory token-bucket rate limiting for abuse-prone endpoints.
+#
+# A limit such as "10/60" allows bursts of 10 requests and refills at 10 per
+# 60 seconds. Buckets are kept per key (client IP, login email, ...) in a
+# sharded dict: each shard has its own lock, a key costs one small tuple, and
+# each shard holds at most RATE_LIMIT_MAX_KEYS / shards keys. Buckets that have
+# refilled completely carry no information and are swept away periodically;
+# a new key arriving at a full shard evicts the least recently used one.
+#
+# Limits are attached to routes when they are registered:
+#
+#   router.add('POST', '/api/login', limited(APIHandler.handle_login, LOGIN_BY_IP, LOGIN_BY_EMAIL))
+import os
+import math
+import time
+import threading
+from functools import wraps
+from serialization import dumps_bytes
+
+RATE_LIMIT_ENABLED = (os.getenv("RATE_LIMIT_ENABLED") or 'true').lower() == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS") or 100000)
+RATE_LIMIT_SHARDS = 16
+# Seconds between sweeps of a shard
+RATE_LIMIT_SWEEP_INTERVAL = 60
+# Use the first X-Forwarded-For address as the client IP (only behind a proxy
+# that sets it)
+TRUST_PROXY = (os.getenv("TRUST_PROXY") or 'false').lower() == 'true'
+
+def parse_limit(text):
+    """Parse "requests/seconds" into (capacity, period)"""
+    requests, _, seconds = text.partition('/')
+    capacity, period = float(requests), float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit '{text}'")
+    return capacity, period
+
+class _Shard:
+    __slots__ = ('buckets', 'lock', 'next_sweep')
+
+    def __init__(self):
+        self.buckets = {}   # key -> (tokens, updated_at), oldest first
+        self.lock = threading.Lock()
+        self.next_sweep = time.monotonic() + RATE_LIMIT_SWEEP_INTERVAL
+
+class RateLimiter:
+    """Token buckets keyed by string, in a bounded sharded dict"""
+
+    def __init__(self, name, limit, max_keys=RATE_LIMIT_MAX_KEYS, shards=RATE_LIMIT_SHARDS):
+        self.name = name
+        self.capacity, self.period = parse_limit(limit)
+        self.rate = self.capacity / self.period
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_size = max(1, max_keys // shards)
+        self.rejected = 0
+
+    def hit(self, key, cost=1):
+        """Take cost tokens from key's bucket.
+
+        Returns 0 if the request is allowed, otherwise the seconds to wait
+        before it would be.
+        """
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = time.monotonic()
+        with shard.lock:
+            if now >= shard.next_sweep:
+                self._sweep(shard, now)
+            entry = shard.buckets.pop(key, None)
+            if entry is None:
+                tokens = self.capacity
+                if len(shard.buckets) >= self._shard_size:
+                    # Full of active keys: drop the least recently used one
+                    del shard.buckets[next(iter(shard.buckets))]
+            else:
+                tokens, updated_at = entry
+                tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            # (Re-)inserted at the end, so the dict stays in least recently used order
+            if tokens >= cost:
+                shard.buckets[key] = (tokens - cost, now)
+                return 0
+            shard.buckets[key] = (tokens, now)
+            self.rejected += 1
+        return (cost - tokens) / self.rate
+
+    def _sweep(self, shard, now):
+        """Drop buckets that have refilled completely"""
+        shard.next_sweep = now + RATE_LIMIT_SWEEP_INTERVAL
+        for key, (tokens, updated_at) in list(shard.buckets.items()):
+            if tokens + (now - updated_at) * self.rate >= self.capacity:
+                del shard.buckets[key]
+
+    def reset(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.buckets.clear()
+
+    def stats(self):
+        return {
+            "keys": sum(len(shard.buckets) for shard in self._shards),
+            "rejected": self.rejected,
+        }
+
+def client_ip(handler):
+    if TRUST_PROXY:
+        forwarded = handler.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return handler.client_address[0]
+
+def body_field(name):
+    """Key function reading a (case-insensitive) field of the JSON request body.
+
+    A body that is not a JSON object has no key, so only the other rules apply.
+    """
+    def key(handler):
+        body = handler._json_body()
+        value = body.get(name) if isinstance(body, dict) else None
+        return value.strip().lower() if isinstance(value, str) and value.strip() else None
+    return key
+
+class Rule:
+    """A limiter plus the function that picks its key from a request.
+
+    needs_body tells limited() to check rules that do not read the body first,
+    so a flood from one IP is refused without reading what it sent.
+    """
+
+    def __init__(self, limiter, key, needs_body=False):
+        self.limiter = limiter
+        self.key = key
+        self.needs_body = needs_body
+
+def _rule(name, env, default, key, needs_body=False):
+    return Rule(RateLimiter(name, os.getenv(env) or default), key, needs_body)
+
+LOGIN_BY_IP = _rule("login-ip", "RATE_LIMIT_LOGIN_IP", "20/60", client_ip)
+LOGIN_BY_EMAIL = _rule("login-email", "RATE_LIMIT_LOGIN_EMAIL", "5/60", body_field('email'), needs_body=True)
+CONTACT_BY_IP = _rule("contact-ip", "RATE_LIMIT_CONTACT_IP", "5/60", client_ip)
+STK_PUSH_BY_IP = _rule("stkpush-ip", "RATE_LIMIT_STKPUSH_IP", "10/60", client_ip)
+
+def check(handler, rules):
+    """Return the Retry-After seconds for the first rule that refuses the request, or 0"""
+    for rule in sorted(rules, key=lambda rule: rule.needs_body):
+        key = rule.key(handler)
+        if key is None:
+            continue
+        wait = rule.limiter.hit(key)
+        if wait:
+            return wait
+    return 0
+
+def limited(handler_method, *rules):
+    """Wrap a route handler so requests over any of the rules get 429"""
+    @wraps(handler_method)
+    def wrapper(self, *args, **kwargs):
+        if RATE_LIMIT_ENABLED:
+            wait = check(self, rules)
+            if wait:
+                if self._body_cache is None:
+                    # The body was not read; do not reuse the connection
+                    self._last_request = True
+                body = dumps_bytes({"error": "Too many requests, try again later"})
+                return self._send_body(body, 429, headers={'Retry-After': str(math.ceil(wait))})
+        return handler_method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,153 @@
+import re
+import time
+
+# Converters for typed path parameters, e.g. /api/artworks/<int:artwork_id>
+PARAM_CONVERTERS = {
+    'int': int,
+    'str': str,
+    'path': str,
+}
+
+PARAM_PATTERN = re.compile(r'^<(?:(\w+):)?(\w+)>$')
+
+class _Node:
+    """One path segment in the route trie"""
+
+    __slots__ = ('children', 'params', 'catch_all', 'methods', 'pattern')
+
+    def __init__(self):
+        self.children = {}      # literal segment -> _Node
+        self.params = []        # [(name, converter, _Node)] tried in registration order
+        self.catch_all = None   # (name, _Node) for <path:...> parameters
+        self.methods = {}       # HTTP method -> handler
+        self.pattern = None
+
+class Router:
+    """Method-aware request router with typed path parameters.
+
+    Patterns are split into segments once when they are registered. Paths
+    without parameters are found with a single dict lookup; the rest walk a
+    segment trie, so lookup cost depends on path depth and not on the number
+    of routes.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._static = {}
+        self._timing_hooks = []
+
+    def add(self, method, pattern, handler):
+        """Register a handler for an HTTP method and path pattern"""
+        node = self._root
+        segments = pattern.strip('/').split('/')
+        is_static = True
+        for index, segment in enumerate(segments):
+            match = PARAM_PATTERN.match(segment)
+            if not match:
+                node = node.children.setdefault(segment, _Node())
+                continue
+
+            is_static = False
+            type_name, name = match.group(1) or 'str', match.group(2)
+            if type_name not in PARAM_CONVERTERS:
+                raise ValueError(f"Unknown parameter type '{type_name}' in route {pattern}")
+
+            if type_name == 'path':
+                if index != len(segments) - 1:
+                    raise ValueError(f"path parameter must be the last segment in route {pattern}")
+                if node.catch_all is None:
+                    node.catch_all = (name, _Node())
+                node = node.catch_all[1]
+                continue
+
+            converter = PARAM_CONVERTERS[type_name]
+            for existing_name, existing_converter, child in node.params:
+                if existing_name == name and existing_converter is converter:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((name, converter, child))
+                node = child
+
+        if method in node.methods:
+            raise ValueError(f"Duplicate route {method} {pattern}")
+        node.methods[method] = handler
+        node.pattern = pattern
+        if is_static:
+            self._static[pattern.rstrip('/') or '/'] = node
+
+    def add_timing_hook(self, hook):
+        """Call hook(method, pattern, elapsed_seconds) after every dispatched request"""
+        self._timing_hooks.append(hook)
+
+    def _find(self, path):
+        """Return (node, params) for a path, or (None, None) if nothing matches"""
+        node = self._static.get(path.rstrip('/') or '/')
+        if node is not None:
+            return node, {}
+        segments = path.strip('/').split('/')
+        return self._walk(self._root, segments, 0, {})
+
+    def _walk(self, node, segments, index, params):
+        if index == len(segments):
+            return (node, params) if node.methods else (None, None)
+
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found, found_params = self._walk(child, segments, index + 1, params)
+            if found is not None:
+                return found, found_params
+
+        for name, converter, child in node.params:
+            if not segment:
+                break
+            try:
+                value = converter(segment)
+            except ValueError:
+                continue
+            found, found_params = self._walk(child, segments, index + 1, {**params, name: value})
+            if found is not None:
+                return found, found_params
+
+        if node.catch_all is not None:
+            name, child = node.catch_all
+            return child, {**params, name: '/'.join(segments[index:])}
+
+        return None, None
+
+    def resolve(self, method, path):
+        """Look up a route.
+
+        Returns (handler, params, pattern, allowed_methods). handler is None
+        when nothing matches; allowed_methods is then non-empty if the path
+        exists but does not support the method (405) and empty otherwise (404).
+        """
+        node, params = self._find(path)
+        if node is None:
+            return None, None, None, ()
+        handler = node.methods.get(method)
+        if handler is None and method == 'HEAD':
+            handler = node.methods.get('GET')
+        if handler is None:
+            return None, None, node.pattern, tuple(sorted(node.methods))
+        return handler, params, node.pattern, ()
+
+    def dispatch(self, target, method, path):
+        """Run the matching handler as handler(target, **params).
+
+        Returns (matched, allowed_methods) so the caller can send 404 or 405.
+        """
+        handler, params, pattern, allowed = self.resolve(method, path)
+        if handler is None:
+            return False, allowed
+
+        start = time.perf_counter()
+        try:
+            handler(target, **params)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self._timing_hooks:
+                hook(method, pattern, elapsed)
+        return True, ()
@@ -0,0 +1,38 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+# orjson is used when it is installed (pip install orjson); the standard
+# library encoder is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(obj):
+    """Encode the database types the standard encoder does not know about"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# One shared encoder instance instead of building a JSONEncoder per call
+_encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+
+if orjson is not None:
+    def dumps_bytes(data):
+        """Encode data (including Decimal and datetime values) to UTF-8 JSON bytes"""
+        return orjson.dumps(data, default=_default)
+else:
+    def dumps_bytes(data):
+        """Encode data (including Decimal and datetime values) to UTF-8 JSON bytes"""
+        return _encoder.encode(data).encode('utf-8')
+
+def dumps(data):
+    """Encode data to a JSON string"""
+    return dumps_bytes(data).decode('utf-8')
+
+def encoder_name():
+    """Name of the JSON backend in use"""
+    return 'orjson' if orjson is not None else 'json'
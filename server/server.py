@@ -4,222 +4,283 @@ import http.server
 import json
 import urllib.parse
 from urllib.parse import urlparse
-import mimetypes
-from decimal import Decimal
-from datetime import datetime
+from email.utils import formatdate
 import sqlite3
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before importing modules that read them)
 load_dotenv()
 
+from pool_server import PooledHTTPServer, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, wait_for_request
+from async_server import AsyncHTTPServer
+from router import Router
+from db_backend import SQLiteBackend
+from migrations import apply_migrations
+from serialization import dumps_bytes
+from pagination import parse_query_params, build_listing_query, finish_page, is_paged, PaginationError
+from static_files import (
+    STATIC_ROOT, RangeNotSatisfiable, resolve_static_path, content_type_for, cache_control_for,
+    file_etag, is_not_modified, parse_range, send_file_range,
+)
+from compression import COMPRESSION_MIN_BYTES, is_compressible, negotiate, compress, StreamCompressor, precompressed_path
+from uploads import receive_upload, UploadError
+from rate_limit import limited, LOGIN_BY_IP, LOGIN_BY_EMAIL, CONTACT_BY_IP, STK_PUSH_BY_IP
+from passwords import hash_password, verify_password, verify_dummy, PasswordHasherBusy
+import image_pipeline
+import job_queue
+from payments import STK_PUSH_JOB, queue_stk_push, job_status
+from logger import get_logger
+from cache import catalog_cache, catalog_key, cached_catalog, invalidate_catalog, cached_response, etag_matches
+
+log = get_logger("server")
+access_log = get_logger("access")
+
 # Database configuration
 DATABASE_FILE = os.getenv("DATABASE_FILE") or 'database.db'
 
+# "persistent" reuses one tuned connection per worker thread,
+# "per_request" opens a fresh connection for every call
+SQLITE_CONNECTION_MODE = os.getenv("SQLITE_CONNECTION_MODE") or 'persistent'
+db = SQLiteBackend(DATABASE_FILE, persistent=SQLITE_CONNECTION_MODE == 'persistent')
+
+# Serving engine: "threaded" (worker pool) or "asyncio"
+SERVER_ENGINE = os.getenv("SERVER_ENGINE") or 'threaded'
+
+# Large listings are streamed: rows are fetched STREAM_CHUNK_ROWS at a time
+# and written out whenever STREAM_BUFFER_BYTES of JSON have accumulated
+STREAM_LISTINGS = (os.getenv("STREAM_LISTINGS") or 'true').lower() == 'true'
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS") or 500)
+STREAM_BUFFER_BYTES = 64 * 1024
+
+# Keep-alive configuration
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT") or 15)
+# Idle connections are closed after this many seconds instead while other
+# connections wait for a worker
+KEEPALIVE_BUSY_TIMEOUT = float(os.getenv("KEEPALIVE_BUSY_TIMEOUT") or 0.5)
+MAX_KEEPALIVE_REQUESTS = int(os.getenv("MAX_KEEPALIVE_REQUESTS") or 100)
+
 # Function to initialize the database
 def initialize_database():
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-
-        # Create users table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL,
-                phone TEXT
-            )
-        """)
-
-        # Create admins table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL
-            )
-        """)
-
-        # Create artworks table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS artworks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                artist TEXT NOT NULL,
-                year INTEGER,
-                description TEXT,
-                image_url TEXT,
-                price REAL NOT NULL,
-                admin_id INTEGER,
-                FOREIGN KEY (admin_id) REFERENCES admins (id)
-            )
-        """)
-
-        # Create exhibitions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS exhibitions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                start_date TEXT NOT NULL,
-                end_date TEXT NOT NULL,
-                description TEXT,
-                image_url TEXT,
-                price REAL NOT NULL,
-                admin_id INTEGER,
-                FOREIGN KEY (admin_id) REFERENCES admins (id)
-            )
-        """)
-
-        # Create artwork_orders table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS artwork_orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                artwork_id INTEGER,
-                total_amount REAL NOT NULL,
-                payment_status TEXT NOT NULL,
-                order_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (artwork_id) REFERENCES artworks (id)
-            )
-        """)
-
-        # Create exhibition_bookings table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS exhibition_bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                exhibition_id INTEGER,
-                total_amount REAL NOT NULL,
-                booking_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (exhibition_id) REFERENCES exhibitions (id)
-            )
-        """)
-
-        # Create contact_messages table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS contact_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                message TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create messages table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                message TEXT NOT NULL,
-                is_read INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Create mpesa_payments table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mpesa_payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL NOT NULL,
-                phone_number TEXT NOT NULL,
-                checkout_request_id TEXT UNIQUE,
-                merchant_request_id TEXT,
-                mpesa_receipt_number TEXT,
-                transaction_date DATETIME,
-                result_code INTEGER,
-                result_desc TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-
-        conn.commit()
-        print("Database initialized successfully.")
+        with db.transaction() as session:
+            # Create users table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL UNIQUE,
+                    password TEXT NOT NULL,
+                    phone TEXT
+                )
+            """)
+
+            # Create admins table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS admins (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL UNIQUE,
+                    password TEXT NOT NULL
+                )
+            """)
+
+            # Create artworks table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS artworks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    artist TEXT NOT NULL,
+                    year INTEGER,
+                    description TEXT,
+                    image_url TEXT,
+                    price REAL NOT NULL,
+                    admin_id INTEGER,
+                    FOREIGN KEY (admin_id) REFERENCES admins (id)
+                )
+            """)
+
+            # Create exhibitions table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS exhibitions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    description TEXT,
+                    image_url TEXT,
+                    price REAL NOT NULL,
+                    admin_id INTEGER,
+                    FOREIGN KEY (admin_id) REFERENCES admins (id)
+                )
+            """)
+
+            # Create artwork_orders table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS artwork_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    artwork_id INTEGER,
+                    total_amount REAL NOT NULL,
+                    payment_status TEXT NOT NULL,
+                    order_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (artwork_id) REFERENCES artworks (id)
+                )
+            """)
+
+            # Create exhibition_bookings table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS exhibition_bookings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    exhibition_id INTEGER,
+                    total_amount REAL NOT NULL,
+                    booking_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (exhibition_id) REFERENCES exhibitions (id)
+                )
+            """)
+
+            # Create contact_messages table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS contact_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create messages table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    is_read INTEGER DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create mpesa_payments table
+            session.execute("""
+                CREATE TABLE IF NOT EXISTS mpesa_payments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    amount REAL NOT NULL,
+                    phone_number TEXT NOT NULL,
+                    checkout_request_id TEXT UNIQUE,
+                    merchant_request_id TEXT,
+                    mpesa_receipt_number TEXT,
+                    transaction_date DATETIME,
+                    result_code INTEGER,
+                    result_desc TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            """)
+
+        log.info("Database initialized")
         return True
     except Exception as e:
-        print(f"Error initializing database: {e}")
+        log.error("Error initializing database: %s", e)
         return False
-    finally:
-        if conn:
-            conn.close()
 
-# Function to get a database connection
-def get_db_connection():
+def stream_query(query, params=(), transform=None):
+    """Run a query now and return an iterator that fetches its rows in chunks"""
+    rows = db.stream(query, params, chunk_size=STREAM_CHUNK_ROWS)
+    return (transform(row) for row in rows) if transform else rows
+
+def get_listing(base_query, listing, params, key, transform=None):
+    """Run a sorted/filtered listing query, one page at a time when limit or cursor is given"""
+    try:
+        query, args, page = build_listing_query(base_query, listing, params, is_paged(params))
+    except PaginationError as e:
+        return {"error": str(e)}, 400
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-        return conn
+        rows, next_cursor = finish_page(db.query(query, args), page)
+        if transform:
+            rows = [transform(row) for row in rows]
+        result = {key: rows}
+        if page['limit']:
+            result["nextCursor"] = next_cursor
+        return result, 200
     except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+        log.error("Error getting %s: %s", key, e)
+        return {"error": str(e)}, 500
 
 # --- User Authentication ---
 def register_user(name, email, password, phone):
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
+    if not password:
+        return {"error": "Password is required"}, 400
     try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO users (name, email, password, phone) VALUES (?, ?, ?, ?)",
-                       (name, email, password, phone))
-        conn.commit()
-        user_id = cursor.lastrowid
+        # Hashed before taking a database connection
+        hashed_password = hash_password(password)
+    except PasswordHasherBusy as e:
+        return {"error": str(e)}, 503
+    try:
+        _, user_id = db.execute("INSERT INTO users (name, email, password, phone) VALUES (%s, %s, %s, %s)",
+                                (name, email, hashed_password, phone))
         return {"message": "User registered successfully", "user_id": user_id}, 201
     except sqlite3.IntegrityError:
         return {"error": "Email already registered"}, 400
     except Exception as e:
-        print(f"Registration error: {e}")
+        log.error("Registration error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
+
+def check_credentials(table, columns, email, password):
+    """Return the users/admins row (as a dict of columns) whose password matches, or None.
+
+    Accounts created before passwords were hashed store them as plain text;
+    those, like outdated hashes, are rehashed after a successful login.
+    """
+    account = db.query_one(f"SELECT {columns}, password FROM {table} WHERE email = %s", (email,))
+    if account is None:
+        verify_dummy(password)
+        return None
+    stored = account.pop('password')
+    matches, rehash = verify_password(password, stored, allow_plaintext=True)
+    if not matches:
+        return None
+    if rehash:
+        new_hash = hash_password(password)
+        try:
+            # Skipped if the password was changed in the meantime
+            db.execute(f"UPDATE {table} SET password = %s WHERE id = %s AND password = %s",
+                       (new_hash, account['id'], stored))
+        except Exception as e:
+            log.error("Error upgrading password hash: %s", e)
+    return account
 
 def login_user(email, password):
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, email, phone FROM users WHERE email = ? AND password = ?", (email, password))
-        user = cursor.fetchone()
+        user = check_credentials("users", "id, name, email, phone", email, password)
         if user:
-            user_dict = dict(user)
-            return {"message": "Login successful", "user": user_dict}, 200
+            return {"message": "Login successful", "user": user}, 200
         else:
             return {"error": "Invalid credentials"}, 401
+    except PasswordHasherBusy as e:
+        return {"error": str(e)}, 503
     except Exception as e:
-        print(f"Login error: {e}")
+        log.error("Login error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 # --- Admin Authentication ---
 def login_admin(email, password):
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, email FROM admins WHERE email = ? AND password = ?", (email, password))
-        admin = cursor.fetchone()
+        admin = check_credentials("admins", "id, name, email", email, password)
         if admin:
-            admin_dict = dict(admin)
-            return {"message": "Admin login successful", "admin": admin_dict}, 200
+            return {"message": "Admin login successful", "admin": admin}, 200
         else:
             return {"error": "Invalid credentials"}, 401
+    except PasswordHasherBusy as e:
+        return {"error": str(e)}, 503
     except Exception as e:
-        print(f"Admin login error: {e}")
+        log.error("Admin login error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 # --- Artwork Management ---
 def create_artwork(auth_header, data):
@@ -227,81 +288,93 @@ def create_artwork(auth_header, data):
     if not auth_header:
         return {"error": "Authentication required"}, 401
     
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
+        _, artwork_id = db.execute("""
             INSERT INTO artworks (title, artist, year, description, image_url, price, admin_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """, (data['title'], data['artist'], data.get('year'), data.get('description'), data.get('image_url'), data['price'], 1))  # Assuming admin_id is 1
-        conn.commit()
-        artwork_id = cursor.lastrowid
+        invalidate_catalog()
         return {"message": "Artwork created successfully", "artwork_id": artwork_id}, 201
     except Exception as e:
-        print(f"Artwork creation error: {e}")
+        log.error("Artwork creation error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
-def get_all_artworks():
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
+def with_image_variants(row):
+    """Add the URLs of the generated thumbnail, medium and WebP variants"""
+    row['imageVariants'] = image_pipeline.variant_urls(row.get('image_url'))
+    return row
+
+ARTWORKS_SELECT = "SELECT * FROM artworks"
+ALL_ARTWORKS_QUERY = ARTWORKS_SELECT
+
+ARTWORK_LISTING = {
+    'id': ('id', 'id'),
+    'sorts': {
+        'newest': ('id', 'id', 'desc'),
+        'oldest': ('id', 'id', 'asc'),
+        'price_asc': ('price', 'price', 'asc'),
+        'price_desc': ('price', 'price', 'desc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'artist': ('artist', '='),
+        'min_price': ('price', '>='),
+        'max_price': ('price', '<='),
+        'year': ('year', '='),
+    },
+}
+
+def get_all_artworks(params=None):
+    if params:
+        return get_listing(ARTWORKS_SELECT, ARTWORK_LISTING, params, "artworks", with_image_variants)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM artworks")
-        artworks = [dict(row) for row in cursor.fetchall()]
+        artworks = [with_image_variants(row) for row in db.query(ALL_ARTWORKS_QUERY)]
         return {"artworks": artworks}, 200
     except Exception as e:
-        print(f"Error getting artworks: {e}")
+        log.error("Error getting artworks: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 def get_artwork(artwork_id):
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM artworks WHERE id = ?", (artwork_id,))
-        artwork = cursor.fetchone()
+        artwork = db.query_one("SELECT * FROM artworks WHERE id = %s", (artwork_id,))
         if artwork:
-            return {"artwork": dict(artwork)}, 200
+            return {"artwork": with_image_variants(artwork)}, 200
         else:
             return {"error": "Artwork not found"}, 404
     except Exception as e:
-        print(f"Error getting artwork: {e}")
+        log.error("Error getting artwork: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 def update_artwork(auth_header, artwork_id, data):
     # Verify auth token
     if not auth_header:
         return {"error": "Authentication required"}, 401
     
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE artworks SET title = ?, artist = ?, year = ?, description = ?, image_url = ?, price = ?
-            WHERE id = ?
+        rowcount, _ = db.execute("""
+            UPDATE artworks SET title = %s, artist = %s, year = %s, description = %s, image_url = %s, price = %s
+            WHERE id = %s
         """, (data['title'], data['artist'], data.get('year'), data.get('description'), data.get('image_url'), data['price'], artwork_id))
-        conn.commit()
-        if cursor.rowcount > 0:
+        invalidate_catalog()
+        if rowcount > 0:
             return {"message": "Artwork updated successfully"}, 200
         else:
             return {"error": "Artwork not found"}, 404
     except Exception as e:
-        print(f"Artwork update error: {e}")
+        log.error("Artwork update error: %s", e)
+        return {"error": str(e)}, 500
+
+def delete_artwork(artwork_id):
+    try:
+        rowcount, _ = db.execute("DELETE FROM artworks WHERE id = %s", (artwork_id,))
+        invalidate_catalog()
+        if rowcount > 0:
+            return {"message": "Artwork deleted successfully"}, 200
+        else:
+            return {"error": "Artwork not found"}, 404
+    except Exception as e:
+        log.error("Artwork deletion error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 # --- Exhibition Management ---
 def create_exhibition(auth_header, data):
@@ -309,181 +382,299 @@ def create_exhibition(auth_header, data):
     if not auth_header:
         return {"error": "Authentication required"}, 401
     
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
+        _, exhibition_id = db.execute("""
             INSERT INTO exhibitions (title, start_date, end_date, description, image_url, price, admin_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
         """, (data['title'], data['start_date'], data['end_date'], data.get('description'), data.get('image_url'), data['price'], 1))  # Assuming admin_id is 1
-        conn.commit()
-        exhibition_id = cursor.lastrowid
+        invalidate_catalog()
         return {"message": "Exhibition created successfully", "exhibition_id": exhibition_id}, 201
     except Exception as e:
-        print(f"Exhibition creation error: {e}")
+        log.error("Exhibition creation error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
-def get_all_exhibitions():
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
+EXHIBITIONS_SELECT = "SELECT * FROM exhibitions"
+
+EXHIBITION_LISTING = {
+    'id': ('id', 'id'),
+    'sorts': {
+        'upcoming': ('start_date', 'start_date', 'asc'),
+        'latest': ('start_date', 'start_date', 'desc'),
+        'price_asc': ('price', 'price', 'asc'),
+        'price_desc': ('price', 'price', 'desc'),
+    },
+    'default_sort': 'upcoming',
+    'filters': {
+        'min_price': ('price', '>='),
+        'max_price': ('price', '<='),
+        'date_from': ('start_date', '>='),
+        'date_to': ('start_date', '<'),
+    },
+}
+
+def get_all_exhibitions(params=None):
+    if params:
+        return get_listing(EXHIBITIONS_SELECT, EXHIBITION_LISTING, params, "exhibitions", with_image_variants)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM exhibitions")
-        exhibitions = [dict(row) for row in cursor.fetchall()]
+        exhibitions = [with_image_variants(row) for row in db.query(EXHIBITIONS_SELECT)]
         return {"exhibitions": exhibitions}, 200
     except Exception as e:
-        print(f"Error getting exhibitions: {e}")
+        log.error("Error getting exhibitions: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 def get_exhibition(exhibition_id):
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM exhibitions WHERE id = ?", (exhibition_id,))
-        exhibition = cursor.fetchone()
+        exhibition = db.query_one("SELECT * FROM exhibitions WHERE id = %s", (exhibition_id,))
         if exhibition:
-            return {"exhibition": dict(exhibition)}, 200
+            return {"exhibition": with_image_variants(exhibition)}, 200
         else:
             return {"error": "Exhibition not found"}, 404
     except Exception as e:
-        print(f"Error getting exhibition: {e}")
+        log.error("Error getting exhibition: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 # --- Ticket Management ---
+TICKETS_SELECT = """
+    SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id, e.title as exhibition_title,
+           e.image_url as exhibition_image_url, b.booking_date, b.status, b.total_amount
+    FROM exhibition_bookings b
+    JOIN users u ON b.user_id = u.id
+    JOIN exhibitions e ON b.exhibition_id = e.id
+"""
+ALL_TICKETS_QUERY = TICKETS_SELECT + "    ORDER BY b.booking_date DESC\n"
+
+TICKET_LISTING = {
+    'id': ('b.id', 'id'),
+    'sorts': {
+        'newest': ('b.booking_date', 'booking_date', 'desc'),
+        'oldest': ('b.booking_date', 'booking_date', 'asc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'status': ('b.status', '='),
+        'exhibition_id': ('b.exhibition_id', '='),
+        'user_id': ('b.user_id', '='),
+        'date_from': ('b.booking_date', '>='),
+        'date_to': ('b.booking_date', '<'),
+    },
+}
+
 def get_all_tickets():
-    # Placeholder function - replace with actual implementation
-    return {"message": "Tickets endpoint hit"}, 200
+    try:
+        return {"tickets": db.query(ALL_TICKETS_QUERY)}, 200
+    except Exception as e:
+        log.error("Error getting tickets: %s", e)
+        return {"error": str(e)}, 500
 
 # --- Order Management ---
+ARTWORK_ORDERS_SELECT = """
+    SELECT o.id, o.user_id, u.name as user_name, o.artwork_id as reference_id, 
+           a.title as item_title, o.total_amount as amount, o.payment_status, 
+           'artwork' as type, o.order_date as created_at
+    FROM artwork_orders o
+    JOIN users u ON o.user_id = u.id
+    LEFT JOIN artworks a ON o.artwork_id = a.id
+"""
+ALL_ARTWORK_ORDERS_QUERY = ARTWORK_ORDERS_SELECT + "    ORDER BY o.order_date DESC\n"
+
+# Filtered or paged /api/orders requests list artwork orders only;
+# exhibition bookings are listed through /api/tickets
+ORDER_LISTING = {
+    'id': ('o.id', 'id'),
+    'sorts': {
+        'newest': ('o.order_date', 'created_at', 'desc'),
+        'oldest': ('o.order_date', 'created_at', 'asc'),
+        'amount_asc': ('o.total_amount', 'amount', 'asc'),
+        'amount_desc': ('o.total_amount', 'amount', 'desc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'payment_status': ('o.payment_status', '='),
+        'user_id': ('o.user_id', '='),
+        'min_amount': ('o.total_amount', '>='),
+        'max_amount': ('o.total_amount', '<='),
+        'date_from': ('o.order_date', '>='),
+        'date_to': ('o.order_date', '<'),
+    },
+}
+
+ALL_EXHIBITION_BOOKINGS_QUERY = """
+    SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id as reference_id, 
+           e.title as item_title, b.total_amount as amount, b.status as payment_status, 
+           'exhibition' as type, b.booking_date as created_at
+    FROM exhibition_bookings b
+    JOIN users u ON b.user_id = u.id
+    LEFT JOIN exhibitions e ON b.exhibition_id = e.id
+    ORDER BY b.booking_date DESC
+"""
+
 def get_all_orders():
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
+        # Artwork orders and exhibition bookings, read in one transaction
+        with db.transaction() as session:
+            artwork_orders = session.query(ALL_ARTWORK_ORDERS_QUERY)
+            exhibition_bookings = session.query(ALL_EXHIBITION_BOOKINGS_QUERY)
+        
+        return {"orders": artwork_orders, "bookings": exhibition_bookings}, 200
+    except Exception as e:
+        log.error("Error getting all orders: %s", e)
+        return {"error": str(e)}, 500
+
+def get_user_orders(auth_header, user_id):
+    # Verify auth token
+    if not auth_header:
+        return {"error": "Authentication required"}, 401
+    
+    try:
+        with db.transaction() as session:
+            # Get artwork orders for the user
+            orders = session.query("""
+                SELECT o.id, o.user_id, u.name as user_name, o.artwork_id as reference_id, 
+                    a.title as item_title, o.total_amount as amount, o.payment_status, 
+                    'artwork' as type, o.order_date as created_at
+                FROM artwork_orders o
+                JOIN users u ON o.user_id = u.id
+                LEFT JOIN artworks a ON o.artwork_id = a.id
+                WHERE o.user_id = %s
+                ORDER BY o.order_date DESC
+            """, (user_id,))
+            
+            # Get exhibition bookings for the user
+            bookings = session.query("""
+                SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id as reference_id, 
+                    e.title as item_title, b.total_amount as amount, b.status as payment_status, 
+                    'exhibition' as type, b.booking_date as created_at
+                FROM exhibition_bookings b
+                JOIN users u ON b.user_id = u.id
+                LEFT JOIN exhibitions e ON b.exhibition_id = e.id
+                WHERE b.user_id = %s
+                ORDER BY b.booking_date DESC
+            """, (user_id,))
         
-        # Fetch artwork orders
-        cursor.execute("""
-            SELECT o.id, o.user_id, u.name as user_name, o.artwork_id as reference_id, 
-                   a.title as item_title, o.total_amount as amount, o.payment_status, 
-                   'artwork' as type, o.order_date as created_at
-            FROM artwork_orders o
-            JOIN users u ON o.user_id = u.id
-            LEFT JOIN artworks a ON o.artwork_id = a.id
-            ORDER BY o.order_date DESC
-        """)
-        artwork_orders = [dict(row) for row in cursor.fetchall()]
+        # Combine both results
+        all_orders = orders + bookings
         
-        # Fetch exhibition bookings
-        cursor.execute("""
-            SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id as reference_id, 
-                   e.title as item_title, b.total_amount as amount, b.status as payment_status, 
-                   'exhibition' as type, b.booking_date as created_at
-            FROM exhibition_bookings b
-            JOIN users u ON b.user_id = u.id
-            LEFT JOIN exhibitions e ON b.exhibition_id = e.id
-            ORDER BY b.booking_date DESC
-        """)
-        exhibition_bookings = [dict(row) for row in cursor.fetchall()]
+        # Sort by date (newest first)
+        all_orders.sort(key=lambda x: x.get('created_at', ''), reverse=True)
         
-        return {"orders": artwork_orders, "bookings": exhibition_bookings}, 200
+        return {"orders": all_orders}, 200
     except Exception as e:
-        print(f"Error getting all orders: {e}")
+        log.error("Error getting user orders: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        if conn:
-            conn.close()
 
 # --- Contact Messages ---
 def create_contact_message(data):
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO contact_messages (name, email, message) VALUES (?, ?, ?)",
-                       (data['name'], data['email'], data['message']))
-        conn.commit()
-        message_id = cursor.lastrowid
+        _, message_id = db.execute("INSERT INTO contact_messages (name, email, message) VALUES (%s, %s, %s)",
+                                   (data['name'], data['email'], data['message']))
         return {"message": "Message created successfully", "message_id": message_id}, 201
     except Exception as e:
-        print(f"Message creation error: {e}")
+        log.error("Message creation error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 # --- Messages ---
+MESSAGES_SELECT = "SELECT * FROM messages"
+ALL_MESSAGES_QUERY = MESSAGES_SELECT + " ORDER BY created_at DESC"
+
+MESSAGE_LISTING = {
+    'id': ('id', 'id'),
+    'sorts': {
+        'newest': ('created_at', 'created_at', 'desc'),
+        'oldest': ('created_at', 'created_at', 'asc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'is_read': ('is_read', '='),
+        'email': ('email', '='),
+        'date_from': ('created_at', '>='),
+        'date_to': ('created_at', '<'),
+    },
+}
+
 def get_messages(auth_header):
     # Verify auth token
     if not auth_header:
         return {"error": "Authentication required"}, 401
     
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM messages ORDER BY created_at DESC")
-        messages = [dict(row) for row in cursor.fetchall()]
-        return {"messages": messages}, 200
+        return {"messages": db.query(ALL_MESSAGES_QUERY)}, 200
     except Exception as e:
-        print(f"Error getting messages: {e}")
+        log.error("Error getting messages: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 def update_message(auth_header, message_id, data):
     # Verify auth token
     if not auth_header:
         return {"error": "Authentication required"}, 401
     
-    conn = get_db_connection()
-    if conn is None:
-        return {"error": "Database connection failed"}, 500
     try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE messages SET is_read = ? WHERE id = ?", (data['is_read'], message_id))
-        conn.commit()
-        if cursor.rowcount > 0:
+        rowcount, _ = db.execute("UPDATE messages SET is_read = %s WHERE id = %s", (data['is_read'], message_id))
+        if rowcount > 0:
             return {"message": "Message updated successfully"}, 200
         else:
             return {"error": "Message not found"}, 404
     except Exception as e:
-        print(f"Message update error: {e}")
+        log.error("Message update error: %s", e)
         return {"error": str(e)}, 500
-    finally:
-        conn.close()
 
 # --- M-Pesa Integration ---
-def handle_stk_push_request(data):
-    # Placeholder function - replace with actual implementation
-    return {"message": "STK push request received", "data": data}, 200
+# STK pushes are initiated by job workers (see payments.py); the request
+# returns the checkout_request_id at once and clients poll its status.
+def handle_stk_push_request(data, idempotency_key=None):
+    result = queue_stk_push(data, idempotency_key)
+    if "error" in result:
+        return {"error": result["error"]}, result["status"]
+    return result, 202
+
+@job_queue.handler(STK_PUSH_JOB)
+def process_stk_push(payload, checkout_request_id):
+    """Job: record the STK push payment (simulated as successful, as in mpesa.py)"""
+    merchant_request_id = f"mr_{checkout_request_id[3:]}"
+    # Connection errors are retried by the job queue.
+    # OR IGNORE: a retried job must not record the payment twice
+    db.execute("""
+        INSERT OR IGNORE INTO mpesa_payments
+            (user_id, amount, phone_number, checkout_request_id, merchant_request_id,
+             transaction_date, result_code, result_desc)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, 0, 'Success')
+    """, (payload["userId"], payload["amount"], payload["phoneNumber"],
+          checkout_request_id, merchant_request_id))
+    return {"checkout_request_id": checkout_request_id, "merchant_request_id": merchant_request_id}
 
 def handle_mpesa_callback(data):
     # Placeholder function - replace with actual implementation
-    print("M-Pesa callback data:", data)
+    log.info("M-Pesa callback received")
     return {"message": "M-Pesa callback received"}, 200
 
 def check_transaction_status(checkout_request_id):
-    # Placeholder function - replace with actual implementation
-    return {"message": f"Transaction status for {checkout_request_id}"}, 200
+    try:
+        payment = db.query_one(
+            "SELECT result_code, result_desc FROM mpesa_payments WHERE checkout_request_id = %s",
+            (checkout_request_id,))
+    except Exception as e:
+        log.error("Error checking transaction status: %s", e)
+        return {"error": str(e)}, 500
+    if payment is not None:
+        result_code = payment["result_code"]
+        status = "pending" if result_code is None else "completed" if result_code == 0 else "failed"
+        return {
+            "success": True,
+            "checkout_request_id": checkout_request_id,
+            "status": status,
+            "result_code": result_code,
+            "result_desc": payment["result_desc"],
+        }, 200
+
+    response = job_status(checkout_request_id)
+    if response is None:
+        return {"error": "Transaction not found"}, 404
+    return response, 200
 
 def ensure_uploads_directory():
     uploads_dir = os.path.join(os.path.dirname(__file__), "static", "uploads")
     if not os.path.exists(uploads_dir):
         os.makedirs(uploads_dir)
-        print(f"Created directory: {uploads_dir}")
+        log.info("Created directory %s", uploads_dir)
 
 # Call this function to ensure directory exists
 ensure_uploads_directory()
@@ -505,9 +696,9 @@ def create_default_image():
             d.text((300, 200), "No Image Available", fill=(100, 100, 100))
             
             img.save(default_image_path)
-            print(f"Created default placeholder image at {default_image_path}")
+            log.info("Created default placeholder image at %s", default_image_path)
         except Exception as e:
-            print(f"Failed to create default image: {e}")
+            log.warning("Failed to create default image: %s", e)
             # Fallback: Create a simple file
             with open(default_image_path, "w") as f:
                 f.write("Default Image Placeholder")
@@ -515,8 +706,9 @@ def create_default_image():
 # Try to create the default image
 try:
     create_default_image()
+
 except Exception as e:
-    print(f"Failed to create default image: {e}, continuing anyway")
+    log.warning("Failed to create default image: %s, continuing anyway", e)
 
 # Ensure the public placeholder.svg is available
 def create_placeholder_svg():
@@ -529,318 +721,514 @@ def create_placeholder_svg():
             </svg>"""
             with open(placeholder_path, "w") as f:
                 f.write(svg_content)
-            print(f"Created placeholder SVG at {placeholder_path}")
+            log.info("Created placeholder SVG at %s", placeholder_path)
         except Exception as e:
-            print(f"Failed to create placeholder SVG: {e}")
+            log.warning("Failed to create placeholder SVG: %s", e)
 
 # Create placeholder SVG
 create_placeholder_svg()
 
-# Custom JSON encoder to handle Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return float(obj)
-        elif isinstance(obj, datetime):
-            return obj.isoformat()
-        return super(DecimalEncoder, self).default(obj)
-
 class APIHandler(http.server.BaseHTTPRequestHandler):
-    def _set_headers(self, status_code=200, content_type='application/json'):
+    # HTTP/1.1 keeps connections open between requests; idle sockets are
+    # dropped after `timeout` seconds
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    max_keepalive_requests = MAX_KEEPALIVE_REQUESTS
+    _last_request = False
+    _body_cache = None
+
+    def handle(self):
+        """Serve requests on this connection until the client or a limit closes it"""
+        self.close_connection = True
+        served = 0
+        while True:
+            if not wait_for_request(self.connection, self.rfile, self.timeout,
+                                    KEEPALIVE_BUSY_TIMEOUT, self._server_busy):
+                break
+            served += 1
+            self._last_request = served >= self.max_keepalive_requests
+            self.handle_one_request()
+            if self.close_connection or self._last_request:
+                break
+
+    def _server_busy(self):
+        waiting = getattr(self.server, 'connections_waiting', None)
+        return waiting is not None and waiting()
+
+    def log_message(self, format, *args):
+        # Access lines go through the logging queue instead of straight to stderr
+        access_log.info("%s " + format, self.address_string(), *args)
+
+    def _set_headers(self, status_code=200, content_type='application/json', content_length=0, headers=None):
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(content_length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        if self._last_request:
+            self.send_header('Connection', 'close')
         self.end_headers()
     
     def do_OPTIONS(self):
         self._set_headers()
     
-    def _parse_json_body(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        return json.loads(post_data.decode('utf-8'))
+    def _read_body(self):
+        """Read the request body so the connection is ready for the next request"""
+        content_length = int(self.headers.get('Content-Length') or 0)
+        if content_length <= 0:
+            return b''
+        return self.rfile.read(content_length)
+    
+    def _choose_encoding(self, content_type, length):
+        """Content coding to apply to a response body, or None"""
+        if length < COMPRESSION_MIN_BYTES or not is_compressible(content_type):
+            return None
+        return negotiate(self.headers.get('Accept-Encoding'))
+    
+    def _send_body(self, body, status_code=200, content_type='application/json', headers=None,
+                   content_encoding=None):
+        """Send a complete body, compressing it unless content_encoding says it already is"""
+        headers = dict(headers or {})
+        if is_compressible(content_type):
+            headers['Vary'] = 'Accept-Encoding'
+            if content_encoding is None:
+                content_encoding = self._choose_encoding(content_type, len(body))
+                if content_encoding:
+                    body = compress(body, content_encoding)
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        self._set_headers(status_code, content_type, len(body), headers)
+        if self.command != 'HEAD':
+            self.wfile.write(body)
     
     def _send_response(self, data, status_code=200):
-        self._set_headers(status_code)
-        self.wfile.write(json.dumps(data, cls=DecimalEncoder).encode())
+        self._send_body(dumps_bytes(data), status_code)
     
-    def _serve_static_file(self, file_path):
-        try:
-            # Determine content type based on file extension
-            content_type, _ = mimetypes.guess_type(file_path)
-            if content_type is None:
-                content_type = 'application/octet-stream'
-            
-            with open(file_path, 'rb') as file:
-                self._set_headers(200, content_type)
-                self.wfile.write(file.read())
-        except FileNotFoundError:
-            # Serve default placeholder instead
-            placeholder_path = os.path.join(os.path.dirname(__file__), "static", "placeholder.svg")
-            if os.path.exists(placeholder_path):
-                with open(placeholder_path, 'rb') as file:
-                    self._set_headers(200, 'image/svg+xml')
-                    self.wfile.write(file.read())
-            else:
-                self._set_headers(404)
-                self.wfile.write(b'File not found')
+    def _send_cached(self, key, render):
+        """Send a cached public GET response, or 304 if the client's copy is current"""
+        response = cached_response(key, render)
+        if response.etag is None:
+            return self._send_body(response.body, response.status)
+        body, etag = response.body, response.etag
+        encoding = self._choose_encoding('application/json', len(body))
+        if encoding:
+            # Compressed variants are cached with the entry and get their own ETag
+            body = response.variants.get(encoding)
+            if body is None:
+                body = response.variants[encoding] = compress(response.body, encoding)
+            etag = f'{etag[:-1]}-{encoding}"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            return self._send_not_modified(headers)
+        self._send_body(body, response.status, headers=headers, content_encoding=encoding or '')
     
-    def do_GET(self):
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        # Special handling for placeholder.svg
-        if path == '/placeholder.svg':
-            placeholder_path = os.path.join(os.path.dirname(__file__), "static", "placeholder.svg")
-            return self._serve_static_file(placeholder_path)
-        
-        # Handle static files
-        if path.startswith('/static/'):
-            file_path = os.path.join(os.path.dirname(__file__), path[1:])  # Remove leading /
-            return self._serve_static_file(file_path)
-        
-        # Handle API endpoints
-        if path == '/api/artworks':
-            result, status_code = get_all_artworks()
-            self._send_response(result, status_code)
-        
-        elif path.startswith('/api/artworks/'):
-            artwork_id = path.split('/')[-1]
-            result, status_code = get_artwork(artwork_id)
-            self._send_response(result, status_code)
-        
-        elif path == '/api/exhibitions':
-            result, status_code = get_all_exhibitions()
-            self._send_response(result, status_code)
+    def _send_not_modified(self, headers):
+        self.send_response(304)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if self._last_request:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+    
+    def _send_json_stream(self, sections, status_code=200):
+        """Stream a JSON object whose values are arrays built from row iterators.
+
+        sections is a list of (key, rows) pairs. Rows are encoded one at a
+        time and sent with chunked transfer encoding, so memory use does not
+        grow with the number of rows.
+        """
+        if self.request_version == 'HTTP/1.0' or self.command == 'HEAD':
+            # No chunked encoding available (or no body wanted), so buffer the response
+            data = {key: list(rows) for key, rows in sections}
+            return self._send_response(data, status_code)
         
-        elif path.startswith('/api/exhibitions/'):
-            exhibition_id = path.split('/')[-1]
-            result, status_code = get_exhibition(exhibition_id)
-            self._send_response(result, status_code)
+        encoding = negotiate(self.headers.get('Accept-Encoding'))
+        compressor = StreamCompressor(encoding) if encoding else None
         
-        elif path == '/api/tickets':
-            auth_header = self.headers.get('Authorization')
-            result, status_code = get_all_tickets()
-            self._send_response(result, status_code)
+        self.send_response(status_code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if self._last_request:
+            self.send_header('Connection', 'close')
+        self.end_headers()
         
-        elif path == '/api/orders':
-            auth_header = self.headers.get('Authorization')
-            result, status_code = get_all_orders()
-            self._send_response(result, status_code)
+        buffer = bytearray(b'{')
+        try:
+            for index, (key, rows) in enumerate(sections):
+                if index:
+                    buffer += b','
+                buffer += dumps_bytes(key) + b':['
+                first = True
+                for row in rows:
+                    if not first:
+                        buffer += b','
+                    buffer += dumps_bytes(row)
+                    first = False
+                    if len(buffer) >= STREAM_BUFFER_BYTES:
+                        self._write_chunk(compressor.compress(buffer) if compressor else buffer)
+                        buffer.clear()
+                buffer += b']'
+            buffer += b'}'
+            if compressor:
+                self._write_chunk(compressor.compress(buffer))
+                self._write_chunk(compressor.flush())
+            else:
+                self._write_chunk(buffer)
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # Headers are already sent; drop the connection so the client sees a truncated body
+            log.error("Error while streaming response: %s", e)
+            self.close_connection = True
+        finally:
+            for _, rows in sections:
+                close = getattr(rows, 'close', None)
+                if close:
+                    close()
+    
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write(b'%X\r\n' % len(data) + bytes(data) + b'\r\n')
+    
+    def _serve_static_file(self, file_path):
+        """Send a file with validators, conditional GET, byte ranges and precompressed variants"""
+        try:
+            file = open(file_path, 'rb')
+        except (FileNotFoundError, IsADirectoryError):
+            # Serve default placeholder instead
+            placeholder_path = os.path.join(STATIC_ROOT, "placeholder.svg")
+            if file_path != placeholder_path and os.path.exists(placeholder_path):
+                return self._serve_static_file(placeholder_path)
+            return self._send_body(b'File not found', 404, 'text/plain')
         
-        elif path.startswith('/api/users/') and '/orders' in path:
-            auth_header = self.headers.get('Authorization')
-            user_id = path.split('/')[3]  # Extract user_id from /api/users/{user_id}/orders
+        with file:
+            stat = os.fstat(file.fileno())
+            content_type = content_type_for(file_path)
+            etag = file_etag(stat)
+            headers = {
+                'ETag': etag,
+                'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+                'Cache-Control': cache_control_for(file_path),
+                'Accept-Ranges': 'bytes',
+            }
+            encoding = None
+            if is_compressible(content_type):
+                headers['Vary'] = 'Accept-Encoding'
+                encoding = self._choose_encoding(content_type, stat.st_size)
+                if encoding:
+                    # Every encoding is a separate representation with its own ETag
+                    etag = headers['ETag'] = f'{etag[:-1]}-{encoding}"'
+            if is_not_modified(self.headers, etag, stat.st_mtime):
+                return self._send_not_modified(headers)
             
-            # Verify auth token
-            if not auth_header:
-                self._send_response({"error": "Authentication required"}, 401)
-                return
-                
-            # Connect to database and fetch orders for this user
-            connection = get_db_connection()
-            if connection is None:
-                self._send_response({"error": "Database connection failed"}, 500)
-                return
-                
-            try:
-                cursor = connection.cursor()
-                # Get artwork orders for the user
-                cursor.execute("""
-                    SELECT o.id, o.user_id, u.name as user_name, o.artwork_id as reference_id, 
-                        a.title as item_title, o.total_amount as amount, o.payment_status, 
-                        'artwork' as type, o.order_date as created_at
-                    FROM artwork_orders o
-                    JOIN users u ON o.user_id = u.id
-                    LEFT JOIN artworks a ON o.artwork_id = a.id
-                    WHERE o.user_id = ?
-                    ORDER BY o.order_date DESC
-                """, (user_id,))
-                
-                orders = [dict(row) for row in cursor.fetchall()]
-                
-                # Get exhibition bookings for the user
-                cursor.execute("""
-                    SELECT b.id, b.user_id, u.name as user_name, b.exhibition_id as reference_id, 
-                        e.title as item_title, b.total_amount as amount, b.status as payment_status, 
-                        'exhibition' as type, b.booking_date as created_at
-                    FROM exhibition_bookings b
-                    JOIN users u ON b.user_id = u.id
-                    LEFT JOIN exhibitions e ON b.exhibition_id = e.id
-                    WHERE b.user_id = ?
-                    ORDER BY b.booking_date DESC
-                """, (user_id,))
-                
-                bookings = [dict(row) for row in cursor.fetchall()]
-                
-                # Combine both results
-                all_orders = orders + bookings
-                
-                # Sort by date (newest first)
-                all_orders.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-                
-                self._send_response({"orders": all_orders})
-            except Exception as e:
-                print(f"Error getting user orders: {e}")
-                self._send_response({"error": str(e)}, 500)
-            finally:
-                connection.close()
-        
-        elif path.startswith('/api/messages'):
-            auth_header = self.headers.get('Authorization')
-            result, status_code = get_messages(auth_header)
-            self._send_response(result, status_code)
-        
-        elif path.startswith('/api/mpesa/status/'):
-            checkout_request_id = path.split('/')[-1]
-            result, status_code = check_transaction_status(checkout_request_id)
-            self._send_response(result, status_code)
-        
-        else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode())
+            if encoding:
+                with open(precompressed_path(file_path, encoding, STATIC_ROOT), 'rb') as variant:
+                    headers['Content-Encoding'] = encoding
+                    return self._send_file(variant, content_type, headers, etag, stat.st_mtime)
+            self._send_file(file, content_type, headers, etag, stat.st_mtime)
     
-    def do_POST(self):
+    def _send_file(self, file, content_type, headers, etag, mtime):
+        size = os.fstat(file.fileno()).st_size
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length).decode('utf-8')
-            
+            byte_range = parse_range(self.headers, size, etag, mtime)
+        except RangeNotSatisfiable:
+            headers['Content-Range'] = f"bytes */{size}"
+            return self._set_headers(416, content_type, 0, headers)
+        
+        status_code = 200
+        start, end = 0, size - 1
+        if byte_range:
+            status_code = 206
+            start, end = byte_range
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        count = end - start + 1
+        self._set_headers(status_code, content_type, count, headers)
+        if self.command != 'HEAD' and count > 0:
+            send_file_range(self.connection, self.wfile, file, start, count)
+    
+    def _json_body(self):
+        """Parse the request body as JSON, falling back to form encoding"""
+        if self._body_cache is None:
+            post_data = self._read_body().decode('utf-8')
             try:
-                data = json.loads(post_data)
+                self._body_cache = json.loads(post_data) if post_data else {}
             except json.JSONDecodeError:
                 data = urllib.parse.parse_qs(post_data)
                 # Convert lists to single values
                 for key in data:
                     if isinstance(data[key], list) and len(data[key]) == 1:
                         data[key] = data[key][0]
-            
-            if self.path == '/api/register':
-                result, status_code = register_user(
-                    data.get('name'),
-                    data.get('email'),
-                    data.get('password'),
-                    data.get('phone', '')
-                )
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/login':
-                result, status_code = login_user(
-                    data.get('email'),
-                    data.get('password')
-                )
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/admin-login':
-                result, status_code = login_admin(
-                    data.get('email'),
-                    data.get('password')
-                )
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/artworks':
-                auth_header = self.headers.get('Authorization')
-                result, status_code = create_artwork(auth_header, data)
-                self._send_response(result, status_code)
-            
-            elif self.path.startswith('/api/artworks/'):
-                artwork_id = self.path.split('/')[-1]
-                auth_header = self.headers.get('Authorization')
-                result, status_code = update_artwork(auth_header, artwork_id, data)
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/exhibitions':
-                auth_header = self.headers.get('Authorization')
-                result, status_code = create_exhibition(auth_header, data)
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/mpesa/stkpush':
-                auth_header = self.headers.get('Authorization')
-                result, status_code = handle_stk_push_request(data)
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/contact':
-                result, status_code = create_contact_message(data)
-                self._send_response(result, status_code)
-            
-            elif self.path.startswith('/api/messages/'):
-                message_id = self.path.split('/')[-1]
-                auth_header = self.headers.get('Authorization')
-                result, status_code = update_message(auth_header, message_id, data)
-                self._send_response(result, status_code)
-            
-            elif self.path == '/api/mpesa/callback':
-                result, status_code = handle_mpesa_callback(data)
-                self._send_response(result, status_code)
-            
-            else:
-                self._set_headers(404)
-                self.wfile.write(json.dumps({"error": "Not found"}).encode())
-                
+                self._body_cache = data
+        return self._body_cache
+    
+    def _dispatch(self, method):
+        self._body_cache = None
+        path = urlparse(self.path).path
+        try:
+            matched, allowed = router.dispatch(self, method, path)
+            if not matched:
+                # Drain any body so the connection can be reused
+                self._read_body()
+                if allowed:
+                    self._send_method_not_allowed(allowed)
+                else:
+                    self._send_response({"error": "Not found"}, 404)
         except Exception as e:
-            print(f"Error handling POST request: {e}")
-            self._set_headers(500)
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            log.exception("Error handling %s request for %s", method, path)
+            self._send_response({"error": str(e)}, 500)
+    
+    def _send_method_not_allowed(self, allowed):
+        body = dumps_bytes({"error": "Method not allowed"})
+        self.send_response(405)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Allow', ', '.join(allowed))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if self._last_request:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        self._dispatch('GET')
+    
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+    
+    def do_POST(self):
+        self._dispatch('POST')
     
     def do_PUT(self):
-        content_length = int(self.headers['Content-Length'])
-        body = self.rfile.read(content_length).decode('utf-8')
-        data = json.loads(body)
-        
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        if path.startswith('/api/artworks/'):
-            artwork_id = path.split('/')[-1]
-            auth_header = self.headers.get('Authorization')
-            result, status_code = update_artwork(auth_header, artwork_id, data)
-            self._send_response(result, status_code)
-        else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode())
+        self._dispatch('PUT')
     
     def do_DELETE(self):
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        if path.startswith('/api/artworks/'):
-            artwork_id = path.split('/')[-1]
-            # Placeholder: Add authentication check here if needed
-            
-            conn = get_db_connection()
-            if conn is None:
-                self._send_response({"error": "Database connection failed"}, 500)
-                return
-            
-            try:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM artworks WHERE id = ?", (artwork_id,))
-                conn.commit()
-                if cursor.rowcount > 0:
-                    self._send_response({"message": "Artwork deleted successfully"}, 200)
-                else:
-                    self._send_response({"error": "Artwork not found"}, 404)
-            except Exception as e:
-                print(f"Artwork deletion error: {e}")
-                self._send_response({"error": str(e)}, 500)
-            finally:
-                conn.close()
-        else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not found"}).encode())
+        self._dispatch('DELETE')
+    
+    # --- Route handlers ---
+    def serve_placeholder(self):
+        self._serve_static_file(os.path.join(STATIC_ROOT, "placeholder.svg"))
+    
+    def serve_static(self, file_path):
+        path = resolve_static_path(urllib.parse.unquote(file_path))
+        if path is None:
+            return self._send_body(b'File not found', 404, 'text/plain')
+        self._serve_static_file(path)
+    
+    def _query_params(self):
+        return parse_query_params(urlparse(self.path).query)
+    
+    def handle_get_artworks(self):
+        params = self._query_params()
+        if not params and STREAM_LISTINGS and catalog_cache.ttl <= 0:
+            return self._send_json_stream([("artworks", stream_query(ALL_ARTWORKS_QUERY, transform=with_image_variants))])
+        self._send_cached(
+            catalog_key("artworks", params),
+            lambda: cached_catalog("artworks", params, lambda: get_all_artworks(params))
+        )
+    
+    def handle_get_artwork(self, artwork_id):
+        self._send_cached(("artwork", artwork_id), lambda: get_artwork(artwork_id))
+    
+    def handle_create_artwork(self):
+        auth_header = self.headers.get('Authorization')
+        result, status_code = create_artwork(auth_header, self._json_body())
+        self._send_response(result, status_code)
+    
+    def handle_update_artwork(self, artwork_id):
+        auth_header = self.headers.get('Authorization')
+        result, status_code = update_artwork(auth_header, artwork_id, self._json_body())
+        self._send_response(result, status_code)
+    
+    def handle_delete_artwork(self, artwork_id):
+        result, status_code = delete_artwork(artwork_id)
+        self._send_response(result, status_code)
+    
+    def handle_get_exhibitions(self):
+        params = self._query_params()
+        self._send_cached(
+            catalog_key("exhibitions", params),
+            lambda: cached_catalog("exhibitions", params, lambda: get_all_exhibitions(params))
+        )
+    
+    def handle_get_exhibition(self, exhibition_id):
+        self._send_cached(("exhibition", exhibition_id), lambda: get_exhibition(exhibition_id))
+    
+    def handle_create_exhibition(self):
+        auth_header = self.headers.get('Authorization')
+        result, status_code = create_exhibition(auth_header, self._json_body())
+        self._send_response(result, status_code)
+    
+    def handle_get_tickets(self):
+        params = self._query_params()
+        if params:
+            result, status_code = get_listing(TICKETS_SELECT, TICKET_LISTING, params, "tickets")
+            return self._send_response(result, status_code)
+        if STREAM_LISTINGS:
+            return self._send_json_stream([("tickets", stream_query(ALL_TICKETS_QUERY))])
+        result, status_code = get_all_tickets()
+        self._send_response(result, status_code)
+    
+    def handle_get_orders(self):
+        params = self._query_params()
+        if params:
+            result, status_code = get_listing(ARTWORK_ORDERS_SELECT, ORDER_LISTING, params, "orders")
+            return self._send_response(result, status_code)
+        if STREAM_LISTINGS:
+            return self._send_json_stream([
+                ("orders", stream_query(ALL_ARTWORK_ORDERS_QUERY)),
+                ("bookings", stream_query(ALL_EXHIBITION_BOOKINGS_QUERY)),
+            ])
+        result, status_code = get_all_orders()
+        self._send_response(result, status_code)
+    
+    def handle_get_user_orders(self, user_id):
+        auth_header = self.headers.get('Authorization')
+        result, status_code = get_user_orders(auth_header, user_id)
+        self._send_response(result, status_code)
+    
+    def handle_get_messages(self):
+        auth_header = self.headers.get('Authorization')
+        params = self._query_params()
+        if params:
+            if not auth_header:
+                return self._send_response({"error": "Authentication required"}, 401)
+            result, status_code = get_listing(MESSAGES_SELECT, MESSAGE_LISTING, params, "messages")
+            return self._send_response(result, status_code)
+        if STREAM_LISTINGS and auth_header:
+            return self._send_json_stream([("messages", stream_query(ALL_MESSAGES_QUERY))])
+        result, status_code = get_messages(auth_header)
+        self._send_response(result, status_code)
+    
+    def handle_update_message(self, message_id):
+        auth_header = self.headers.get('Authorization')
+        result, status_code = update_message(auth_header, message_id, self._json_body())
+        self._send_response(result, status_code)
+    
+    def handle_register(self):
+        data = self._json_body()
+        result, status_code = register_user(
+            data.get('name'),
+            data.get('email'),
+            data.get('password'),
+            data.get('phone', '')
+        )
+        self._send_response(result, status_code)
+    
+    def handle_login(self):
+        data = self._json_body()
+        result, status_code = login_user(data.get('email'), data.get('password'))
+        self._send_response(result, status_code)
+    
+    def handle_admin_login(self):
+        data = self._json_body()
+        result, status_code = login_admin(data.get('email'), data.get('password'))
+        self._send_response(result, status_code)
+    
+    def handle_contact(self):
+        result, status_code = create_contact_message(self._json_body())
+        self._send_response(result, status_code)
+    
+    def handle_upload(self):
+        """Stream an image from the request body to static/uploads"""
+        if not self.headers.get('Authorization'):
+            # Do not read an unauthenticated body; close the connection instead
+            self._last_request = True
+            return self._send_response({"error": "Authentication required"}, 401)
+        try:
+            upload = receive_upload(self.rfile, self.headers)
+        except UploadError as e:
+            # The rest of the body may be unread
+            self._last_request = True
+            return self._send_response({"error": str(e)}, e.status_code)
+        # Thumbnails and WebP variants are generated in the background
+        image_pipeline.submit(upload["url"])
+        self._send_response({
+            "url": upload["url"],
+            "contentType": upload["content_type"],
+            "size": upload["size"],
+            "sha256": upload["sha256"],
+        }, 201 if upload["created"] else 200)
+    
+    def handle_stk_push(self):
+        result, status_code = handle_stk_push_request(self._json_body(), self.headers.get('Idempotency-Key'))
+        self._send_response(result, status_code)
+    
+    def handle_mpesa_callback(self):
+        result, status_code = handle_mpesa_callback(self._json_body())
+        self._send_response(result, status_code)
+    
+    def handle_mpesa_status(self, checkout_request_id):
+        result, status_code = check_transaction_status(checkout_request_id)
+        self._send_response(result, status_code)
+
+# Slow requests are reported by the router timing hook
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS") or 1.0)
 
-def run(server_class=http.server.HTTPServer, handler_class=APIHandler, port=8000):
+def log_slow_request(method, pattern, elapsed):
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        log.warning("Slow request: %s %s took %.0f ms", method, pattern, elapsed * 1000)
+
+# Route table - patterns are compiled once at import time
+router = Router()
+router.add('GET', '/placeholder.svg', APIHandler.serve_placeholder)
+router.add('GET', '/static/<path:file_path>', APIHandler.serve_static)
+router.add('GET', '/api/artworks', APIHandler.handle_get_artworks)
+router.add('POST', '/api/artworks', APIHandler.handle_create_artwork)
+router.add('GET', '/api/artworks/<int:artwork_id>', APIHandler.handle_get_artwork)
+router.add('PUT', '/api/artworks/<int:artwork_id>', APIHandler.handle_update_artwork)
+router.add('DELETE', '/api/artworks/<int:artwork_id>', APIHandler.handle_delete_artwork)
+router.add('GET', '/api/exhibitions', APIHandler.handle_get_exhibitions)
+router.add('POST', '/api/exhibitions', APIHandler.handle_create_exhibition)
+router.add('GET', '/api/exhibitions/<int:exhibition_id>', APIHandler.handle_get_exhibition)
+router.add('GET', '/api/tickets', APIHandler.handle_get_tickets)
+router.add('GET', '/api/orders', APIHandler.handle_get_orders)
+router.add('GET', '/api/users/<int:user_id>/orders', APIHandler.handle_get_user_orders)
+router.add('GET', '/api/messages', APIHandler.handle_get_messages)
+router.add('POST', '/api/messages/<int:message_id>', APIHandler.handle_update_message)
+router.add('PUT', '/api/messages/<int:message_id>', APIHandler.handle_update_message)
+router.add('POST', '/api/register', APIHandler.handle_register)
+router.add('POST', '/api/login', limited(APIHandler.handle_login, LOGIN_BY_IP, LOGIN_BY_EMAIL))
+router.add('POST', '/api/admin-login', limited(APIHandler.handle_admin_login, LOGIN_BY_IP, LOGIN_BY_EMAIL))
+router.add('POST', '/api/contact', limited(APIHandler.handle_contact, CONTACT_BY_IP))
+router.add('POST', '/api/uploads', APIHandler.handle_upload)
+router.add('POST', '/api/mpesa/stkpush', limited(APIHandler.handle_stk_push, STK_PUSH_BY_IP))
+router.add('POST', '/api/mpesa/callback', APIHandler.handle_mpesa_callback)
+router.add('GET', '/api/mpesa/status/<checkout_request_id>', APIHandler.handle_mpesa_status)
+router.add_timing_hook(log_slow_request)
+
+def run(server_class=PooledHTTPServer, handler_class=APIHandler, port=8000,
+        workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, engine=SERVER_ENGINE):
     server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f"Starting server on port {port}...")
+    if engine == 'asyncio':
+        httpd = AsyncHTTPServer(server_address, handler_class)
+        log.info("Using asyncio engine with %d executor threads", httpd.workers)
+    elif issubclass(server_class, PooledHTTPServer):
+        httpd = server_class(server_address, handler_class, workers=workers, queue_size=queue_size)
+        log.info("Using %d worker threads with a queue of %d connections", workers, queue_size)
+    else:
+        httpd = server_class(server_address, handler_class)
+    log.info("Starting server on port %d", port)
     try:
         initialize_database()  # Initialize the database on server startup
+        apply_migrations(db)
+        job_queue.start()
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("Server stopped.")
+        log.info("Server stopped")
     except Exception as e:
-        print(f"Server error: {e}")
+        log.exception("Server error")
+    finally:
+        httpd.server_close()
+        job_queue.stop()
+        db.close_all()
+        image_pipeline.shutdown(wait=False)
 
 # This is the main entry point for the script
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+
+# SQLite tuning (can be overridden from the environment)
+SQLITE_CONFIG = {
+    'journal_mode': os.getenv("SQLITE_JOURNAL_MODE") or 'WAL',
+    'synchronous': os.getenv("SQLITE_SYNCHRONOUS") or 'NORMAL',
+    'busy_timeout': float(os.getenv("SQLITE_BUSY_TIMEOUT") or 5),  # seconds
+    'cached_statements': int(os.getenv("SQLITE_CACHED_STATEMENTS") or 256),
+}
+
+class PersistentConnection(sqlite3.Connection):
+    """SQLite connection that survives close() so its thread can reuse it.
+
+    close() only rolls back an unfinished transaction, which keeps existing
+    `finally: conn.close()` blocks correct. Use really_close() to close the
+    underlying database handle.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+class ThreadLocalConnections:
+    """Hands every thread its own long-lived, tuned SQLite connection.
+
+    Reusing the connection keeps sqlite3's prepared statement cache warm
+    and avoids re-opening the file on every request. WAL journaling lets
+    readers run while another thread is writing.
+    """
+
+    def __init__(self, database_file, journal_mode='WAL', synchronous='NORMAL',
+                 busy_timeout=5, cached_statements=256):
+        self.database_file = database_file
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.database_file,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            factory=PersistentConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def get(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = self._open()
+            self._local.connection = conn
+        return conn
+
+    def close_all(self):
+        """Close every connection opened so far (call on shutdown)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.really_close()
+            except sqlite3.ProgrammingError:
+                # Connections can only be closed from the thread that owns them
+                pass
+        self._local = threading.local()
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def get_thread_connections(database_file):
+    """Return the process-wide ThreadLocalConnections for a database file"""
+    key = os.path.abspath(database_file)
+    with _shared_lock:
+        connections = _shared.get(key)
+        if connections is None:
+            connections = ThreadLocalConnections(database_file, **SQLITE_CONFIG)
+            _shared[key] = connections
+    return connections
@@ -0,0 +1,113 @@
+import os
+import re
+import socket
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+CONTENT_ROOT = os.path.join(STATIC_ROOT, "uploads", "cas")
+
+# Cache lifetimes: files in the content-addressed image store never change
+# under the same name, so they can be cached for a year; other static files
+# are revalidated hourly
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE") or 3600)
+STATIC_UPLOADS_MAX_AGE = int(os.getenv("STATIC_UPLOADS_MAX_AGE") or 31536000)
+
+# Block size for the copy fallback when the connection is not a plain socket
+STATIC_CHUNK_SIZE = 256 * 1024
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file"""
+
+def resolve_static_path(relative_path, root=STATIC_ROOT):
+    """Map a URL path below /static to a file, or None if it escapes the root"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, relative_path.lstrip('/')))
+    if path != root and path.startswith(root + os.sep):
+        return path
+    return None
+
+def content_type_for(path):
+    content_type, _ = mimetypes.guess_type(path)
+    return content_type or 'application/octet-stream'
+
+def cache_control_for(path):
+    if path.startswith(CONTENT_ROOT + os.sep):
+        return f"public, max-age={STATIC_UPLOADS_MAX_AGE}, immutable"
+    return f"public, max-age={STATIC_MAX_AGE}"
+
+def file_etag(stat):
+    """Strong ETag from the file's modification time and size"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def is_not_modified(headers, etag, mtime):
+    """Evaluate If-None-Match, or If-Modified-Since when no ETag was sent"""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        if if_none_match.strip() == '*':
+            return True
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in tags)
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(mtime) <= since
+    return False
+
+def parse_range(headers, size, etag, mtime):
+    """Return (start, end) for a single satisfiable byte range, or None for the whole file.
+
+    Multiple ranges and malformed headers are ignored (the whole file is sent).
+    Raises RangeNotSatisfiable when the range starts past the end of the file.
+    """
+    header = headers.get('Range')
+    if not header:
+        return None
+    if_range = headers.get('If-Range')
+    if if_range and if_range.strip() not in (etag, formatdate(mtime, usegmt=True)):
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+def send_file_range(connection, wfile, file, offset, count):
+    """Write count bytes of file starting at offset to the client.
+
+    Plain sockets use socket.sendfile (os.sendfile, zero copy); anything else,
+    such as the asyncio engine's writer, gets the file in blocks.
+    """
+    if isinstance(connection, socket.socket):
+        wfile.flush()
+        connection.sendfile(file, offset, count)
+        return
+    file.seek(offset)
+    remaining = count
+    buffer = bytearray(min(STATIC_CHUNK_SIZE, max(count, 1)))
+    view = memoryview(buffer)
+    while remaining > 0:
+        read = file.readinto(view[:min(len(buffer), remaining)])
+        if not read:
+            break
+        wfile.write(view[:read])
+        remaining -= read
@@ -0,0 +1,79 @@
+import json
+import pytest
+import cache
+from cache import TTLCache, make_etag, etag_matches, cached_response, invalidate_catalog
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(cache, 'catalog_cache', TTLCache(ttl=60))
+    monkeypatch.setattr(cache, 'response_cache', TTLCache(ttl=60))
+
+def test_etag_is_strong_and_versioned():
+    etag = make_etag(b'{"artworks":[]}', version='v1')
+    assert etag.startswith('"v1-') and etag.endswith('"')
+    assert make_etag(b'{"artworks":[]}', version='v1') == etag
+    assert make_etag(b'{"artworks":[1]}', version='v1') != etag
+    assert make_etag(b'{"artworks":[]}', version='v2') != etag
+
+@pytest.mark.parametrize('header, expected', [
+    ('"v1-abc"', True),
+    ('W/"v1-abc"', True),
+    ('"other", "v1-abc"', True),
+    ('*', True),
+    ('"v1-abd"', False),
+    ('', False),
+    (None, False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"v1-abc"') is expected
+
+def test_cached_response_encodes_once():
+    calls = []
+
+    def render():
+        calls.append(1)
+        return {"artworks": [{"id": 1}]}, 200
+
+    first = cached_response(('artworks',), render)
+    second = cached_response(('artworks',), render)
+    assert second is first and len(calls) == 1
+    assert json.loads(first.body) == {"artworks": [{"id": 1}]}
+    assert first.status == 200 and etag_matches(first.etag, first.etag)
+
+def test_errors_are_not_cached():
+    responses = iter([({"error": "boom"}, 500), ({"artworks": []}, 200)])
+    failed = cached_response(('artworks',), lambda: next(responses))
+    assert failed.status == 500 and failed.etag is None
+    assert cached_response(('artworks',), lambda: next(responses)).status == 200
+
+def test_write_changes_the_etag():
+    before = cached_response(('artworks',), lambda: ({"artworks": []}, 200))
+    invalidate_catalog()
+    after = cached_response(('artworks',), lambda: ({"artworks": []}, 200))
+    # Same body, but a client holding the old ETag must not get a 304
+    assert after.body == before.body
+    assert not etag_matches(before.etag, after.etag)
+
+def test_ttl_cache_expiry_and_eviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    entries = TTLCache(max_entries=2, ttl=10)
+    entries.put('a', 1)
+    entries.put('b', 2, ttl=100)
+    assert entries.get('a') == (True, 1)
+    entries.put('c', 3)
+    # 'b' was the least recently used entry
+    assert entries.get('b') == (False, None)
+    now[0] += 11
+    assert entries.get('a') == (False, None)
+    assert entries.stats()['evictions'] == 1 and entries.stats()['expirations'] == 1
+
+def test_load_racing_with_invalidation_is_not_stored():
+    entries = TTLCache(ttl=60)
+
+    def loader():
+        entries.invalidate()
+        return 'stale'
+
+    assert entries.get_or_load('key', loader) == 'stale'
+    assert entries.get('key') == (False, None)
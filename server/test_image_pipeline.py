@@ -0,0 +1,24 @@
+import pytest
+import image_pipeline
+from image_pipeline import generate_variants
+
+Image = pytest.importorskip("PIL.Image")
+
+def test_variants_are_written_without_leftover_temp_files(tmp_path):
+    source = tmp_path / "photo.jpg"
+    Image.new('RGB', (1500, 600), 'teal').save(source, 'JPEG')
+    written = generate_variants(str(source))
+    assert sorted(written) == ['medium', 'mediumWebp', 'thumbnail', 'thumbnailWebp', 'webp']
+    with Image.open(written['thumbnail']) as thumbnail:
+        assert thumbnail.format == 'JPEG' and thumbnail.size == (320, 128)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'photo.jpg', 'photo.webp', 'photo_medium.jpg', 'photo_medium.webp',
+        'photo_thumbnail.jpg', 'photo_thumbnail.webp',
+    ]
+
+def test_failed_save_removes_its_temp_file(tmp_path, monkeypatch):
+    image = Image.new('RGB', (10, 10))
+    monkeypatch.setattr(image_pipeline, 'WEBP_QUALITY', 'not a number')
+    with pytest.raises(Exception):
+        image_pipeline._save(image, str(tmp_path / "a.webp"), 'WEBP')
+    assert list(tmp_path.iterdir()) == []
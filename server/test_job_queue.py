@@ -0,0 +1,138 @@
+import pytest
+import job_queue
+from job_queue import QUEUED, RUNNING, DONE, FAILED, PermanentJobError, IdempotencyConflict
+
+@pytest.fixture(autouse=True)
+def queue(tmp_path, monkeypatch):
+    """A job queue on its own database file, with no handlers registered"""
+    monkeypatch.setattr(job_queue, 'JOB_DB_FILE', str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_queue, '_backend', None)
+    monkeypatch.setattr(job_queue, '_handlers', {})
+    monkeypatch.setattr(job_queue, 'JOB_MAX_ATTEMPTS', 3)
+    yield
+    job_queue._get_backend().close_all()
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(job_queue.time, 'time', lambda: now[0])
+    return now
+
+def test_idempotency_key_returns_the_same_job():
+    job, created = job_queue.enqueue("kind", {"n": 1}, idempotency_key="k")
+    again, created_again = job_queue.enqueue("kind", {"n": 2}, idempotency_key="k")
+    assert created and not created_again
+    assert again["id"] == job["id"] and again["payload"] == {"n": 1}
+    assert job_queue.enqueue("kind", {"n": 3})[0]["id"] != job["id"]
+
+def test_key_reused_for_another_payload_conflicts():
+    job, _ = job_queue.enqueue("kind", {"n": 1}, idempotency_key="k", match_payload=True)
+    assert job_queue.enqueue("kind", {"n": 1}, idempotency_key="k", match_payload=True)[0]["id"] == job["id"]
+    for kind, payload in (("kind", {"n": 2}), ("other", {"n": 1})):
+        with pytest.raises(IdempotencyConflict):
+            job_queue.enqueue(kind, payload, idempotency_key="k", match_payload=True)
+    assert job_queue.stats() == {QUEUED: 1}
+
+def test_finished_job_is_not_reused_for_derived_keys():
+    @job_queue.handler("kind")
+    def run(payload, job_id):
+        return "ok"
+
+    job, _ = job_queue.enqueue("kind", {}, idempotency_key="k", reuse_finished=False)
+    # Still queued: the same job is returned
+    assert job_queue.enqueue("kind", {}, idempotency_key="k", reuse_finished=False)[0]["id"] == job["id"]
+    job_queue.run_job(job_queue.claim())
+    second, created = job_queue.enqueue("kind", {}, idempotency_key="k", reuse_finished=False)
+    assert created and second["id"] != job["id"]
+    assert job_queue.get_job(job["id"])["status"] == DONE
+    # A client-chosen key keeps pointing at the finished job
+    job_queue.run_job(job_queue.claim())
+    assert job_queue.enqueue("kind", {}, idempotency_key="k")[0]["id"] == second["id"]
+
+def test_failed_job_is_requeued_under_its_key():
+    job, _ = job_queue.enqueue("unknown", {}, idempotency_key="k")
+    job_queue.run_job(job_queue.claim())
+    assert job_queue.get_job(job["id"])["status"] == FAILED
+    again, created = job_queue.enqueue("unknown", {"retry": True}, idempotency_key="k")
+    assert created and again["id"] == job["id"]
+    assert again["status"] == QUEUED and again["attempts"] == 0 and again["payload"] == {"retry": True}
+
+def test_claim_leases_one_job_at_a_time(clock):
+    job_queue.enqueue("kind", {})
+    job = job_queue.claim()
+    assert job["status"] == RUNNING and job["attempts"] == 1
+    assert job["locked_until"] == clock[0] + job_queue.JOB_LEASE_SECONDS
+    assert job_queue.claim() is None
+    # The worker died: the job is handed out again once its lease runs out
+    clock[0] += job_queue.JOB_LEASE_SECONDS
+    again = job_queue.claim()
+    assert again["id"] == job["id"] and again["attempts"] == 2
+
+def test_retry_with_backoff_then_give_up(clock):
+    calls = []
+
+    @job_queue.handler("flaky")
+    def run(payload, job_id):
+        calls.append(job_id)
+        raise RuntimeError("gateway timeout")
+
+    job, _ = job_queue.enqueue("flaky", {})
+    job_queue.run_job(job_queue.claim())
+    stored = job_queue.get_job(job["id"])
+    assert stored["status"] == QUEUED and stored["last_error"] == "gateway timeout"
+    assert clock[0] + job_queue.JOB_RETRY_BASE / 2 <= stored["run_after"] <= clock[0] + job_queue.JOB_RETRY_BASE
+    # Not due until the backoff has passed
+    assert job_queue.claim() is None
+    for _ in range(job_queue.JOB_MAX_ATTEMPTS - 1):
+        clock[0] += job_queue.JOB_RETRY_MAX
+        job_queue.run_job(job_queue.claim())
+    assert len(calls) == job_queue.JOB_MAX_ATTEMPTS
+    assert job_queue.get_job(job["id"])["status"] == FAILED
+    clock[0] += job_queue.JOB_RETRY_MAX
+    assert job_queue.claim() is None
+
+def test_permanent_error_is_not_retried():
+    @job_queue.handler("kind")
+    def run(payload, job_id):
+        raise PermanentJobError("User not found")
+
+    job, _ = job_queue.enqueue("kind", {})
+    job_queue.run_job(job_queue.claim())
+    stored = job_queue.get_job(job["id"])
+    assert stored["status"] == FAILED and stored["attempts"] == 1 and stored["last_error"] == "User not found"
+
+def test_result_is_stored():
+    @job_queue.handler("kind")
+    def run(payload, job_id):
+        return {"echo": payload["value"], "job_id": job_id}
+
+    job, _ = job_queue.enqueue("kind", {"value": 7})
+    job_queue.run_job(job_queue.claim())
+    stored = job_queue.get_job(job["id"])
+    assert stored["status"] == DONE and stored["result"] == {"echo": 7, "job_id": job["id"]}
+
+def test_outcome_is_discarded_after_losing_the_lease(clock):
+    job_queue.enqueue("kind", {})
+    stale = job_queue.claim()
+    clock[0] += job_queue.JOB_LEASE_SECONDS
+    current = job_queue.claim()
+    # The first worker finishing late must not overwrite the running attempt
+    assert job_queue._finish(stale, DONE, result="late") is False
+    assert job_queue.get_job(current["id"])["status"] == RUNNING
+    assert job_queue._finish(current, DONE, result="ok") is True
+    assert job_queue.get_job(current["id"])["result"] == "ok"
+
+def test_retry_delay_is_jittered_and_capped():
+    for attempts in range(1, 20):
+        ceiling = min(job_queue.JOB_RETRY_BASE * 2 ** (attempts - 1), job_queue.JOB_RETRY_MAX)
+        assert ceiling / 2 <= job_queue.retry_delay(attempts) <= ceiling
+
+def test_purge_removes_old_finished_jobs(clock):
+    old, _ = job_queue.enqueue("unknown", {})
+    job_queue.run_job(job_queue.claim())
+    pending, _ = job_queue.enqueue("unknown", {})
+    clock[0] += 10
+    assert job_queue.purge(older_than=5) == 1
+    assert job_queue.get_job(old["id"]) is None
+    assert job_queue.stats() == {QUEUED: 1}
+    assert job_queue.get_job(pending["id"]) is not None
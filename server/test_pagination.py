@@ -0,0 +1,112 @@
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from db_backend import SQLiteBackend
+from pagination import (
+    PaginationError, MAX_PAGE_SIZE, parse_query_params, encode_cursor, decode_cursor,
+    build_listing_query, finish_page, is_paged,
+)
+
+LISTING = {
+    'id': ('id', 'id'),
+    'sorts': {
+        'newest': ('id', 'id', 'desc'),
+        'price_asc': ('price', 'price', 'asc'),
+        'price_desc': ('price', 'price', 'desc'),
+    },
+    'default_sort': 'newest',
+    'filters': {
+        'artist': ('artist', '='),
+        'min_price': ('price', '>='),
+    },
+}
+
+def test_cursor_round_trip():
+    cursor = encode_cursor('price_asc', Decimal('12.50'), 7)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == ('price_asc', '12.50', 7)
+    stamp = datetime(2024, 5, 1, 12, 30)
+    assert decode_cursor(encode_cursor('newest', stamp, 3)) == ('newest', '2024-05-01 12:30:00', 3)
+
+@pytest.mark.parametrize('cursor', ['not-base64!', 'e30', encode_cursor('a', 1, 2)[:-3]])
+def test_invalid_cursor(cursor):
+    with pytest.raises(PaginationError):
+        decode_cursor(cursor)
+
+def test_parse_query_params_keeps_last_value():
+    assert parse_query_params('limit=5&sort=price_asc&limit=10') == {'limit': '10', 'sort': 'price_asc'}
+
+def test_is_paged():
+    assert is_paged({'limit': '5'}) and is_paged({'cursor': 'x'})
+    assert not is_paged({'sort': 'newest'})
+
+def test_keyset_predicate_and_order():
+    cursor = encode_cursor('price_asc', 10, 4)
+    query, args, page = build_listing_query("SELECT * FROM artworks", LISTING,
+                                            {'sort': 'price_asc', 'artist': 'A', 'cursor': cursor, 'limit': '2'})
+    assert "WHERE artist = %s AND (price > %s OR (price = %s AND id > %s))" in query
+    assert query.endswith("ORDER BY price ASC, id ASC\nLIMIT %s")
+    assert args == ('A', 10, 10, 4, 3)
+    assert page == {'limit': 2, 'sort': 'price_asc', 'sort_key': 'price', 'id_key': 'id'}
+
+def test_sorting_by_id_uses_a_single_comparison():
+    query, args, _ = build_listing_query("SELECT * FROM artworks", LISTING,
+                                         {'cursor': encode_cursor('newest', 9, 9)}, paged=False)
+    assert "WHERE id < %s" in query and query.endswith("ORDER BY id DESC")
+    assert args == (9,)
+
+@pytest.mark.parametrize('params', [
+    {'sort': 'random'},
+    {'colour': 'red'},
+    {'limit': 'ten'},
+    {'limit': '0'},
+    {'sort': 'price_desc', 'cursor': encode_cursor('price_asc', 1, 1)},
+])
+def test_invalid_parameters(params):
+    with pytest.raises(PaginationError):
+        build_listing_query("SELECT * FROM artworks", LISTING, params)
+
+def test_page_size_is_capped():
+    _, args, page = build_listing_query("SELECT * FROM artworks", LISTING, {'limit': '100000'})
+    assert page['limit'] == MAX_PAGE_SIZE and args == (MAX_PAGE_SIZE + 1,)
+
+def test_finish_page():
+    page = {'limit': 2, 'sort': 'newest', 'sort_key': 'id', 'id_key': 'id'}
+    rows, cursor = finish_page([{'id': 3}, {'id': 2}, {'id': 1}], page)
+    assert rows == [{'id': 3}, {'id': 2}]
+    assert decode_cursor(cursor) == ('newest', 2, 2)
+    assert finish_page([{'id': 1}], page) == ([{'id': 1}], None)
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "pagination.db"))
+    with backend.transaction() as session:
+        session.execute("CREATE TABLE artworks (id INTEGER PRIMARY KEY, artist TEXT, price REAL)")
+        # Many equal prices, so pages must break ties on id
+        session.executemany("INSERT INTO artworks (artist, price) VALUES (%s, %s)",
+                            [('A' if n % 3 else 'B', n % 4) for n in range(23)])
+    yield backend
+    backend.close_all()
+
+def walk(backend, params):
+    seen, cursor = [], None
+    while True:
+        page_params = dict(params, limit='5')
+        if cursor:
+            page_params['cursor'] = cursor
+        query, args, page = build_listing_query("SELECT * FROM artworks", LISTING, page_params)
+        rows, cursor = finish_page(backend.query(query, args), page)
+        assert len(rows) <= 5
+        seen.extend(rows)
+        if cursor is None:
+            return seen
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'sort': 'price_asc'},
+    {'sort': 'price_desc', 'artist': 'A'},
+    {'sort': 'price_asc', 'min_price': '2'},
+])
+def test_keyset_walk_returns_every_row_once_in_order(backend, params):
+    query, args, _ = build_listing_query("SELECT * FROM artworks", LISTING, params, paged=False)
+    assert walk(backend, params) == backend.query(query, args)
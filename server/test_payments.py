@@ -0,0 +1,43 @@
+import pytest
+import job_queue
+import payments
+from payments import queue_stk_push
+
+@pytest.fixture(autouse=True)
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_DB_FILE', str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_queue, '_backend', None)
+    yield
+    job_queue._get_backend().close_all()
+
+def request(**fields):
+    return {"phoneNumber": "254700000000", "amount": 1500, "orderType": "artwork",
+            "orderId": 7, "userId": 1, **fields}
+
+def test_missing_fields_and_bad_order_type():
+    assert queue_stk_push(request(phoneNumber=" ")) == {
+        "error": "Missing required fields: phoneNumber", "status": 400}
+    assert queue_stk_push(request(orderType="poster"))["status"] == 400
+
+def test_repeated_request_shares_the_queued_job():
+    first = queue_stk_push(request())
+    assert first["status"] == "queued" and first["checkout_request_id"].startswith("ws_")
+    assert queue_stk_push(request())["checkout_request_id"] == first["checkout_request_id"]
+    assert queue_stk_push(request(amount=2000))["checkout_request_id"] != first["checkout_request_id"]
+
+def test_client_key_is_scoped_to_the_user():
+    first = queue_stk_push(request(), idempotency_key="abc")
+    assert queue_stk_push(request(), idempotency_key="abc")["checkout_request_id"] == first["checkout_request_id"]
+    # Another user choosing the same key gets their own payment
+    other = queue_stk_push(request(userId=2), idempotency_key="abc")
+    assert other["checkout_request_id"] != first["checkout_request_id"]
+    assert job_queue.get_job(other["checkout_request_id"])["payload"]["userId"] == 2
+
+def test_client_key_reused_for_another_request_is_refused():
+    queue_stk_push(request(), idempotency_key="abc")
+    assert queue_stk_push(request(amount=1), idempotency_key="abc") == {
+        "error": "Idempotency-Key was already used for a different payment request", "status": 422}
+    assert job_queue.stats() == {job_queue.QUEUED: 1}
+
+def test_client_keys_do_not_collide_across_users():
+    assert payments.client_idempotency_key({"userId": "1:a"}, "b") != payments.client_idempotency_key({"userId": "1"}, "a:b")
@@ -0,0 +1,41 @@
+import time
+import socket
+import threading
+import pytest
+from pool_server import wait_for_request
+
+@pytest.fixture
+def pair():
+    server, client = socket.socketpair()
+    with server, client:
+        yield server, client
+
+def wait(server, timeout=15, busy_timeout=15, busy=False):
+    rfile = server.makefile('rb')
+    started = time.monotonic()
+    result = wait_for_request(server, rfile, timeout, busy_timeout, lambda: busy)
+    return result, time.monotonic() - started
+
+def test_closed_peer_is_detected_at_once(pair):
+    server, client = pair
+    client.close()
+    result, elapsed = wait(server)
+    assert result is False and elapsed < 0.5
+
+def test_peer_closing_while_idle(pair):
+    server, client = pair
+    threading.Timer(0.1, client.close).start()
+    result, elapsed = wait(server)
+    assert result is False and elapsed < 1
+
+def test_request_arriving(pair):
+    server, client = pair
+    threading.Timer(0.1, client.sendall, [b"GET / HTTP/1.1\r\n"]).start()
+    assert wait(server)[0] is True
+
+def test_idle_connection_times_out(pair):
+    server, _ = pair
+    assert wait(server, timeout=0.3)[0] is False
+    # Sooner when other connections are waiting for a worker
+    result, elapsed = wait(server, busy_timeout=0.2, busy=True)
+    assert result is False and elapsed < 1
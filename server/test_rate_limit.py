@@ -0,0 +1,99 @@
+import json
+import pytest
+import rate_limit
+from rate_limit import RateLimiter, Rule, parse_limit, check, limited, body_field
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_parse_limit():
+    assert parse_limit("10/60") == (10.0, 60.0)
+    assert parse_limit("3") == (3.0, 1.0)
+    for text in ("0/60", "5/0", "x/1"):
+        with pytest.raises(ValueError):
+            parse_limit(text)
+
+def test_burst_then_refill(clock):
+    limiter = RateLimiter("test", "3/60")
+    assert [limiter.hit("ip") for _ in range(3)] == [0, 0, 0]
+    # One token comes back every 20 seconds
+    assert limiter.hit("ip") == pytest.approx(20)
+    clock[0] += 5
+    assert limiter.hit("ip") == pytest.approx(15)
+    clock[0] += 15
+    assert limiter.hit("ip") == 0
+    assert limiter.hit("ip") == pytest.approx(20)
+    assert limiter.stats()["rejected"] == 3
+
+def test_keys_are_independent(clock):
+    limiter = RateLimiter("test", "1/60")
+    assert limiter.hit("a") == 0
+    assert limiter.hit("a") > 0
+    assert limiter.hit("b") == 0
+
+def test_full_shard_evicts_least_recently_used(clock):
+    limiter = RateLimiter("test", "1/60", max_keys=2, shards=1)
+    limiter.hit("a")
+    limiter.hit("b")
+    limiter.hit("a")        # refused, but "a" is now the most recent key
+    limiter.hit("c")        # evicts "b"
+    assert limiter.stats()["keys"] == 2
+    assert limiter.hit("a") > 0
+    assert limiter.hit("b") == 0
+
+def test_sweep_drops_refilled_buckets(clock):
+    limiter = RateLimiter("test", "2/10", shards=1)
+    limiter.hit("idle")
+    clock[0] += rate_limit.RATE_LIMIT_SWEEP_INTERVAL
+    limiter.hit("busy")
+    assert limiter.stats()["keys"] == 1
+
+class FakeHandler:
+    def __init__(self, ip, body):
+        self.client_address = (ip, 5000)
+        self.headers = {}
+        self._body = body
+        self._body_cache = None
+        self._last_request = False
+        self.sent = None
+
+    def _json_body(self):
+        self._body_cache = self._body
+        return self._body
+
+    def _send_body(self, body, status, headers=None):
+        self.sent = (status, json.loads(body), headers)
+
+def test_ip_rules_are_checked_before_reading_the_body(clock):
+    by_ip = Rule(RateLimiter("ip", "1/60"), rate_limit.client_ip)
+    by_email = Rule(RateLimiter("email", "5/60"), body_field('email'), needs_body=True)
+    assert check(FakeHandler("1.2.3.4", {"email": "A@x "}), [by_email, by_ip]) == 0
+    handler = FakeHandler("1.2.3.4", {"email": "a@x"})
+    assert check(handler, [by_email, by_ip]) > 0
+    assert handler._body_cache is None
+    # Emails are matched case-insensitively; a missing one is not limited
+    assert by_email.limiter.stats()["keys"] == 1
+    assert check(FakeHandler("5.6.7.8", {}), [by_email]) == 0
+
+@pytest.mark.parametrize('body', [[], "a@x", 42, None])
+def test_body_that_is_not_an_object_has_no_key(clock, body):
+    by_email = Rule(RateLimiter("email", "1/60"), body_field('email'), needs_body=True)
+    for _ in range(3):
+        assert check(FakeHandler("1.2.3.4", body), [by_email]) == 0
+    assert by_email.limiter.stats()["keys"] == 0
+
+def test_limited_answers_429_with_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_ENABLED', True)
+    rule = Rule(RateLimiter("ip", "1/90"), rate_limit.client_ip)
+    calls = []
+    route = limited(lambda handler: calls.append(handler), rule)
+    first, second = FakeHandler("9.9.9.9", {}), FakeHandler("9.9.9.9", {})
+    route(first)
+    route(second)
+    assert calls == [first]
+    assert second.sent == (429, {"error": "Too many requests, try again later"}, {'Retry-After': '90'})
+    # The body was never read, so the connection is not reused
+    assert second._last_request is True
@@ -0,0 +1,77 @@
+import pytest
+from router import Router
+
+def handler(name):
+    def run(target, **params):
+        target.append((name, params))
+    return run
+
+@pytest.fixture
+def router():
+    router = Router()
+    router.add('GET', '/api/artworks', handler('list'))
+    router.add('POST', '/api/artworks', handler('create'))
+    router.add('GET', '/api/artworks/<int:artwork_id>', handler('get'))
+    router.add('GET', '/api/artworks/featured', handler('featured'))
+    router.add('GET', '/api/users/<user_id>/orders', handler('user_orders'))
+    router.add('GET', '/api/mpesa/status/<checkout_request_id>', handler('status'))
+    router.add('GET', '/static/<path:file_path>', handler('static'))
+    return router
+
+def test_static_route(router):
+    func, params, pattern, allowed = router.resolve('GET', '/api/artworks')
+    assert params == {} and pattern == '/api/artworks' and allowed == ()
+    # A trailing slash matches the same route
+    assert router.resolve('GET', '/api/artworks/')[2] == '/api/artworks'
+
+def test_int_parameter_is_converted(router):
+    _, params, pattern, _ = router.resolve('GET', '/api/artworks/42')
+    assert params == {'artwork_id': 42}
+    assert pattern == '/api/artworks/<int:artwork_id>'
+
+def test_literal_segment_wins_over_parameter(router):
+    assert router.resolve('GET', '/api/artworks/featured')[2] == '/api/artworks/featured'
+
+def test_int_parameter_rejects_other_values(router):
+    assert router.resolve('GET', '/api/artworks/abc') == (None, None, None, ())
+
+def test_str_parameter_in_the_middle(router):
+    _, params, _, _ = router.resolve('GET', '/api/users/7/orders')
+    assert params == {'user_id': '7'}
+
+def test_empty_segment_does_not_match_parameter(router):
+    assert router.resolve('GET', '/api/mpesa/status/')[0] is None
+
+def test_path_parameter_takes_the_rest(router):
+    _, params, _, _ = router.resolve('GET', '/static/uploads/thumbs/a.webp')
+    assert params == {'file_path': 'uploads/thumbs/a.webp'}
+
+def test_method_not_allowed_lists_methods(router):
+    func, params, pattern, allowed = router.resolve('DELETE', '/api/artworks')
+    assert func is None and pattern == '/api/artworks'
+    assert allowed == ('GET', 'POST')
+
+def test_head_falls_back_to_get(router):
+    assert router.resolve('HEAD', '/api/artworks/1')[0] is not None
+
+def test_unknown_path(router):
+    assert router.resolve('GET', '/api/nothing') == (None, None, None, ())
+
+def test_dispatch_calls_handler_and_timing_hooks(router):
+    timings = []
+    router.add_timing_hook(lambda method, pattern, elapsed: timings.append((method, pattern)))
+    calls = []
+    assert router.dispatch(calls, 'GET', '/api/artworks/5') == (True, ())
+    assert calls == [('get', {'artwork_id': 5})]
+    assert timings == [('GET', '/api/artworks/<int:artwork_id>')]
+    assert router.dispatch(calls, 'PUT', '/api/artworks') == (False, ('GET', 'POST'))
+
+def test_invalid_routes_are_rejected():
+    router = Router()
+    router.add('GET', '/a/<int:id>', handler('a'))
+    with pytest.raises(ValueError):
+        router.add('GET', '/a/<int:id>', handler('again'))
+    with pytest.raises(ValueError):
+        router.add('GET', '/b/<float:x>', handler('b'))
+    with pytest.raises(ValueError):
+        router.add('GET', '/c/<path:rest>/d', handler('c'))
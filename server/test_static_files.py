@@ -0,0 +1,92 @@
+import io
+import os
+import socket
+from email.utils import formatdate
+import pytest
+from static_files import (
+    RangeNotSatisfiable, parse_range, is_not_modified, resolve_static_path, send_file_range,
+)
+
+ETAG = '"5f1-400"'
+MTIME = 1700000000
+
+def byte_range(header, size=1000, **headers):
+    return parse_range({'Range': header, **headers}, size, ETAG, MTIME)
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=990-5000', (990, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=999-999', (999, 999)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert byte_range(header) == expected
+
+@pytest.mark.parametrize('header', [
+    'bytes=0-1,5-6',    # multiple ranges: whole file
+    'bytes=-',
+    'bytes=50-10',
+    'items=0-10',
+    'bytes=a-b',
+])
+def test_ignored_ranges(header):
+    assert byte_range(header) is None
+
+def test_no_range_header():
+    assert parse_range({}, 1000, ETAG, MTIME) is None
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=5000-6000', 'bytes=-0'])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        byte_range(header)
+
+def test_if_range():
+    assert byte_range('bytes=0-9', **{'If-Range': ETAG}) == (0, 9)
+    assert byte_range('bytes=0-9', **{'If-Range': formatdate(MTIME, usegmt=True)}) == (0, 9)
+    # The file changed since the client's copy: send all of it
+    assert byte_range('bytes=0-9', **{'If-Range': '"old"'}) is None
+
+@pytest.mark.parametrize('headers, expected', [
+    ({'If-None-Match': ETAG}, True),
+    ({'If-None-Match': f'"x", W/{ETAG}'}, True),
+    ({'If-None-Match': '"x"', 'If-Modified-Since': formatdate(MTIME + 60, usegmt=True)}, False),
+    ({'If-Modified-Since': formatdate(MTIME, usegmt=True)}, True),
+    ({'If-Modified-Since': formatdate(MTIME - 60, usegmt=True)}, False),
+    ({'If-Modified-Since': 'yesterday'}, False),
+    ({}, False),
+])
+def test_is_not_modified(headers, expected):
+    assert is_not_modified(headers, ETAG, MTIME) is expected
+
+def test_resolve_static_path_stays_in_root(tmp_path):
+    (tmp_path / "uploads").mkdir()
+    (tmp_path / "uploads" / "a.png").write_bytes(b"x")
+    assert resolve_static_path("uploads/a.png", root=str(tmp_path)) == str(tmp_path / "uploads" / "a.png")
+    assert resolve_static_path("../secret", root=str(tmp_path)) is None
+    assert resolve_static_path("uploads/../../secret", root=str(tmp_path)) is None
+    assert resolve_static_path("", root=str(tmp_path)) is None
+
+def test_send_file_range_copies_when_not_a_socket(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(3000))
+    out = io.BytesIO()
+    with open(path, 'rb') as file:
+        send_file_range(None, out, file, 100, 2500)
+    assert out.getvalue() == path.read_bytes()[100:2600]
+
+def test_send_file_range_uses_sendfile_on_sockets(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(3000))
+    server, client = socket.socketpair()
+    with server, client, open(path, 'rb') as file:
+        wfile = server.makefile('wb')
+        wfile.write(b"HEAD")
+        send_file_range(server, wfile, file, 10, 20)
+        # Buffered headers are flushed before the file data
+        received = b''
+        while len(received) < 24:
+            received += client.recv(1024)
+        wfile.close()
+    assert received == b"HEAD" + path.read_bytes()[10:30]
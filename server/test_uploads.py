@@ -0,0 +1,100 @@
+import io
+import hashlib
+import pytest
+import image_store
+import uploads
+from uploads import UploadError, receive_upload, sniff_image_type
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+BOUNDARY = 'xYz-boundary-42'
+
+def multipart(*parts, boundary=BOUNDARY):
+    """Encode (headers, content) parts as a multipart/form-data body"""
+    body = b'preamble\r\n'
+    for headers, content in parts:
+        body += f'--{boundary}\r\n{headers}\r\n\r\n'.encode() + content + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode()
+
+FILE_HEADERS = 'Content-Disposition: form-data; name="image"; filename="a.png"\r\nContent-Type: image/png'
+FIELD_HEADERS = 'Content-Disposition: form-data; name="title"'
+
+class TrickleFile(io.BytesIO):
+    """Returns at most `step` bytes per read, to split boundaries across reads"""
+
+    def __init__(self, data, step):
+        super().__init__(data)
+        self.step = step
+
+    def read(self, size=-1):
+        return super().read(min(size, self.step) if size >= 0 else self.step)
+
+def file_content(body, step=uploads.UPLOAD_CHUNK_SIZE):
+    reader = uploads._BodyReader(TrickleFile(body, step), len(body))
+    return b''.join(uploads._multipart_file_chunks(reader, BOUNDARY.encode()))
+
+@pytest.mark.parametrize('step', [1, 7, len(BOUNDARY) + 3, 4096])
+def test_file_part_is_extracted_for_any_read_size(step):
+    content = PNG + b'\r\n--xYz-not-the-boundary' + PNG
+    body = multipart((FIELD_HEADERS, b'Sunset'), (FILE_HEADERS, content), (FIELD_HEADERS, b'after'))
+    assert file_content(body, step) == content
+
+def test_empty_file_part():
+    assert file_content(multipart((FILE_HEADERS, b''))) == b''
+
+@pytest.mark.parametrize('body, message', [
+    (multipart((FIELD_HEADERS, b'no file')), "No file found"),
+    (multipart((FILE_HEADERS, PNG))[:-40], "unexpected end"),
+    (b'--' + BOUNDARY.encode() + b'\r\n' + b'X' * (uploads.MAX_PART_HEADER_BYTES + 10), "too large"),
+])
+def test_malformed_multipart(body, message):
+    with pytest.raises(UploadError, match=message):
+        file_content(body)
+
+def test_sniff_image_type():
+    assert sniff_image_type(PNG[:16]) == ('image/png', '.png')
+    assert sniff_image_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == ('image/webp', '.webp')
+    assert sniff_image_type(b'<svg xmlns=') is None
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, 'CAS_ROOT', str(tmp_path / 'cas'))
+    return tmp_path
+
+def upload(body, content_type, store):
+    headers = {'Content-Length': str(len(body)), 'Content-Type': content_type}
+    rfile = io.BytesIO(body + b'NEXT REQUEST')
+    result = receive_upload(rfile, headers, upload_dir=str(store / 'tmp'))
+    # The whole body is consumed, and nothing past it
+    assert rfile.read() == b'NEXT REQUEST'
+    return result
+
+def test_receive_multipart_upload(store):
+    body = multipart((FILE_HEADERS, PNG), (FIELD_HEADERS, b'trailing field'))
+    result = upload(body, f'multipart/form-data; boundary="{BOUNDARY}"', store)
+    sha256 = hashlib.sha256(PNG).hexdigest()
+    assert result == {"url": image_store.content_url(sha256, '.png'), "content_type": "image/png",
+                      "size": len(PNG), "sha256": sha256, "created": True}
+    with open(image_store.content_path(sha256, '.png'), 'rb') as file:
+        assert file.read() == PNG
+    # Identical content is stored once
+    assert upload(PNG, 'image/png', store)['created'] is False
+    assert list((store / 'tmp').iterdir()) == []
+
+@pytest.mark.parametrize('body, headers, status', [
+    (b'GIF89a', {}, 411),
+    (b'GIF89a', {'Content-Length': 'many'}, 400),
+    (b'', {'Content-Length': str(uploads.UPLOAD_MAX_BYTES + uploads.MULTIPART_OVERHEAD_BYTES + 1)}, 413),
+    (b'%PDF-1.7 not an image', {'Content-Length': '21'}, 415),
+    (b'', {'Content-Length': '0'}, 400),
+    (b'GIF89a', {'Content-Length': '6', 'Content-Type': 'multipart/form-data'}, 400),
+])
+def test_rejected_uploads(store, body, headers, status):
+    with pytest.raises(UploadError) as error:
+        receive_upload(io.BytesIO(body), headers, upload_dir=str(store / 'tmp'))
+    assert error.value.status_code == status
+    assert not (store / 'cas').exists()
+
+def test_truncated_body(store):
+    with pytest.raises(UploadError, match="ended early"):
+        receive_upload(io.BytesIO(PNG[:100]), {'Content-Length': str(len(PNG))}, upload_dir=str(store / 'tmp'))
+    assert list((store / 'tmp').iterdir()) == []
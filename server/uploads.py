@@ -0,0 +1,194 @@
+import os
+import re
+import hashlib
+import tempfile
+import image_store
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+
+# Largest accepted image; the request body may be a little larger for
+# multipart framing
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES") or 10 * 1024 * 1024)
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_PART_HEADER_BYTES = 16 * 1024
+
+# Accepted image formats, identified by their leading bytes rather than by
+# the client's Content-Type or file name
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', '.png'),
+    (b'GIF87a', 'image/gif', '.gif'),
+    (b'GIF89a', 'image/gif', '.gif'),
+)
+SNIFF_BYTES = 16
+
+BOUNDARY_PATTERN = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+FILENAME_PATTERN = re.compile(rb'filename="?([^";\r\n]*)"?', re.IGNORECASE)
+
+class UploadError(Exception):
+    """An upload was rejected; status_code is the HTTP status to answer with"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def sniff_image_type(head):
+    """Return (content_type, extension) for the image format of head, or None"""
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', '.webp'
+    return None
+
+class _BodyReader:
+    """Reads at most Content-Length bytes of a request body"""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=UPLOAD_CHUNK_SIZE):
+        if self.remaining <= 0:
+            return b''
+        data = self.rfile.read(min(size, self.remaining))
+        if not data:
+            raise UploadError("Request body ended early")
+        self.remaining -= len(data)
+        return data
+
+    def chunks(self):
+        while True:
+            data = self.read()
+            if not data:
+                return
+            yield data
+
+    def drain(self):
+        while self.read():
+            pass
+
+def _multipart_file_chunks(reader, boundary):
+    """Yield the content of the first file part of a multipart/form-data body.
+
+    Only a small window around the boundary is held in memory; everything
+    before it is passed on as soon as it arrives.
+    """
+    delimiter = b'--' + boundary
+    buffer = bytearray()
+
+    def fill():
+        data = reader.read()
+        if not data:
+            raise UploadError("Malformed multipart body: unexpected end of data")
+        buffer.extend(data)
+
+    # Skip the preamble up to the first delimiter
+    while True:
+        index = buffer.find(delimiter)
+        if index >= 0:
+            del buffer[:index + len(delimiter)]
+            break
+        del buffer[:max(len(buffer) - len(delimiter), 0)]
+        fill()
+
+    marker = b'\r\n' + delimiter
+    while True:
+        while len(buffer) < 2:
+            fill()
+        if buffer.startswith(b'--'):
+            raise UploadError("No file found in multipart body")
+        while True:
+            end = buffer.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(buffer) > MAX_PART_HEADER_BYTES:
+                raise UploadError("Multipart part headers too large")
+            fill()
+        part_headers = bytes(buffer[:end])
+        del buffer[:end + 4]
+        is_file = FILENAME_PATTERN.search(part_headers) is not None
+
+        while True:
+            index = buffer.find(marker)
+            if index >= 0:
+                if is_file and index:
+                    yield bytes(buffer[:index])
+                del buffer[:index + len(marker)]
+                break
+            # Keep enough bytes to recognise a marker split across reads
+            keep = len(marker) - 1
+            if len(buffer) > keep:
+                if is_file:
+                    yield bytes(buffer[:-keep])
+                del buffer[:-keep]
+            fill()
+        if is_file:
+            return
+
+def receive_upload(rfile, headers, upload_dir=UPLOADS_DIR):
+    """Stream an uploaded image from the request body into the image store.
+
+    The body is either the raw image or multipart/form-data with one file
+    part. The image is kept in the content-addressed store, so uploading the
+    same bytes twice stores them once. Returns {"url", "content_type", "size",
+    "sha256", "created"}; raises UploadError.
+    """
+    length = headers.get('Content-Length')
+    if length is None:
+        raise UploadError("Content-Length required", 411)
+    try:
+        length = int(length)
+    except ValueError:
+        raise UploadError("Invalid Content-Length")
+    if length > UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise UploadError(f"Upload exceeds {UPLOAD_MAX_BYTES} bytes", 413)
+
+    reader = _BodyReader(rfile, length)
+    content_type = headers.get('Content-Type', '')
+    if content_type.lower().startswith('multipart/form-data'):
+        match = BOUNDARY_PATTERN.search(content_type)
+        if not match:
+            raise UploadError("Missing multipart boundary")
+        chunks = _multipart_file_chunks(reader, match.group(1).encode('latin-1'))
+    else:
+        chunks = reader.chunks()
+
+    try:
+        result = _write_upload(chunks, upload_dir)
+    finally:
+        chunks.close()
+    # Consume anything after the file part so the connection can be reused
+    reader.drain()
+    return result
+
+def _write_upload(chunks, upload_dir):
+    os.makedirs(upload_dir, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=upload_dir, prefix='.upload-')
+    try:
+        size = 0
+        head = bytearray()
+        digest = hashlib.sha256()
+        with os.fdopen(descriptor, 'wb') as file:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise UploadError(f"Upload exceeds {UPLOAD_MAX_BYTES} bytes", 413)
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                digest.update(chunk)
+                file.write(chunk)
+        if size == 0:
+            raise UploadError("Empty upload")
+        detected = sniff_image_type(bytes(head))
+        if detected is None:
+            raise UploadError("Unsupported image type; expected JPEG, PNG, GIF or WebP", 415)
+        detected_type, extension = detected
+        sha256 = digest.hexdigest()
+        url, created = image_store.store_file(temp_path, sha256, extension)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return {"url": url, "content_type": detected_type, "size": size, "sha256": sha256, "created": created}